@@ -1,12 +1,20 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-import sqlite3
-from datetime import datetime
-from database import Database
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for
+from datetime import datetime, timezone
+from markupsafe import Markup, escape
+from database import (
+    Database, ADMIN_DEAL_SORTS, SEARCH_KINDS, SNIPPET_START, SNIPPET_END, ANALYTICS_GRANULARITIES
+)
+from admin_events import AdminEventHub
 from utils import format_amount, get_trust_rating_display
-from config import DATABASE_PATH, DEAL_STATUS, WEB_HOST, WEB_PORT
+from config import (
+    DEAL_STATUS, WEB_HOST, WEB_PORT, ADMIN_PAGE_SIZE, ADMIN_MAX_PAGE_SIZE, ADMIN_COUNT_LIMIT,
+    ADMIN_QUERY_TIMEOUT, ADMIN_BULK_LIMIT, ADMIN_SEARCH_PAGE_SIZE, ADMIN_SEARCH_MAX_OFFSET,
+    ADMIN_ANALYTICS_MAX_BUCKETS, ADMIN_ANALYTICS_DEFAULT_BUCKETS
+)
 
 app = Flask(__name__)
-db = Database()
+db = Database(query_timeout=ADMIN_QUERY_TIMEOUT)
+event_hub = AdminEventHub(db)
 
 @app.route('/')
 def index():
@@ -16,102 +24,194 @@ def index():
 @app.route('/admin')
 def admin_dashboard():
     """Main admin dashboard"""
-    # Get statistics
-    with sqlite3.connect(DATABASE_PATH) as conn:
-        cursor = conn.cursor()
-        
-        # Total users
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-        
-        # Total deals
-        cursor.execute("SELECT COUNT(*) FROM deals")
-        total_deals = cursor.fetchone()[0]
-        
-        # Pending payments
-        cursor.execute("SELECT COUNT(*) FROM deals WHERE status = ?", (DEAL_STATUS["PAYMENT_PENDING"],))
-        pending_payments = cursor.fetchone()[0]
-        
-        # Open disputes
-        cursor.execute("SELECT COUNT(*) FROM disputes WHERE status = 'open'")
-        open_disputes = cursor.fetchone()[0]
-        
-        # Recent deals
-        cursor.execute("""
-            SELECT d.*, u.username as party_a_username 
-            FROM deals d 
-            JOIN users u ON d.party_a_id = u.user_id 
-            ORDER BY d.created_at DESC 
-            LIMIT 10
-        """)
-        recent_deals = cursor.fetchall()
-    
-    stats = {
-        'total_users': total_users,
-        'total_deals': total_deals,
-        'pending_payments': pending_payments,
-        'open_disputes': open_disputes
-    }
-    
-    return render_template('admin.html', stats=stats, recent_deals=recent_deals, format_amount=format_amount)
+    # Materialized counters, read with the event log position they include
+    stats, last_event_id = db.get_dashboard_stats()
+    recent_deals = db.get_recent_deals(limit=10)
+    
+    return render_template(
+        'admin.html', stats=stats, recent_deals=recent_deals, last_event_id=last_event_id,
+        format_amount=format_amount
+    )
+
+@app.route('/admin/events')
+def admin_events():
+    """Stream dashboard changes as Server-Sent Events"""
+    # Browsers send Last-Event-ID when they reconnect on their own
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    return Response(
+        event_hub.stream(after), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def page_args():
+    """Read the page size and keyset cursor shared by the paginated listings"""
+    try:
+        limit = min(max(int(request.args.get('limit', ADMIN_PAGE_SIZE)), 1), ADMIN_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = ADMIN_PAGE_SIZE
+    cursor = request.args.get('cursor', type=int)
+    backwards = request.args.get('dir') == 'prev'
+    return limit, cursor, backwards
+
+def deal_filter_args():
+    """Read the deal listing filters, dropping values that don't parse"""
+    filters = {}
+    status = request.args.get('status', 'all')
+    if status in DEAL_STATUS.values():
+        filters['status'] = status
+    for name in ('date_from', 'date_to'):
+        try:
+            filters[name] = datetime.strptime(request.args.get(name, ''), '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    for name in ('min_amount', 'max_amount'):
+        value = request.args.get(name, type=float)
+        if value is not None:
+            filters[name] = value
+    username = request.args.get('username', '').strip().lstrip('@')
+    if username:
+        filters['username'] = username
+    return filters
+
+def format_count(count: int) -> str:
+    """Display a capped total"""
+    return f"{ADMIN_COUNT_LIMIT:,}+" if count > ADMIN_COUNT_LIMIT else f"{count:,}"
 
 @app.route('/admin/deals')
 def admin_deals():
-    """View all deals"""
-    status_filter = request.args.get('status', 'all')
+    """View deals one page at a time, filtered and sorted"""
+    limit, cursor, backwards = page_args()
+    filters = deal_filter_args()
+    last_event_id = db.get_admin_event_bounds()[1]
+    sort = request.args.get('sort', 'created_at')
+    if sort not in ADMIN_DEAL_SORTS:
+        sort = 'created_at'
+    order = 'asc' if request.args.get('order') == 'asc' else 'desc'
     
-    with sqlite3.connect(DATABASE_PATH) as conn:
-        cursor = conn.cursor()
-        
-        if status_filter == 'all':
-            cursor.execute("""
-                SELECT d.*, u.username as party_a_username 
-                FROM deals d 
-                JOIN users u ON d.party_a_id = u.user_id 
-                ORDER BY d.created_at DESC
-            """)
-        else:
-            cursor.execute("""
-                SELECT d.*, u.username as party_a_username 
-                FROM deals d 
-                JOIN users u ON d.party_a_id = u.user_id 
-                WHERE d.status = ?
-                ORDER BY d.created_at DESC
-            """, (status_filter,))
-        
-        deals = cursor.fetchall()
+    deals_page = db.get_deals_page(
+        limit, cursor, backwards, sort=sort, descending=order == 'desc', **filters
+    )
+    total = format_count(db.count_deals(**filters))
     
-    return render_template('admin.html', deals=deals, status_filter=status_filter, format_amount=format_amount)
+    # Query arguments that page links carry over
+    query = dict(filters, sort=sort, order=order, limit=limit)
+    
+    return render_template(
+        'admin.html', deals_page=deals_page, total=total, query=query,
+        status_filter=filters.get('status', 'all'), deal_statuses=DEAL_STATUS.values(),
+        last_event_id=last_event_id, format_amount=format_amount
+    )
 
 @app.route('/admin/users')
 def admin_users():
-    """View all users"""
-    with sqlite3.connect(DATABASE_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.*, 
-                   COUNT(d.deal_id) as total_deals,
-                   COUNT(CASE WHEN d.status = 'completed' THEN 1 END) as completed_deals
-            FROM users u 
-            LEFT JOIN deals d ON (u.user_id = d.party_a_id OR u.user_id = d.party_b_id)
-            GROUP BY u.user_id
-            ORDER BY u.created_at DESC
-        """)
-        users = cursor.fetchall()
-    
-    return render_template('admin.html', users=users, get_trust_rating_display=get_trust_rating_display)
+    """View users one page at a time"""
+    limit, cursor, backwards = page_args()
+    username = request.args.get('username', '').strip().lstrip('@') or None
+    
+    users_page = db.get_users_page(limit, cursor, backwards, username=username)
+    total = format_count(db.count_users(username))
+    query = {'limit': limit, 'username': username} if username else {'limit': limit}
+    
+    return render_template(
+        'admin.html', users_page=users_page, total=total, query=query,
+        get_trust_rating_display=get_trust_rating_display
+    )
 
 @app.route('/admin/disputes')
 def admin_disputes():
     """View all disputes"""
+    last_event_id = db.get_admin_event_bounds()[1]
     disputes = db.get_open_disputes()
-    return render_template('admin.html', disputes=disputes, format_amount=format_amount)
+    return render_template(
+        'admin.html', disputes=disputes, last_event_id=last_event_id, format_amount=format_amount
+    )
 
 @app.route('/admin/pending')
 def admin_pending():
     """View pending payment confirmations"""
+    last_event_id = db.get_admin_event_bounds()[1]
     pending_deals = db.get_pending_confirmations()
-    return render_template('admin.html', pending_deals=pending_deals, format_amount=format_amount)
+    return render_template(
+        'admin.html', pending_deals=pending_deals, last_event_id=last_event_id, format_amount=format_amount
+    )
+
+def highlight(snippet: str) -> Markup:
+    """Escape a search snippet and mark its matched words"""
+    return Markup(
+        str(escape(snippet)).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+    )
+
+@app.route('/admin/search')
+def admin_search():
+    """Ranked full-text search across deals, users and disputes"""
+    text = request.args.get('q', '').strip()
+    kind = request.args.get('kind', 'all')
+    if kind not in SEARCH_KINDS:
+        kind = 'all'
+    last_page = ADMIN_SEARCH_MAX_OFFSET // ADMIN_SEARCH_PAGE_SIZE + 1
+    page_number = min(max(request.args.get('page', 1, type=int), 1), last_page)
+    
+    search_page = db.search(
+        text, ADMIN_SEARCH_PAGE_SIZE, (page_number - 1) * ADMIN_SEARCH_PAGE_SIZE,
+        kinds=None if kind == 'all' else [kind]
+    )
+    
+    return render_template(
+        'admin.html', search_page=search_page, query={'q': text, 'kind': kind},
+        page_number=page_number, search_kinds=SEARCH_KINDS, highlight=highlight
+    )
+
+def utc_arg(name: str, default: datetime) -> datetime:
+    """Read an ISO date or time argument as naive UTC, like the database timestamps"""
+    if name not in request.args:
+        return default
+    moment = datetime.fromisoformat(request.args[name])
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+@app.route('/admin/api/analytics')
+def api_analytics():
+    """Deal volume, value, completion, dispute and confirmation figures per hour or day
+    
+    Query arguments: granularity (hour or day), start and end (ISO dates
+    or times, UTC). Each bucket covers the deals created in it.
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ANALYTICS_GRANULARITIES:
+        return jsonify({'success': False, 'message': 'granularity must be hour or day'}), 400
+    width = ANALYTICS_GRANULARITIES[granularity][1]
+    
+    try:
+        end = utc_arg('end', datetime.now(timezone.utc).replace(tzinfo=None))
+        start = utc_arg('start', end - width * (ADMIN_ANALYTICS_DEFAULT_BUCKETS[granularity] - 1))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end must be ISO dates or times'}), 400
+    if start > end:
+        return jsonify({'success': False, 'message': 'start must not be after end'}), 400
+    if (end - start) / width >= ADMIN_ANALYTICS_MAX_BUCKETS:
+        return jsonify({
+            'success': False, 'message': f'At most {ADMIN_ANALYTICS_MAX_BUCKETS} {granularity} buckets per request'
+        }), 400
+    
+    series, total = db.get_analytics(granularity, start, end)
+    
+    def figures(bucket):
+        return dict(
+            bucket._asdict(), amount=round(bucket.amount, 2),
+            completion_rate=bucket.completion_rate, dispute_rate=bucket.dispute_rate
+        )
+    
+    return jsonify({
+        'success': True,
+        'granularity': granularity,
+        'start': series[0].bucket,
+        'end': series[-1].bucket,
+        'buckets': [figures(bucket) for bucket in series],
+        'total': {key: value for key, value in figures(total).items() if key != 'bucket'}
+    })
 
 @app.route('/admin/api/confirm_payment/<int:deal_id>', methods=['POST'])
 def api_confirm_payment(deal_id):
@@ -141,7 +241,7 @@ def api_resolve_dispute(dispute_id):
     resolution = request.json.get('resolution', '')
     
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with db.connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE disputes 
@@ -157,8 +257,83 @@ def api_resolve_dispute(dispute_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+def bulk_ids(key: str):
+    """Read a list of ids from the JSON body, without duplicates; None if it isn't one"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return None
+    ids = payload.get(key)
+    if not isinstance(ids, list) or not ids or len(ids) > ADMIN_BULK_LIMIT:
+        return None
+    if not all(isinstance(item_id, int) and not isinstance(item_id, bool) for item_id in ids):
+        return None
+    return list(dict.fromkeys(ids))
+
+def bulk_response(ids, applied, rejected, done_message: str, noun: str):
+    """Per-item results of a bulk action"""
+    applied = set(applied)
+    results = []
+    for item_id in ids:
+        if item_id in applied:
+            results.append({'id': item_id, 'success': True, 'message': done_message})
+        elif item_id not in rejected:
+            # Could have moved, but an atomic batch was rolled back
+            results.append({'id': item_id, 'success': False, 'message': 'Not applied: other items failed'})
+        elif rejected[item_id] is None:
+            results.append({'id': item_id, 'success': False, 'message': f'{noun} not found'})
+        else:
+            status = rejected[item_id].replace('_', ' ')
+            results.append({'id': item_id, 'success': False, 'message': f'{noun} is {status}'})
+    return jsonify({'success': len(applied) == len(ids), 'applied': len(applied), 'results': results})
+
+@app.route('/admin/api/bulk/confirm_payments', methods=['POST'])
+def api_bulk_confirm_payments():
+    """Confirm payment for a list of deals in one transaction"""
+    deal_ids = bulk_ids('deal_ids')
+    if deal_ids is None:
+        return jsonify({'success': False, 'message': f'deal_ids must be a list of 1 to {ADMIN_BULK_LIMIT} ids'}), 400
+    
+    try:
+        moved, rejected = db.confirm_payments(deal_ids, atomic=bool(request.json.get('atomic')))
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+    return bulk_response(deal_ids, [deal.deal_id for deal in moved], rejected, 'Payment confirmed', 'Deal')
+
+@app.route('/admin/api/bulk/reject_payments', methods=['POST'])
+def api_bulk_reject_payments():
+    """Reject payment and cancel a list of deals in one transaction"""
+    deal_ids = bulk_ids('deal_ids')
+    if deal_ids is None:
+        return jsonify({'success': False, 'message': f'deal_ids must be a list of 1 to {ADMIN_BULK_LIMIT} ids'}), 400
+    
+    try:
+        moved, rejected = db.transition_deals(
+            deal_ids, DEAL_STATUS["CANCELLED"], atomic=bool(request.json.get('atomic'))
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+    return bulk_response(deal_ids, [deal.deal_id for deal in moved], rejected, 'Deal cancelled', 'Deal')
+
+@app.route('/admin/api/bulk/resolve_disputes', methods=['POST'])
+def api_bulk_resolve_disputes():
+    """Resolve a list of disputes with one resolution in one transaction"""
+    dispute_ids = bulk_ids('dispute_ids')
+    if dispute_ids is None:
+        return jsonify({'success': False, 'message': f'dispute_ids must be a list of 1 to {ADMIN_BULK_LIMIT} ids'}), 400
+    resolution = str(request.json.get('resolution', '')).strip()
+    if not resolution:
+        return jsonify({'success': False, 'message': 'A resolution is required'}), 400
+    
+    try:
+        resolved, rejected = db.resolve_disputes(
+            dispute_ids, resolution, atomic=bool(request.json.get('atomic'))
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+    return bulk_response(dispute_ids, resolved, rejected, 'Dispute resolved', 'Dispute')
+
 def run_admin_server():
-    """Run the admin web server"""
+    """Run the admin web server with Flask's development server (see admin_server.py for production)"""
     app.run(host=WEB_HOST, port=WEB_PORT, debug=False)
 
 if __name__ == '__main__':
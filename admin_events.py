@@ -0,0 +1,180 @@
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from database import Database
+from models import AdminEvent
+from config import (
+    DEAL_STATUS, ADMIN_EVENT_POLL_INTERVAL, ADMIN_EVENT_BATCH_SIZE, ADMIN_EVENT_HEARTBEAT,
+    ADMIN_EVENT_QUEUE_SIZE, ADMIN_EVENT_RETENTION
+)
+
+logger = logging.getLogger(__name__)
+
+# Dashboard counters that follow a status: event subject -> (counter, status counted)
+STATUS_COUNTERS = {
+    'deal': ('pending_payments', DEAL_STATUS["PAYMENT_PENDING"]),
+    'dispute': ('open_disputes', 'open'),
+}
+
+# Tells a dashboard it missed events and must reload
+RESET_MESSAGE = "event: reset\ndata: {}\n\n"
+KEEP_ALIVE_MESSAGE = ": keep-alive\n\n"
+
+def counter_deltas(event: AdminEvent) -> Dict[str, int]:
+    """How an event changes the dashboard counters"""
+    deltas = {}
+    if event.kind == 'user_created':
+        deltas['total_users'] = 1
+    elif event.kind == 'deal_created':
+        deltas['total_deals'] = 1
+    
+    subject = event.kind.split('_', 1)[0]
+    if subject in STATUS_COUNTERS:
+        counter, status = STATUS_COUNTERS[subject]
+        delta = (event.new_status == status) - (event.old_status == status)
+        if delta:
+            deltas[counter] = delta
+    return deltas
+
+def format_event(event: AdminEvent) -> str:
+    """Encode an event as one Server-Sent Events message"""
+    payload = dict(event._asdict(), deltas=counter_deltas(event))
+    return f"id: {event.event_id}\nevent: {event.kind}\ndata: {json.dumps(payload)}\n\n"
+
+class Subscription:
+    """One connected dashboard's buffer of encoded events"""
+    
+    def __init__(self, cursor: int, queue_size: int):
+        self.cursor = cursor  # Newest event id not delivered through the queue
+        self.queue = queue.Queue(queue_size)
+        self.overflowed = False
+
+class AdminEventHub:
+    """Fans the admin_events log out to connected dashboards.
+    
+    While at least one dashboard is connected, a single thread reads new
+    events every poll_interval and queues them to every subscriber, so
+    database load follows the rate of change, not the number of open tabs.
+    The thread exits when the last dashboard disconnects. A dashboard that
+    falls more than queue_size events behind is told to reload.
+    """
+    
+    def __init__(self, database: Database, poll_interval: float = ADMIN_EVENT_POLL_INTERVAL,
+                 batch_size: int = ADMIN_EVENT_BATCH_SIZE, heartbeat: float = ADMIN_EVENT_HEARTBEAT,
+                 queue_size: int = ADMIN_EVENT_QUEUE_SIZE, retention: int = ADMIN_EVENT_RETENTION):
+        self.db = database
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._cursor = 0
+        self._since_prune = 0
+    
+    def subscribe(self) -> Subscription:
+        """Register a dashboard, starting the reader thread if it is the first"""
+        with self._lock:
+            if self._thread is None:
+                self.db.prune_admin_events(self.retention)
+                self._cursor = self.db.get_admin_event_bounds()[1]
+                self._since_prune = 0
+                self._thread = threading.Thread(target=self._run, name="admin-events", daemon=True)
+                self._thread.start()
+            subscription = Subscription(self._cursor, self.queue_size)
+            self._subscribers.add(subscription)
+            return subscription
+    
+    def unsubscribe(self, subscription: Subscription):
+        """Forget a dashboard that disconnected"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+    
+    @property
+    def subscribers(self) -> int:
+        """Number of connected dashboards"""
+        return len(self._subscribers)
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+                cursor = self._cursor
+            
+            try:
+                events = self.db.get_admin_events(cursor, self.batch_size)
+            except Exception as e:
+                logger.error(f"Error reading admin events: {e}")
+                events = []
+            
+            if events:
+                messages = [format_event(event) for event in events]
+                with self._lock:
+                    self._cursor = events[-1].event_id
+                    for subscription in list(self._subscribers):
+                        try:
+                            for message in messages:
+                                subscription.queue.put_nowait(message)
+                        except queue.Full:
+                            subscription.overflowed = True
+                            self._subscribers.discard(subscription)
+                
+                self._since_prune += len(events)
+                if self._since_prune >= self.retention:
+                    self._since_prune = 0
+                    try:
+                        self.db.prune_admin_events(self.retention)
+                    except Exception as e:
+                        logger.error(f"Error pruning admin events: {e}")
+            
+            # A full batch means more are waiting: read again straight away
+            if len(events) < self.batch_size:
+                time.sleep(self.poll_interval)
+    
+    def _replay(self, after_event_id: int, until_event_id: int) -> Optional[Iterator[str]]:
+        """Messages for the events a reconnecting dashboard missed, or None if they are gone"""
+        oldest, _ = self.db.get_admin_event_bounds()
+        if after_event_id > until_event_id or (oldest and oldest > after_event_id + 1):
+            return None
+        
+        def messages():
+            cursor = after_event_id
+            while cursor < until_event_id:
+                events = self.db.get_admin_events(cursor, min(self.batch_size, until_event_id - cursor))
+                if not events:
+                    break
+                for event in events:
+                    yield format_event(event)
+                cursor = events[-1].event_id
+        return messages()
+    
+    def stream(self, after_event_id: Optional[int] = None) -> Iterator[str]:
+        """Yield Server-Sent Events messages until the client disconnects
+        
+        Events after after_event_id that the hub already passed are replayed
+        from the log first; without after_event_id the stream starts now.
+        """
+        subscription = self.subscribe()
+        try:
+            if after_event_id is not None and after_event_id != subscription.cursor:
+                replay = self._replay(after_event_id, subscription.cursor)
+                if replay is None:
+                    yield RESET_MESSAGE
+                    return
+                yield from replay
+            
+            while not subscription.overflowed:
+                try:
+                    yield subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield KEEP_ALIVE_MESSAGE
+            yield RESET_MESSAGE
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,115 @@
+"""
+Admin panel serving - gunicorn settings and a supervisor for running the
+admin app in its own process group, so slow admin requests never compete
+with the bot's event loop for the GIL.
+
+The module doubles as gunicorn's configuration file:
+    python -m gunicorn --config python:admin_server admin:app
+"""
+
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from config import (
+    WEB_HOST, WEB_PORT, ADMIN_WORKERS, ADMIN_WORKER_THREADS, ADMIN_KEEPALIVE, ADMIN_WORKER_TIMEOUT,
+    ADMIN_GRACEFUL_TIMEOUT, ADMIN_MAX_REQUESTS, ADMIN_RESTART_DELAY, ADMIN_MAX_RESTART_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+# Gunicorn settings. Threaded workers let live dashboard streams stay open
+# without tying up a whole process each.
+bind = f"{WEB_HOST}:{WEB_PORT}"
+workers = ADMIN_WORKERS
+worker_class = "gthread"
+threads = ADMIN_WORKER_THREADS
+keepalive = ADMIN_KEEPALIVE
+timeout = ADMIN_WORKER_TIMEOUT
+graceful_timeout = ADMIN_GRACEFUL_TIMEOUT
+max_requests = ADMIN_MAX_REQUESTS
+max_requests_jitter = ADMIN_MAX_REQUESTS // 10
+proc_name = "escrow-admin"
+
+def command() -> list:
+    """The command line that serves the admin app with these settings"""
+    return [sys.executable, "-m", "gunicorn", "--config", "python:admin_server", "admin:app"]
+
+class AdminServerProcess:
+    """Runs the admin server as a child process group and restarts it if it dies.
+    
+    Crashes are retried after restart_delay seconds, doubling up to
+    max_restart_delay while the server keeps failing soon after starting.
+    """
+    
+    def __init__(self, restart_delay: float = ADMIN_RESTART_DELAY,
+                 max_restart_delay: float = ADMIN_MAX_RESTART_DELAY):
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.process = None
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start the server and its supervising thread"""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._supervise, name="admin-supervisor", daemon=True)
+        self._thread.start()
+    
+    def _spawn(self) -> bool:
+        with self._lock:
+            if self._stopping.is_set():
+                return False
+            # A new session gives the arbiter and its workers their own process group
+            self.process = subprocess.Popen(command(), cwd=Path(__file__).parent, start_new_session=True)
+            return True
+    
+    def _supervise(self):
+        delay = self.restart_delay
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            try:
+                if not self._spawn():
+                    break
+                code = self.process.wait()
+            except OSError as e:
+                code = e
+            if self._stopping.is_set():
+                break
+            
+            if time.monotonic() - started >= self.max_restart_delay:
+                # It ran fine for a while, so this is a fresh failure
+                delay = self.restart_delay
+            logger.error(f"Admin server exited ({code}), restarting in {delay:.1f}s")
+            self._stopping.wait(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+            self.restarts += 1
+    
+    def stop(self):
+        """Shut the server down, letting in-flight requests finish first"""
+        with self._lock:
+            self._stopping.set()
+            process = self.process
+        if process and process.poll() is None:
+            # SIGTERM makes gunicorn stop its workers gracefully
+            process.terminate()
+            try:
+                process.wait(ADMIN_GRACEFUL_TIMEOUT + 5)
+            except subprocess.TimeoutExpired:
+                logger.warning("Admin server did not stop in time, killing it")
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+        if self._thread:
+            self._thread.join(ADMIN_GRACEFUL_TIMEOUT + 5)
+            self._thread = None
+    
+    @property
+    def running(self) -> bool:
+        """Whether the server process is currently alive"""
+        return self.process is not None and self.process.poll() is None
@@ -1,15 +1,23 @@
 import logging
 import asyncio
+import secrets
 from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, 
-    CallbackQueryHandler, filters
+    CallbackQueryHandler, TypeHandler, filters
 )
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, MAX_CONCURRENT_UPDATES, BOT_RUN_MODE, WEBHOOK_URL, WEBHOOK_HOST,
+    WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, WEBHOOK_RECORD_PATH, STATS_RECONCILE_INTERVAL,
+    ADMIN_EVENT_RETENTION
+)
+from notifications import notifier
+from webhook import WebhookServer
+from update_processor import PerUserUpdateProcessor
 from handlers import (
     start_command, help_command, contact_command, newdeal_command,
-    status_command, admin_command, handle_message, handle_callback_query,
-    error_handler
+    status_command, admin_command, search_command, handle_message, handle_callback_query,
+    error_handler, drop_duplicate_updates, rate_limit_updates, db, user_states, qr_renderer
 )
 
 # Configure logging
@@ -22,11 +30,18 @@ logger = logging.getLogger(__name__)
 class EscrowBot:
     def __init__(self):
         self.application = None
+        self.webhook_server = None
+        self.maintenance_task = None
+        self._stopped = asyncio.Event()
     
     def setup_handlers(self):
         """Setup all command and message handlers"""
         app = self.application
         
+        # Drop redelivered updates, then throttle floods, before any other handler sees them
+        app.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-2)
+        app.add_handler(TypeHandler(Update, rate_limit_updates), group=-1)
+        
         # Command handlers
         app.add_handler(CommandHandler("start", start_command))
         app.add_handler(CommandHandler("help", help_command))
@@ -34,6 +49,7 @@ class EscrowBot:
         app.add_handler(CommandHandler("newdeal", newdeal_command))
         app.add_handler(CommandHandler("status", status_command))
         app.add_handler(CommandHandler("admin", admin_command))
+        app.add_handler(CommandHandler("search", search_command))
         
         # Callback query handler for inline keyboards
         app.add_handler(CallbackQueryHandler(handle_callback_query))
@@ -48,7 +64,12 @@ class EscrowBot:
         """Initialize the bot application"""
         try:
             # Create application
-            self.application = Application.builder().token(BOT_TOKEN).build()
+            self.application = (
+                Application.builder()
+                .token(BOT_TOKEN)
+                .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+                .build()
+            )
             
             # Setup handlers
             self.setup_handlers()
@@ -56,6 +77,12 @@ class EscrowBot:
             # Initialize the application
             await self.application.initialize()
             
+            # Start the outbound notification dispatcher
+            await notifier.start(self.application.bot)
+            
+            if STATS_RECONCILE_INTERVAL > 0:
+                self.maintenance_task = asyncio.create_task(self.run_maintenance())
+            
             logger.info("Bot initialized successfully")
             return True
             
@@ -63,10 +90,35 @@ class EscrowBot:
             logger.error(f"Failed to initialize bot: {e}")
             return False
     
+    async def run_maintenance(self):
+        """Periodically recount the dashboard counters and trim the admin event log"""
+        while True:
+            await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+            try:
+                drift = await db.reconcile_stats()
+                for row in drift:
+                    logger.warning(f"Stats counter {row['name']} drifted: {row['value']} -> {row['actual']}")
+            except Exception as e:
+                logger.error(f"Error reconciling stats: {e}")
+            
+            # Dashboards prune while connected; this bounds the log when none are
+            try:
+                await db.prune_admin_events(ADMIN_EVENT_RETENTION)
+            except Exception as e:
+                logger.error(f"Error pruning admin events: {e}")
+    
+    async def run(self):
+        """Receive updates in the configured BOT_RUN_MODE until stopped"""
+        if BOT_RUN_MODE == "webhook":
+            await self.start_webhook()
+        else:
+            await self.start_polling()
+    
     async def start_polling(self):
         """Start the bot with polling"""
         try:
-            await self.application.start()
+            if not self.application.running:
+                await self.application.start()
             await self.application.updater.start_polling(
                 drop_pending_updates=True,
                 allowed_updates=Update.ALL_TYPES
@@ -75,20 +127,83 @@ class EscrowBot:
             logger.info("Bot started and polling for updates...")
             
             # Keep the bot running
-            await self.application.updater.idle()
+            await self._stopped.wait()
             
         except Exception as e:
             logger.error(f"Error during polling: {e}")
         finally:
             await self.stop()
     
+    async def start_webhook(self):
+        """Start the bot with the embedded webhook server, falling back to polling"""
+        await self.application.start()
+        
+        if not await self.setup_webhook():
+            logger.warning("Webhook unavailable, falling back to polling")
+            await self.start_polling()
+            return
+        
+        try:
+            logger.info("Bot started and receiving updates by webhook...")
+            await self._stopped.wait()
+        finally:
+            await self.stop()
+    
+    async def setup_webhook(self) -> bool:
+        """Start the webhook server and register it with Telegram"""
+        if not WEBHOOK_URL and not WEBHOOK_SECRET_TOKEN:
+            # Without registering the webhook ourselves the sender must already know the secret
+            logger.error("Webhook mode needs WEBHOOK_URL or WEBHOOK_SECRET_TOKEN")
+            return False
+        
+        bot = self.application.bot
+        secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        
+        async def process_update(data):
+            await self.application.update_queue.put(Update.de_json(data, bot))
+        
+        server = WebhookServer(
+            process_update, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+            secret_token=secret_token, record_path=WEBHOOK_RECORD_PATH or None
+        )
+        try:
+            await server.start()
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                    secret_token=secret_token,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True
+                )
+        except Exception as e:
+            logger.error(f"Failed to start webhook: {e}")
+            await server.stop()
+            return False
+        
+        self.webhook_server = server
+        return True
+    
     async def stop(self):
         """Stop the bot gracefully"""
         try:
+            self._stopped.set()
+            if self.maintenance_task:
+                self.maintenance_task.cancel()
+                self.maintenance_task = None
+            if self.webhook_server:
+                await self.webhook_server.stop()
+                self.webhook_server = None
             if self.application:
-                await self.application.updater.stop()
-                await self.application.stop()
+                await notifier.stop()
+                if self.application.updater.running:
+                    await self.application.updater.stop()
+                if self.application.running:
+                    await self.application.stop()
                 await self.application.shutdown()
+            # Flush coalesced writes and pending conversation states before exiting
+            qr_renderer.close()
+            user_states.close()
+            db.close()
             logger.info("Bot stopped successfully")
         except Exception as e:
             logger.error(f"Error stopping bot: {e}")
@@ -99,7 +214,7 @@ async def main():
     
     if await bot.initialize():
         try:
-            await bot.start_polling()
+            await bot.run()
         except KeyboardInterrupt:
             logger.info("Received interrupt signal, stopping bot...")
         except Exception as e:
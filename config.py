@@ -4,7 +4,21 @@ from typing import Dict, Any
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN", "your_bot_token_here")
 ADMIN_USER_ID = os.getenv("ADMIN_USER_ID", "123456789")  # Admin's Telegram user ID
-DATABASE_PATH = "escrow_bot.db"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "escrow_bot.db")
+
+# Database connection tuning
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))  # Max pooled SQLite connections
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")  # WAL lets readers and a writer run concurrently
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # NORMAL is durable enough in WAL mode
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # Wait for locks instead of failing
+DB_ASYNC_WORKERS = int(os.getenv("DB_ASYNC_WORKERS", "4"))  # Threads serving AsyncDatabase calls
+DB_ASYNC_MAX_PENDING = int(os.getenv("DB_ASYNC_MAX_PENDING", "256"))  # AsyncDatabase calls accepted at once; more raise an overload error
+
+# User record cache
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))  # Max cached users
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))  # Seconds before a cached user is re-read
+USER_WRITE_FLUSH_INTERVAL = float(os.getenv("USER_WRITE_FLUSH_INTERVAL", "1.0"))  # Seconds to coalesce /start profile writes
+USER_WRITE_BATCH_SIZE = int(os.getenv("USER_WRITE_BATCH_SIZE", "200"))  # Flush early once this many are queued
 
 # UPI Configuration
 UPI_ID = "Shouryahooda751-2@oksbi"
@@ -17,7 +31,8 @@ COMMANDS = {
     "status": "Check current deal status",
     "contact": "Contact support",
     "help": "Show command list",
-    "admin": "Admin panel (admin only)"
+    "admin": "Admin panel (admin only)",
+    "search": "Search deals, users and disputes (admin only)"
 }
 
 # Deal Status Constants
@@ -31,6 +46,25 @@ DEAL_STATUS = {
     "CANCELLED": "cancelled"
 }
 
+# Conversation state store for multi-step flows (/newdeal, disputes)
+STATE_STORE_BACKEND = os.getenv("STATE_STORE_BACKEND", "sqlite")  # "sqlite" (survives restarts) or "memory"
+STATE_TTL = float(os.getenv("STATE_TTL", "3600"))  # Seconds an idle flow is kept
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))  # Max flows held in memory
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2.0"))  # Seconds between SQLite write-behind flushes
+
+# Outbound notification queue (Telegram allows ~30 msg/s overall, ~1 msg/s per chat)
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))  # Messages per second across all chats
+NOTIFY_GLOBAL_BURST = float(os.getenv("NOTIFY_GLOBAL_BURST", "30"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))  # Messages per second to one chat
+NOTIFY_CHAT_BURST = float(os.getenv("NOTIFY_CHAT_BURST", "3"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "10000"))  # Max queued messages before dropping
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))  # Concurrent sends
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+NOTIFY_RETRY_BASE_DELAY = float(os.getenv("NOTIFY_RETRY_BASE_DELAY", "1.0"))  # Seconds, doubled per retry
+
+# Deals shown per /status page
+STATUS_PAGE_SIZE = 5
+
 # Trust Rating Scale
 TRUST_RATING_SCALE = {
     1: "⭐",
@@ -50,6 +84,79 @@ ANIMATIONS = {
     "waiting": "⏳ Waiting for buyer payment..."
 }
 
+# QR code rendering
+QR_BOX_SIZE = 10  # Pixels per module
+QR_BORDER = 4  # Quiet zone, in modules
+QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))
+QR_MAX_PENDING = int(os.getenv("QR_MAX_PENDING", "32"))  # Renders accepted at once; more are refused
+
+# Admin panel listings
+ADMIN_PAGE_SIZE = 50  # Rows per page by default
+ADMIN_MAX_PAGE_SIZE = 200
+ADMIN_COUNT_LIMIT = 10000  # Totals stop counting here and show as "10,000+"
+ADMIN_COUNT_TTL = 30  # Seconds a listing total is reused
+ADMIN_BULK_LIMIT = 1000  # Ids accepted by one bulk action request
+ADMIN_SEARCH_PAGE_SIZE = 20  # Search hits per page
+ADMIN_SEARCH_MAX_OFFSET = 1000  # Deepest search result reachable by paging; refine the query beyond it
+ADMIN_SEARCH_BOT_RESULTS = 5  # Hits listed by the /search bot command
+ADMIN_ANALYTICS_MAX_BUCKETS = 2000  # Buckets one analytics request may span
+ADMIN_ANALYTICS_DEFAULT_BUCKETS = {"hour": 48, "day": 30}  # Range shown when none is given
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))  # Seconds between recounts of the dashboard counters and admin event log pruning; 0 disables
+
+# Live admin dashboard (Server-Sent Events)
+ADMIN_EVENT_POLL_INTERVAL = float(os.getenv("ADMIN_EVENT_POLL_INTERVAL", "1.0"))  # Seconds between checks for new events while a dashboard is open
+ADMIN_EVENT_BATCH_SIZE = 500  # Events read per check
+ADMIN_EVENT_HEARTBEAT = 15  # Seconds between keep-alive comments on an idle stream
+ADMIN_EVENT_QUEUE_SIZE = 1000  # Events buffered per dashboard before it is told to reload
+ADMIN_EVENT_RETENTION = int(os.getenv("ADMIN_EVENT_RETENTION", "10000"))  # Newest events kept for reconnecting dashboards
+
 # Web server configuration
 WEB_HOST = "0.0.0.0"
 WEB_PORT = 5000
+
+# Admin panel serving: "process" runs it under gunicorn in its own process
+# group beside the bot, "thread" runs Flask's development server inside the
+# bot process, "off" doesn't serve it
+ADMIN_SERVER_MODE = os.getenv("ADMIN_SERVER_MODE", "process")
+ADMIN_WORKERS = int(os.getenv("ADMIN_WORKERS", "2"))  # Worker processes
+ADMIN_WORKER_THREADS = int(os.getenv("ADMIN_WORKER_THREADS", "8"))  # Concurrent requests per worker; each open live dashboard holds one
+ADMIN_KEEPALIVE = int(os.getenv("ADMIN_KEEPALIVE", "5"))  # Seconds an idle keep-alive connection stays open
+ADMIN_WORKER_TIMEOUT = int(os.getenv("ADMIN_WORKER_TIMEOUT", "30"))  # Workers unresponsive this long are killed and replaced
+ADMIN_QUERY_TIMEOUT = float(os.getenv("ADMIN_QUERY_TIMEOUT", "15"))  # Seconds one admin database call may run before it is interrupted
+ADMIN_GRACEFUL_TIMEOUT = int(os.getenv("ADMIN_GRACEFUL_TIMEOUT", "10"))  # Seconds workers get to finish requests on shutdown
+ADMIN_MAX_REQUESTS = int(os.getenv("ADMIN_MAX_REQUESTS", "1000"))  # Requests before a worker is recycled (0 = never)
+ADMIN_RESTART_DELAY = 1.0  # Seconds before restarting a crashed admin server, doubling per crash
+ADMIN_MAX_RESTART_DELAY = 60.0
+
+# Duplicate suppression for redelivered updates and double-tapped buttons
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))  # Recent update ids / button presses remembered
+UPDATE_DEDUP_TTL = float(os.getenv("UPDATE_DEDUP_TTL", "600"))  # Seconds an update id is remembered
+CALLBACK_DEDUP_TTL = float(os.getenv("CALLBACK_DEDUP_TTL", "30"))  # Seconds repeat presses of a deal button are ignored
+
+# Rate limits as (requests, window seconds); admins are exempt
+RATE_LIMIT_USER = (30, 60)  # Any update from one user
+RATE_LIMIT_COMMANDS = {  # Extra budgets for expensive actions, per user
+    "newdeal": (5, 300),
+    "status": (10, 60),
+    "start": (5, 60),
+    "message": (20, 60),  # Free text (deal amount, counterparty, description, dispute reason)
+    "callback": (30, 60)  # Inline keyboard presses
+}
+RATE_LIMIT_GLOBAL = (int(os.getenv("RATE_LIMIT_GLOBAL", "100")), 1)  # All users together, per second
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))  # Counters kept in memory
+RATE_LIMIT_WARNING_INTERVAL = 30  # Seconds between "slow down" replies to one user
+
+# Updates handled at once; each user's updates still run one at a time, in order
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+# Update delivery: "polling" (getUpdates) or "webhook" (embedded HTTP endpoint, falls back to polling on failure)
+BOT_RUN_MODE = os.getenv("BOT_RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public https base URL Telegram posts to; empty = don't register it
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")  # Empty = random token per run
+WEBHOOK_RECORD_PATH = os.getenv("WEBHOOK_RECORD_PATH", "")  # Append received updates here for replay
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", str(1024 * 1024)))  # Bytes
+WEBHOOK_IDLE_TIMEOUT = float(os.getenv("WEBHOOK_IDLE_TIMEOUT", "75"))  # Seconds a keep-alive connection may idle
+WEBHOOK_REQUEST_TIMEOUT = float(os.getenv("WEBHOOK_REQUEST_TIMEOUT", "10"))  # Seconds to receive a request's headers and body
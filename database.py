@@ -1,17 +1,729 @@
 import sqlite3
+import csv
 import json
-from datetime import datetime
-from typing import Optional, List, Dict, Any
-from config import DATABASE_PATH, DEAL_STATUS
+import re
+import queue
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+from cache import LRUCache
+from models import User, Deal, Dispute, TrustRating, AdminEvent, SearchResult, AnalyticsBucket, Page, row_builder
+from config import (
+    DATABASE_PATH, DEAL_STATUS, DB_POOL_SIZE, DB_JOURNAL_MODE,
+    DB_SYNCHRONOUS, DB_BUSY_TIMEOUT_MS, DB_ASYNC_WORKERS, DB_ASYNC_MAX_PENDING,
+    USER_CACHE_SIZE, USER_CACHE_TTL, USER_WRITE_FLUSH_INTERVAL, USER_WRITE_BATCH_SIZE,
+    ADMIN_PAGE_SIZE, ADMIN_COUNT_LIMIT, ADMIN_COUNT_TTL, ADMIN_SEARCH_PAGE_SIZE, ADMIN_SEARCH_MAX_OFFSET
+)
+
+def add_column_if_missing(cursor, table: str, column: str, definition: str):
+    """Idempotent ALTER TABLE ... ADD COLUMN for use in migrations"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# Recompute users.total_deals and successful_deals from the party indexes.
+# A deal counts once per user, even if both parties are the same user.
+DEAL_COUNTERS_BACKFILL_SQL = """
+    UPDATE users SET
+        total_deals = (SELECT COUNT(*) FROM deals WHERE party_a_id = users.user_id)
+            + (SELECT COUNT(*) FROM deals
+               WHERE party_b_id = users.user_id AND party_a_id IS NOT users.user_id),
+        successful_deals = (SELECT COUNT(*) FROM deals
+                            WHERE party_a_id = users.user_id AND status = 'completed')
+            + (SELECT COUNT(*) FROM deals
+               WHERE party_b_id = users.user_id AND party_a_id IS NOT users.user_id
+                 AND status = 'completed')
+"""
+
+# Full-text search rows are keyed by rowid = id * 4 + kind code, so triggers
+# can find a record's entry without an index on the UNINDEXED columns
+SEARCH_KINDS = {'deal': 1, 'user': 2, 'dispute': 3}
+
+def _search_sync_triggers(table: str, kind: str, key: str, columns: str, names: str, content: str) -> list:
+    """Triggers keeping search_index in step with inserts, edits and deletes on table"""
+    rowid = f"{{row}}.{key} * 4 + {SEARCH_KINDS[kind]}"
+    new_rowid, old_rowid = rowid.format(row="NEW"), rowid.format(row="OLD")
+    new_names, new_content = names.format(row="NEW"), content.format(row="NEW")
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS search_{table}_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO search_index (rowid, kind, ref_id, names, content)
+            VALUES ({new_rowid}, '{kind}', NEW.{key}, {new_names}, {new_content});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS search_{table}_update AFTER UPDATE OF {columns} ON {table}
+        BEGIN
+            UPDATE search_index SET names = {new_names}, content = {new_content}
+            WHERE rowid = {new_rowid};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS search_{table}_delete AFTER DELETE ON {table}
+        BEGIN
+            DELETE FROM search_index WHERE rowid = {old_rowid};
+        END
+        """,
+        f"""
+        INSERT INTO search_index (rowid, kind, ref_id, names, content)
+        SELECT {rowid.format(row=table)}, '{kind}', {key}, {names.format(row=table)}, {content.format(row=table)}
+        FROM {table}
+        WHERE {rowid.format(row=table)} NOT IN (SELECT rowid FROM search_index)
+        """,
+    ]
+
+# Markers around matched words in search snippets
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+def fts_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching every word as a prefix; None if no words"""
+    terms = [term.lstrip('@').replace('"', '""') for term in text.split()]
+    terms = [term for term in terms if term]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+# Materialized row counts kept in the stats table: '<table>' and '<table>:<status>'
+STATS_ACTUAL_SQL = """
+    SELECT 'users' AS name, COUNT(*) AS value FROM users
+    UNION ALL SELECT 'deals', COUNT(*) FROM deals
+    UNION ALL SELECT 'deals:' || COALESCE(status, ''), COUNT(*) FROM deals GROUP BY status
+    UNION ALL SELECT 'disputes', COUNT(*) FROM disputes
+    UNION ALL SELECT 'disputes:' || COALESCE(status, ''), COUNT(*) FROM disputes GROUP BY status
+"""
+
+# Dashboard figures and the stats counters behind them
+DASHBOARD_STATS = {
+    'total_users': 'users',
+    'total_deals': 'deals',
+    'pending_payments': f'deals:{DEAL_STATUS["PAYMENT_PENDING"]}',
+    'open_disputes': 'disputes:open',
+}
+
+def _stats_triggers(table: str, with_status: bool = True) -> list:
+    """Triggers keeping table's stats counters in step with inserts, status changes and deletes"""
+    def bump(*counters):
+        values = ', '.join(f"({name}, {delta})" for name, delta in counters)
+        return (
+            f"INSERT INTO stats (name, value) VALUES {values} "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;"
+        )
+    
+    def status(row):
+        return f"'{table}:' || COALESCE({row}.status, '')"
+    
+    total = f"'{table}'"
+    triggers = [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS stats_{table}_insert AFTER INSERT ON {table}
+        BEGIN
+            {bump((total, 1), *([(status('NEW'), 1)] if with_status else []))}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS stats_{table}_delete AFTER DELETE ON {table}
+        BEGIN
+            {bump((total, -1), *([(status('OLD'), -1)] if with_status else []))}
+        END
+        """,
+    ]
+    if with_status:
+        triggers.append(f"""
+        CREATE TRIGGER IF NOT EXISTS stats_{table}_status AFTER UPDATE OF status ON {table}
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            {bump((status('OLD'), -1), (status('NEW'), 1))}
+        END
+        """)
+    return triggers
+
+# Analytics rollup granularities: bucket label format (also valid SQLite
+# strftime) and bucket width. Deals are counted in the bucket they were
+# created in, and later completions, disputes and confirmations update
+# that same bucket, so each bucket describes one cohort of deals.
+ANALYTICS_GRANULARITIES = {
+    'hour': ('%Y-%m-%d %H:00:00', timedelta(hours=1)),
+    'day': ('%Y-%m-%d 00:00:00', timedelta(days=1)),
+}
+
+# Whole minutes from a deal's creation to its payment confirmation
+CONFIRM_MINUTES_SQL = (
+    "MAX(CAST((julianday({row}.payment_confirmed_at) - julianday({row}.created_at)) * 1440 AS INTEGER), 0)"
+)
+
+def _rollup_rows(created_at: str, values: str, source: str = "WHERE true") -> str:
+    """SELECT one (granularity, bucket, *values) row per rollup granularity"""
+    return "\n            UNION ALL ".join(
+        f"SELECT '{name}', strftime('{label}', {created_at}), {values} {source}"
+        for name, (label, _) in ANALYTICS_GRANULARITIES.items()
+    )
+
+# Never let a row without created_at block the write that fires a trigger
+_NEW_CREATED_AT = "COALESCE(NEW.created_at, CURRENT_TIMESTAMP)"
+
+ANALYTICS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS analytics_deal_created AFTER INSERT ON deals
+    BEGIN
+        INSERT INTO analytics_rollups (granularity, bucket, deals, amount)
+            {_rollup_rows(_NEW_CREATED_AT, "1, COALESCE(NEW.amount, 0)")}
+        ON CONFLICT (granularity, bucket) DO UPDATE
+        SET deals = deals + excluded.deals, amount = amount + excluded.amount;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS analytics_deal_completed AFTER UPDATE OF status ON deals
+    WHEN (OLD.status IS 'completed') != (NEW.status IS 'completed')
+    BEGIN
+        INSERT INTO analytics_rollups (granularity, bucket, completed)
+            {_rollup_rows(_NEW_CREATED_AT, "(NEW.status IS 'completed') - (OLD.status IS 'completed')")}
+        ON CONFLICT (granularity, bucket) DO UPDATE SET completed = completed + excluded.completed;
+    END
+    """,
+    # Stamp the first confirmation; the stamp in turn feeds the histogram below
+    f"""
+    CREATE TRIGGER IF NOT EXISTS deals_payment_confirmed_at AFTER UPDATE OF status ON deals
+    WHEN NEW.status IS '{DEAL_STATUS["PAYMENT_CONFIRMED"]}' AND NEW.payment_confirmed_at IS NULL
+    BEGIN
+        UPDATE deals SET payment_confirmed_at = CURRENT_TIMESTAMP WHERE deal_id = NEW.deal_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS analytics_deal_confirmed AFTER UPDATE OF payment_confirmed_at ON deals
+    WHEN OLD.payment_confirmed_at IS NULL AND NEW.payment_confirmed_at IS NOT NULL
+    BEGIN
+        INSERT INTO analytics_confirm_times (granularity, bucket, minutes, deals)
+            {_rollup_rows(_NEW_CREATED_AT, CONFIRM_MINUTES_SQL.format(row="NEW") + ", 1")}
+        ON CONFLICT (granularity, bucket, minutes) DO UPDATE SET deals = deals + 1;
+    END
+    """,
+    # A deal counts as disputed once, however many disputes it gets
+    f"""
+    CREATE TRIGGER IF NOT EXISTS analytics_deal_disputed AFTER INSERT ON disputes
+    WHEN NOT EXISTS (
+        SELECT 1 FROM disputes WHERE deal_id = NEW.deal_id AND dispute_id != NEW.dispute_id
+    )
+    BEGIN
+        INSERT INTO analytics_rollups (granularity, bucket, disputed)
+            {_rollup_rows("COALESCE(created_at, CURRENT_TIMESTAMP)", "1", "FROM deals WHERE deal_id = NEW.deal_id")}
+        ON CONFLICT (granularity, bucket) DO UPDATE SET disputed = disputed + 1;
+    END
+    """,
+]
+
+# Recompute every rollup from deals and disputes
+ANALYTICS_REBUILD_SQL = [
+    "DELETE FROM analytics_rollups",
+    "DELETE FROM analytics_confirm_times",
+    *(
+        f"""
+        INSERT INTO analytics_rollups (granularity, bucket, deals, amount, completed, disputed)
+        SELECT '{name}', strftime('{label}', created_at) AS bucket, COUNT(*), COALESCE(SUM(amount), 0),
+               SUM(status IS 'completed'),
+               SUM(EXISTS (SELECT 1 FROM disputes WHERE disputes.deal_id = deals.deal_id))
+        FROM deals
+        WHERE created_at IS NOT NULL
+        GROUP BY bucket
+        """
+        for name, (label, _) in ANALYTICS_GRANULARITIES.items()
+    ),
+    *(
+        f"""
+        INSERT INTO analytics_confirm_times (granularity, bucket, minutes, deals)
+        SELECT '{name}', strftime('{label}', created_at) AS bucket,
+               {CONFIRM_MINUTES_SQL.format(row="deals")} AS minutes, COUNT(*)
+        FROM deals
+        WHERE created_at IS NOT NULL AND payment_confirmed_at IS NOT NULL
+        GROUP BY bucket, minutes
+        """
+        for name, (label, _) in ANALYTICS_GRANULARITIES.items()
+    ),
+]
+
+def histogram_median(histogram: Dict[int, int]) -> Optional[int]:
+    """Median value of a {value: count} histogram, None if it is empty"""
+    middle = (sum(histogram.values()) + 1) // 2
+    if not middle:
+        return None
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen >= middle:
+            return value
+
+# Ordered schema migrations: (version, description, steps). A step is either
+# an SQL statement or a callable taking a cursor. Steps must be idempotent so
+# a database created by an older build can be brought forward safely.
+MIGRATIONS = [
+    (1, "Index deals by party and creation time", [
+        "CREATE INDEX IF NOT EXISTS idx_deals_party_a ON deals (party_a_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_deals_party_b ON deals (party_b_id, created_at)",
+    ]),
+    (2, "Index deals by status and creation time", [
+        "CREATE INDEX IF NOT EXISTS idx_deals_status ON deals (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_deals_created_at ON deals (created_at)",
+    ]),
+    (3, "Index users by username", [
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)",
+    ]),
+    (4, "Index disputes and trust ratings", [
+        "CREATE INDEX IF NOT EXISTS idx_disputes_status ON disputes (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_disputes_deal ON disputes (deal_id)",
+        "CREATE INDEX IF NOT EXISTS idx_trust_ratings_rated ON trust_ratings (rated_id, rating)",
+        "CREATE INDEX IF NOT EXISTS idx_trust_ratings_deal ON trust_ratings (deal_id)",
+    ]),
+    (5, "Keep running trust rating aggregates on users", [
+        lambda cursor: add_column_if_missing(cursor, "users", "rating_sum", "INTEGER NOT NULL DEFAULT 0"),
+        lambda cursor: add_column_if_missing(cursor, "users", "rating_count", "INTEGER NOT NULL DEFAULT 0"),
+        """
+        UPDATE users SET
+            rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM trust_ratings WHERE rated_id = users.user_id),
+            rating_count = (SELECT COUNT(*) FROM trust_ratings WHERE rated_id = users.user_id)
+        """,
+    ]),
+    (6, "Persist conversation states", [
+        """
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states (expires_at)",
+    ]),
+    (7, "Allow one trust rating per rater per deal", [
+        # Keep the first of any duplicate ratings and rebuild the aggregates without the rest
+        """
+        DELETE FROM trust_ratings WHERE rating_id NOT IN (
+            SELECT MIN(rating_id) FROM trust_ratings GROUP BY deal_id, rater_id
+        )
+        """,
+        """
+        UPDATE users SET
+            rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM trust_ratings WHERE rated_id = users.user_id),
+            rating_count = (SELECT COUNT(*) FROM trust_ratings WHERE rated_id = users.user_id),
+            trust_rating = COALESCE((SELECT AVG(rating) FROM trust_ratings WHERE rated_id = users.user_id), trust_rating)
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_trust_ratings_deal_rater ON trust_ratings (deal_id, rater_id)",
+    ]),
+    (8, "Index admin listing sorts and filters", [
+        "CREATE INDEX IF NOT EXISTS idx_deals_amount ON deals (amount)",
+        "CREATE INDEX IF NOT EXISTS idx_deals_party_b_username ON deals (party_b_username, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)",
+    ]),
+    (9, "Maintain per-user deal counters", [
+        # Link party B by id on deals whose seller has already registered
+        """
+        UPDATE deals SET party_b_id = (
+            SELECT user_id FROM users WHERE lower(username) = deals.party_b_username
+            ORDER BY created_at DESC LIMIT 1
+        )
+        WHERE party_b_id IS NULL
+        """,
+        DEAL_COUNTERS_BACKFILL_SQL,
+    ]),
+    (10, "Log changes for the live admin dashboard", [
+        """
+        CREATE TABLE IF NOT EXISTS admin_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            deal_id INTEGER,
+            dispute_id INTEGER,
+            user_id INTEGER,
+            old_status TEXT,
+            new_status TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Triggers catch every writer, bot and admin panel alike, in the writer's transaction
+        """
+        CREATE TRIGGER IF NOT EXISTS admin_events_user_created AFTER INSERT ON users
+        BEGIN
+            INSERT INTO admin_events (kind, user_id) VALUES ('user_created', NEW.user_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS admin_events_deal_created AFTER INSERT ON deals
+        BEGIN
+            INSERT INTO admin_events (kind, deal_id, user_id, new_status)
+            VALUES ('deal_created', NEW.deal_id, NEW.party_a_id, NEW.status);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS admin_events_deal_status AFTER UPDATE OF status ON deals
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO admin_events (kind, deal_id, user_id, old_status, new_status)
+            VALUES ('deal_status', NEW.deal_id, NEW.party_a_id, OLD.status, NEW.status);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS admin_events_dispute_created AFTER INSERT ON disputes
+        BEGIN
+            INSERT INTO admin_events (kind, deal_id, dispute_id, user_id, new_status)
+            VALUES ('dispute_created', NEW.deal_id, NEW.dispute_id, NEW.raised_by, NEW.status);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS admin_events_dispute_status AFTER UPDATE OF status ON disputes
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO admin_events (kind, deal_id, dispute_id, user_id, old_status, new_status)
+            VALUES ('dispute_status', NEW.deal_id, NEW.dispute_id, NEW.raised_by, OLD.status, NEW.status);
+        END
+        """,
+    ]),
+    (11, "Full-text search over deals, users and disputes", [
+        # Underscores stay inside tokens so usernames match whole or by prefix
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            kind UNINDEXED, ref_id UNINDEXED, names, content,
+            tokenize = "unicode61 remove_diacritics 2 tokenchars '_'",
+            prefix = '2 3'
+        )
+        """,
+        # Rank name matches above free-text matches
+        "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(0, 0, 2.0, 1.0)')",
+        *_search_sync_triggers(
+            'deals', 'deal', 'deal_id', 'description, party_b_username',
+            "{row}.party_b_username", "{row}.description"
+        ),
+        *_search_sync_triggers(
+            'users', 'user', 'user_id', 'username, first_name',
+            "TRIM(COALESCE({row}.username, '') || ' ' || COALESCE({row}.first_name, ''))", "NULL"
+        ),
+        *_search_sync_triggers(
+            'disputes', 'dispute', 'dispute_id', 'reason, resolution',
+            "NULL", "TRIM(COALESCE({row}.reason, '') || ' ' || COALESCE({row}.resolution, ''))"
+        ),
+    ]),
+    (12, "Materialized row counters for the admin dashboard", [
+        """
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        # Counters change in the writer's transaction, so they never disagree with the rows
+        *_stats_triggers('users', with_status=False),
+        *_stats_triggers('deals'),
+        *_stats_triggers('disputes'),
+        f"INSERT OR REPLACE INTO stats (name, value) SELECT name, value FROM ({STATS_ACTUAL_SQL})",
+    ]),
+    (13, "Hourly and daily deal analytics rollups", [
+        lambda cursor: add_column_if_missing(cursor, "deals", "payment_confirmed_at", "TIMESTAMP"),
+        # Confirmation times survive only in the admin event log, for deals confirmed recently
+        f"""
+        UPDATE deals SET payment_confirmed_at = confirmed.at
+        FROM (
+            SELECT deal_id, MIN(created_at) AS at FROM admin_events
+            WHERE kind = 'deal_status' AND new_status = '{DEAL_STATUS["PAYMENT_CONFIRMED"]}'
+            GROUP BY deal_id
+        ) AS confirmed
+        WHERE deals.deal_id = confirmed.deal_id AND deals.payment_confirmed_at IS NULL
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS analytics_rollups (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            deals INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            disputed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket)
+        ) WITHOUT ROWID
+        """,
+        # Minutes-to-confirm histograms, so medians need no per-deal rows
+        """
+        CREATE TABLE IF NOT EXISTS analytics_confirm_times (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            minutes INTEGER NOT NULL,
+            deals INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket, minutes)
+        ) WITHOUT ROWID
+        """,
+        *ANALYTICS_TRIGGERS,
+        *ANALYTICS_REBUILD_SQL,
+    ]),
+    (14, "Index users by case-insensitive username", [
+        "CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (lower(username))",
+    ]),
+]
+
+# Hot access paths that must be served by an index (see check_query_plans)
+HOT_QUERIES = {
+    "get_user_by_username": ("SELECT * FROM users WHERE username = ?", ("someone",)),
+    "get_user_deals": ("""
+        SELECT * FROM deals
+        WHERE party_a_id = ? OR party_b_id = ?
+        ORDER BY created_at DESC
+    """, (0, 0)),
+    "get_user_deals_page": ("""
+        SELECT * FROM (
+            SELECT * FROM deals
+            WHERE party_a_id = ?
+              AND (created_at, deal_id) < (SELECT created_at, deal_id FROM deals WHERE deal_id = ?)
+            ORDER BY created_at DESC, deal_id DESC
+            LIMIT ?
+        )
+        UNION
+        SELECT * FROM (
+            SELECT * FROM deals
+            WHERE party_b_id = ?
+              AND (created_at, deal_id) < (SELECT created_at, deal_id FROM deals WHERE deal_id = ?)
+            ORDER BY created_at DESC, deal_id DESC
+            LIMIT ?
+        )
+        ORDER BY created_at DESC, deal_id DESC
+        LIMIT ?
+    """, (0, 0, 5, 0, 0, 5, 5)),
+    "get_pending_confirmations": ("""
+        SELECT * FROM deals WHERE status = ? ORDER BY created_at ASC
+    """, (DEAL_STATUS["PAYMENT_PENDING"],)),
+    "get_open_disputes": ("""
+        SELECT d.*, deals.amount, deals.description, u.username as raised_by_username
+        FROM disputes d
+        JOIN deals ON d.deal_id = deals.deal_id
+        JOIN users u ON d.raised_by = u.user_id
+        WHERE d.status = 'open'
+        ORDER BY d.created_at ASC
+    """, ()),
+    "admin_deals_by_status": ("""
+        SELECT d.*, u.username as party_a_username
+        FROM deals d
+        JOIN users u ON d.party_a_id = u.user_id
+        WHERE d.status = ?
+        ORDER BY d.created_at DESC
+    """, (DEAL_STATUS["COMPLETED"],)),
+    "admin_deals_page": ("""
+        SELECT d.*, u.username as party_a_username
+        FROM deals d
+        LEFT JOIN users u ON d.party_a_id = u.user_id
+        WHERE d.status = ?
+          AND (d.created_at, d.deal_id) < (SELECT created_at, deal_id FROM deals WHERE deal_id = ?)
+        ORDER BY d.created_at DESC, d.deal_id DESC
+        LIMIT 51
+    """, (DEAL_STATUS["COMPLETED"], 0)),
+    "admin_deals_page_by_amount": ("""
+        SELECT d.*, u.username as party_a_username
+        FROM deals d
+        LEFT JOIN users u ON d.party_a_id = u.user_id
+        ORDER BY d.amount DESC, d.deal_id DESC
+        LIMIT 51
+    """, ()),
+    "admin_users_page": ("""
+        SELECT * FROM users
+        WHERE (created_at, user_id) < (SELECT created_at, user_id FROM users WHERE user_id = ?)
+        ORDER BY created_at DESC, user_id DESC
+        LIMIT 51
+    """, (0,)),
+    "registered_party_b": ("""
+        SELECT user_id FROM users WHERE lower(username) = ? ORDER BY created_at DESC LIMIT 1
+    """, ("someone",)),
+    "unbound_deals_for_username": ("""
+        SELECT 1 FROM deals WHERE party_b_username = ? AND party_b_id IS NULL LIMIT 1
+    """, ("someone",)),
+    "admin_events_after": ("""
+        SELECT e.*, d.amount, u.username as party_a_username, d.party_b_username,
+               d.description, d.created_at as deal_created_at,
+               ds.reason, r.username as raised_by_username
+        FROM admin_events e
+        LEFT JOIN deals d ON d.deal_id = e.deal_id
+        LEFT JOIN users u ON u.user_id = d.party_a_id
+        LEFT JOIN disputes ds ON ds.dispute_id = e.dispute_id
+        LEFT JOIN users r ON r.user_id = ds.raised_by
+        WHERE e.event_id > ?
+        ORDER BY e.event_id
+        LIMIT ?
+    """, (0, 500)),
+    "admin_search": ("""
+        SELECT kind, ref_id, snippet(search_index, -1, '[', ']', '...', 12), rank
+        FROM search_index
+        WHERE search_index MATCH ?
+        ORDER BY rank
+        LIMIT 21
+    """, ('"someone"*',)),
+    "analytics_range": ("""
+        SELECT bucket, minutes, deals FROM analytics_confirm_times
+        WHERE granularity = ? AND bucket BETWEEN ? AND ?
+    """, ('hour', '2024-01-01 00:00:00', '2024-01-02 23:00:00')),
+    "admin_recent_deals": ("""
+        SELECT d.*, u.username as party_a_username
+        FROM deals d
+        JOIN users u ON d.party_a_id = u.user_id
+        ORDER BY d.created_at DESC
+        LIMIT 10
+    """, ()),
+}
+
+# Sort keys offered by the admin deal listing; each is paired with deal_id for keyset paging
+ADMIN_DEAL_SORTS = ('created_at', 'amount')
+
+# Tables offered by export_csv: name -> (record type, query in export order)
+EXPORTS = {
+    'users': (User, "SELECT * FROM users ORDER BY user_id"),
+    'deals': (Deal, """
+        SELECT d.*, u.username AS party_a_username
+        FROM deals d
+        LEFT JOIN users u ON d.party_a_id = u.user_id
+        ORDER BY d.deal_id
+    """),
+    'ratings': (TrustRating, "SELECT * FROM trust_ratings ORDER BY rating_id"),
+}
+
+# Deal state machine: target status -> statuses it may be entered from
+DEAL_TRANSITIONS = {
+    DEAL_STATUS["PAYMENT_PENDING"]: (DEAL_STATUS["CREATED"],),
+    DEAL_STATUS["PAYMENT_CONFIRMED"]: (DEAL_STATUS["CREATED"], DEAL_STATUS["PAYMENT_PENDING"]),
+    DEAL_STATUS["DELIVERED"]: (DEAL_STATUS["PAYMENT_CONFIRMED"],),
+    DEAL_STATUS["COMPLETED"]: (DEAL_STATUS["DELIVERED"],),
+    DEAL_STATUS["DISPUTED"]: (
+        DEAL_STATUS["PAYMENT_PENDING"], DEAL_STATUS["PAYMENT_CONFIRMED"], DEAL_STATUS["DELIVERED"]
+    ),
+    DEAL_STATUS["CANCELLED"]: (DEAL_STATUS["CREATED"], DEAL_STATUS["PAYMENT_PENDING"]),
+}
+
+# Insert a user or update their profile in place. Unlike INSERT OR REPLACE
+# this keeps created_at and the rating/deal counters, and skips the write
+# entirely when the profile is unchanged.
+UPSERT_USER_SQL = '''
+    INSERT INTO users (user_id, username, first_name, last_name)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name
+    WHERE users.username IS NOT excluded.username
+       OR users.first_name IS NOT excluded.first_name
+       OR users.last_name IS NOT excluded.last_name
+'''
+
+# User record caches, shared by every Database instance on the same file
+_user_caches = {}
+_user_caches_lock = threading.Lock()
+
+def get_user_cache(db_path: str) -> LRUCache:
+    """Get the process-wide user cache for a database file"""
+    with _user_caches_lock:
+        if db_path not in _user_caches:
+            _user_caches[db_path] = LRUCache(USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+        return _user_caches[db_path]
+
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
 
 class Database:
-    def __init__(self):
-        self.db_path = DATABASE_PATH
+    def __init__(self, db_path: str = None, query_timeout: float = None):
+        self.db_path = db_path or DATABASE_PATH
+        self.query_timeout = None
+        self._pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        self._pool_lock = threading.Lock()
+        self._open_connections = 0
+        self.user_cache = get_user_cache(self.db_path)
+        self._pending_users = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_timer = None
+        self._count_cache = LRUCache(256, ttl=ADMIN_COUNT_TTL)
         self.init_database()
+        # Migrations may run long; only later calls are bounded
+        self.query_timeout = query_timeout
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new long-lived connection configured for concurrent access"""
+        journal_mode = DB_JOURNAL_MODE.upper()
+        synchronous = DB_SYNCHRONOUS.upper()
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Invalid journal mode: {DB_JOURNAL_MODE}")
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous level: {DB_SYNCHRONOUS}")
+        
+        # Connections move between the bot thread and the admin request
+        # threads through the pool, but only one thread uses them at a time.
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            isolation_level="IMMEDIATE"
+        )
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        """Take an idle connection from the pool, opening one if the pool has room"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            if self._open_connections < DB_POOL_SIZE:
+                self._open_connections += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._open_connections -= 1
+                    raise
+        
+        try:
+            return self._pool.get(timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"connection pool exhausted: all {DB_POOL_SIZE} connections busy for {DB_BUSY_TIMEOUT_MS} ms"
+            ) from None
+    
+    def _release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool.put_nowait(conn)
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; commits on success, rolls back on error"""
+        conn = self._acquire()
+        if self.query_timeout:
+            # Interrupt statements still running once the borrow outlasts query_timeout
+            deadline = time.monotonic() + self.query_timeout
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            with conn:
+                yield conn
+        finally:
+            if self.query_timeout:
+                conn.set_progress_handler(None, 0)
+            self._release(conn)
+    
+    def close(self):
+        """Flush queued user profiles and close all idle pooled connections"""
+        with self._pending_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        self.flush_user_updates()
+        
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._pool_lock:
+                self._open_connections -= 1
     
     def init_database(self):
         """Initialize the database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             
             # Users table
@@ -79,230 +791,1117 @@ class Database:
                 )
             ''')
             
+            # Applied schema migrations
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             conn.commit()
+        
+        self.migrate()
+    
+    def get_schema_version(self) -> int:
+        """Get the highest applied migration version"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+            return cursor.fetchone()[0]
+    
+    def migrate(self) -> List[int]:
+        """Apply pending migrations in order, one transaction per version"""
+        applied = []
+        for version, description, steps in MIGRATIONS:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                # Take the write lock before re-checking, so processes starting
+                # up at the same time apply each migration exactly once.
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+                if cursor.fetchone():
+                    continue
+                
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                
+                cursor.execute('''
+                    INSERT INTO schema_version (version, description)
+                    VALUES (?, ?)
+                ''', (version, description))
+                applied.append(version)
+        return applied
+    
+    def check_query_plans(self) -> Dict[str, List[str]]:
+        """Return the hot queries whose EXPLAIN QUERY PLAN contains a full table scan"""
+        violations = {}
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            for name, (sql, params) in HOT_QUERIES.items():
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                details = [row[3] for row in cursor.fetchall()]
+                # "SCAN (subquery-N)" walks an already bounded intermediate result
+                # Virtual tables report the index they use as "INDEX n:<idxStr>"
+                scans = [
+                    detail for detail in details
+                    if detail.startswith('SCAN ') and 'USING' not in detail
+                    and not detail.startswith(('SCAN (', 'SCAN CONSTANT ROW'))
+                    and not re.search(r'VIRTUAL TABLE INDEX \d+:\S', detail)
+                ]
+                if scans:
+                    violations[name] = details
+        return violations
     
     def add_user(self, user_id: int, username: str, first_name: str, last_name: str = None) -> bool:
         """Add a new user or update existing user info"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO users 
-                    (user_id, username, first_name, last_name, created_at)
-                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (user_id, username, first_name, last_name))
+                cursor.execute(UPSERT_USER_SQL, (user_id, username, first_name, last_name))
                 conn.commit()
-                return True
+            self.invalidate_user(user_id)
+            return True
         except Exception as e:
             print(f"Error adding user: {e}")
             return False
     
-    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+    def queue_user_update(self, user_id: int, username: str, first_name: str, last_name: str = None) -> bool:
+        """Record a user's profile, coalescing writes into batched transactions
+        
+        Returns False when the cached profile already matches and nothing was
+        queued. Queued profiles are flushed after USER_WRITE_FLUSH_INTERVAL
+        seconds or once USER_WRITE_BATCH_SIZE of them are waiting.
+        """
+        profile = (username, first_name, last_name)
+        cached = self.user_cache.get(('id', user_id))
+        if cached is not None and (cached.username, cached.first_name, cached.last_name) == profile:
+            return False
+        
+        with self._pending_lock:
+            if self._pending_users.get(user_id) == profile:
+                return False
+            self._pending_users[user_id] = profile
+            batch_full = len(self._pending_users) >= USER_WRITE_BATCH_SIZE
+            if not batch_full and self._flush_timer is None:
+                self._flush_timer = threading.Timer(USER_WRITE_FLUSH_INTERVAL, self._flush_on_timer)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        
+        if batch_full:
+            self.flush_user_updates()
+        return True
+    
+    def _flush_on_timer(self):
+        """Flush queued profiles from the timer thread, retrying later on failure"""
+        with self._pending_lock:
+            self._flush_timer = None
+        try:
+            self.flush_user_updates()
+        except Exception as e:
+            print(f"Error flushing user updates: {e}")
+            with self._pending_lock:
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(USER_WRITE_FLUSH_INTERVAL, self._flush_on_timer)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+    
+    def flush_user_updates(self) -> int:
+        """Write all queued profiles in one transaction and return how many were written"""
+        with self._flush_lock:
+            with self._pending_lock:
+                batch = dict(self._pending_users)
+            if not batch:
+                return 0
+            
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(UPSERT_USER_SQL, [
+                    (user_id, *profile) for user_id, profile in batch.items()
+                ])
+            
+            # Keep profiles that were re-queued with new values meanwhile
+            with self._pending_lock:
+                for user_id, profile in batch.items():
+                    if self._pending_users.get(user_id) == profile:
+                        del self._pending_users[user_id]
+            for user_id in batch:
+                self.invalidate_user(user_id)
+            return len(batch)
+    
+    def _flush_pending_user(self, user_id: int = None, username: str = None):
+        """Flush queued profiles before reading a user that has one pending"""
+        with self._pending_lock:
+            if user_id is not None:
+                pending = user_id in self._pending_users
+            else:
+                username = username.lower()
+                pending = any((profile[0] or '').lower() == username for profile in self._pending_users.values())
+        if pending:
+            self.flush_user_updates()
+    
+    def _cache_user(self, user: User):
+        """Store a user record under its id, and map its username to that id"""
+        self.user_cache.set(('id', user.user_id), user)
+        if user.username:
+            self.user_cache.set(('username', user.username), user.user_id)
+    
+    def invalidate_user(self, user_id: int):
+        """Drop a cached user record after it changes"""
+        # Username entries only point at ids and are re-validated on read,
+        # so dropping the id entry is enough.
+        self.user_cache.pop(('id', user_id))
+    
+    def get_user(self, user_id: int) -> Optional[User]:
         """Get user information"""
+        self._flush_pending_user(user_id=user_id)
+        user = self.user_cache.get(('id', user_id))
+        if user is not None:
+            return user
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
                 row = cursor.fetchone()
                 if row:
-                    columns = [description[0] for description in cursor.description]
-                    return dict(zip(columns, row))
+                    user = row_builder(User, cursor.description)(row)
+                    self._cache_user(user)
+                    return user
                 return None
         except Exception as e:
             print(f"Error getting user: {e}")
             return None
     
-    def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+    def get_user_by_username(self, username: str) -> Optional[User]:
         """Get user information by username"""
+        self._flush_pending_user(username=username)
+        user_id = self.user_cache.get(('username', username))
+        if user_id is not None:
+            user = self.user_cache.get(('id', user_id))
+            if user is not None and user.username == username:
+                return user
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
                 row = cursor.fetchone()
                 if row:
-                    columns = [description[0] for description in cursor.description]
-                    return dict(zip(columns, row))
+                    user = row_builder(User, cursor.description)(row)
+                    self._cache_user(user)
+                    return user
                 return None
         except Exception as e:
             print(f"Error getting user by username: {e}")
             return None
     
     def create_deal(self, party_a_id: int, party_b_username: str, amount: float, description: str) -> Optional[int]:
-        """Create a new deal"""
+        """Create a new deal and count it for both parties
+        
+        A seller who already uses the bot is linked by id straight away;
+        bind_party_b links sellers who register later.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Both parties' rows must exist for the lookup and counter updates below
+            self._flush_pending_user(user_id=party_a_id)
+            self._flush_pending_user(username=party_b_username)
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO deals (party_a_id, party_b_username, amount, description, status)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (party_a_id, party_b_username, amount, description, DEAL_STATUS["CREATED"]))
+                    SELECT user_id FROM users WHERE lower(username) = ? ORDER BY created_at DESC LIMIT 1
+                ''', (party_b_username.lower(),))
+                row = cursor.fetchone()
+                party_b_id = row[0] if row else None
+                
+                cursor.execute('''
+                    INSERT INTO deals (party_a_id, party_b_username, party_b_id, amount, description, status)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (party_a_id, party_b_username, party_b_id, amount, description, DEAL_STATUS["CREATED"]))
                 deal_id = cursor.lastrowid
+                # A deal counts once per user, even with oneself
+                cursor.execute('''
+                    UPDATE users SET total_deals = total_deals + 1 WHERE user_id IN (?, ?)
+                ''', (party_a_id, party_b_id))
                 conn.commit()
-                return deal_id
+            self.invalidate_user(party_a_id)
+            if party_b_id is not None:
+                self.invalidate_user(party_b_id)
+            return deal_id
         except Exception as e:
             print(f"Error creating deal: {e}")
             return None
     
-    def get_deal(self, deal_id: int) -> Optional[Dict[str, Any]]:
+    def bind_party_b(self, user_id: int, username: str) -> int:
+        """Link the deals naming username as party B to user_id and count them
+        
+        Deals are created with only the seller's username; this records
+        their id once they use the bot. Returns the number of deals bound.
+        """
+        if not username:
+            return 0
+        username = username.lower()
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT 1 FROM deals WHERE party_b_username = ? AND party_b_id IS NULL LIMIT 1',
+                    (username,)
+                )
+                if cursor.fetchone() is None:
+                    return 0
+            
+            self._flush_pending_user(user_id=user_id)
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE deals SET party_b_id = ?
+                    WHERE party_b_username = ? AND party_b_id IS NULL
+                    RETURNING party_a_id, status
+                ''', (user_id, username))
+                bound = [row for row in cursor.fetchall() if row[0] != user_id]
+                completed = sum(1 for _, status in bound if status == DEAL_STATUS["COMPLETED"])
+                cursor.execute('''
+                    UPDATE users 
+                    SET total_deals = total_deals + ?,
+                        successful_deals = successful_deals + ?
+                    WHERE user_id = ?
+                ''', (len(bound), completed, user_id))
+                conn.commit()
+            self.invalidate_user(user_id)
+            return len(bound)
+        except Exception as e:
+            print(f"Error binding party B deals: {e}")
+            return 0
+    
+    def get_deal(self, deal_id: int) -> Optional[Deal]:
         """Get deal information"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM deals WHERE deal_id = ?', (deal_id,))
                 row = cursor.fetchone()
                 if row:
-                    columns = [description[0] for description in cursor.description]
-                    return dict(zip(columns, row))
+                    return row_builder(Deal, cursor.description)(row)
                 return None
         except Exception as e:
             print(f"Error getting deal: {e}")
             return None
     
-    def get_user_deals(self, user_id: int) -> List[Dict[str, Any]]:
+    def iter_records(self, record_type: type, sql: str, params=(), batch_size: int = 500) -> Iterator:
+        """Stream query results as records, batch_size rows at a time
+        
+        Holds a pooled connection until the iterator is exhausted or closed.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            build = row_builder(record_type, cursor.description)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield build(row)
+    
+    def export_csv(self, name: str, output) -> int:
+        """Write one of EXPORTS to output as CSV and return the number of rows
+        
+        Rows are streamed with iter_records, so memory use stays flat however
+        large the table is.
+        """
+        record_type, sql = EXPORTS[name]
+        writer = csv.writer(output)
+        writer.writerow(record_type._fields)
+        count = 0
+        for record in self.iter_records(record_type, sql):
+            writer.writerow(record)
+            count += 1
+        return count
+    
+    def get_recent_deals(self, limit: int = 10) -> List[Deal]:
+        """Get the newest deals with party A's username"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT d.*, u.username as party_a_username 
+                FROM deals d 
+                JOIN users u ON d.party_a_id = u.user_id 
+                ORDER BY d.created_at DESC 
+                LIMIT ?
+            ''', (limit,))
+            build = row_builder(Deal, cursor.description)
+            return [build(row) for row in cursor.fetchall()]
+    
+    def _keyset_page(self, record_type: type, sql: str, params: list, sort_columns: str,
+                     key_sql: str, cursor_id: Optional[int], backwards: bool,
+                     descending: bool, limit: int) -> Page:
+        """Run one keyset-paginated query
+        
+        sql selects the rows with a WHERE clause ending in "{cursor}", which is
+        replaced by the keyset condition; sort_columns is the (sort, id) row
+        value and key_sql selects it for cursor_id. Pass the last id of a page
+        as cursor_id to get the next page, or the first id with backwards=True
+        to get the previous one.
+        """
+        # Walking backwards reverses the query order; the page is flipped back below
+        query_descending = descending != backwards
+        comparison, order = ('<', 'DESC') if query_descending else ('>', 'ASC')
+        
+        cursor_condition = ''
+        if cursor_id is not None:
+            cursor_condition = f' AND {sort_columns} {comparison} ({key_sql})'
+            params = [*params, cursor_id]
+        order_by = ', '.join(f'{column.strip()} {order}' for column in sort_columns.strip('()').split(','))
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f'{sql.format(cursor=cursor_condition)} ORDER BY {order_by} LIMIT ?',
+                [*params, limit + 1]
+            )
+            build = row_builder(record_type, cursor.description)
+            items = [build(row) for row in cursor.fetchall()]
+        
+        has_more = len(items) > limit
+        items = items[:limit]
+        if backwards:
+            items.reverse()
+            return Page(items, has_previous=has_more, has_next=True)
+        return Page(items, has_previous=cursor_id is not None, has_next=has_more)
+    
+    def _count_capped(self, key: tuple, sql: str, params: list) -> int:
+        """Count rows matching sql up to ADMIN_COUNT_LIMIT + 1, reusing recent answers"""
+        count = self._count_cache.get(key)
+        if count is None:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'SELECT COUNT(*) FROM ({sql} LIMIT ?)', [*params, ADMIN_COUNT_LIMIT + 1])
+                count = cursor.fetchone()[0]
+            self._count_cache.set(key, count)
+        return count
+    
+    @staticmethod
+    def _deal_filters(status: str = None, date_from: str = None, date_to: str = None,
+                      min_amount: float = None, max_amount: float = None,
+                      username: str = None) -> tuple:
+        """Build the WHERE conditions and parameters for the admin deal filters"""
+        conditions = []
+        params = []
+        if status:
+            conditions.append('d.status = ?')
+            params.append(status)
+        if date_from:
+            conditions.append('d.created_at >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append("d.created_at < date(?, '+1 day')")
+            params.append(date_to)
+        if min_amount is not None:
+            conditions.append('d.amount >= ?')
+            params.append(min_amount)
+        if max_amount is not None:
+            conditions.append('d.amount <= ?')
+            params.append(max_amount)
+        if username:
+            # Prefix match on either party, as index range scans
+            prefix = username.lstrip('@')
+            conditions.append('''(d.party_a_id IN (SELECT user_id FROM users WHERE username >= ? AND username < ?)
+                OR (d.party_b_username >= ? AND d.party_b_username < ?))''')
+            params.extend([prefix, prefix + '\U0010ffff'] * 2)
+        return ' AND '.join(conditions) or '1', params
+    
+    def get_deals_page(self, limit: int = ADMIN_PAGE_SIZE, cursor_deal_id: int = None,
+                       backwards: bool = False, sort: str = 'created_at', descending: bool = True,
+                       **filters) -> Page:
+        """Get one page of all deals with party A's username, for the admin listing
+        
+        filters are those of _deal_filters. Sorting is by sort (one of
+        ADMIN_DEAL_SORTS) then deal_id.
+        """
+        if sort not in ADMIN_DEAL_SORTS:
+            raise ValueError(f"Unsupported sort: {sort}")
+        where, params = self._deal_filters(**filters)
+        return self._keyset_page(
+            Deal,
+            f'''
+                SELECT d.*, u.username as party_a_username
+                FROM deals d
+                LEFT JOIN users u ON d.party_a_id = u.user_id
+                WHERE {where}{{cursor}}
+            ''',
+            params,
+            f'(d.{sort}, d.deal_id)',
+            f'SELECT {sort}, deal_id FROM deals WHERE deal_id = ?',
+            cursor_deal_id, backwards, descending, limit
+        )
+    
+    def count_deals(self, **filters) -> int:
+        """Count deals matching the admin filters, capped at ADMIN_COUNT_LIMIT + 1"""
+        where, params = self._deal_filters(**filters)
+        key = ('deals', *sorted(filters.items()))
+        return self._count_capped(key, f'SELECT 1 FROM deals d WHERE {where}', params)
+    
+    def get_users_page(self, limit: int = ADMIN_PAGE_SIZE, cursor_user_id: int = None,
+                       backwards: bool = False, username: str = None) -> Page:
+        """Get one page of users, newest first, for the admin listing"""
+        where, params = '1', []
+        if username:
+            prefix = username.lstrip('@')
+            where, params = 'username >= ? AND username < ?', [prefix, prefix + '\U0010ffff']
+        
+        return self._keyset_page(
+            User,
+            f'''
+                SELECT u.*
+                FROM users u
+                WHERE {where}{{cursor}}
+            ''',
+            params,
+            '(u.created_at, u.user_id)',
+            'SELECT created_at, user_id FROM users WHERE user_id = ?',
+            cursor_user_id, backwards, True, limit
+        )
+    
+    def count_users(self, username: str = None) -> int:
+        """Count users for the admin listing, capped at ADMIN_COUNT_LIMIT + 1"""
+        if username:
+            prefix = username.lstrip('@')
+            return self._count_capped(
+                ('users', prefix),
+                'SELECT 1 FROM users WHERE username >= ? AND username < ?',
+                [prefix, prefix + '\U0010ffff']
+            )
+        return self._count_capped(('users',), 'SELECT 1 FROM users', [])
+    
+    def get_admin_events(self, after_event_id: int, limit: int = 500) -> List[AdminEvent]:
+        """Get logged changes newer than after_event_id, oldest first, with deal and dispute details"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT e.*, d.amount, u.username as party_a_username, d.party_b_username,
+                       d.description, d.created_at as deal_created_at,
+                       ds.reason, r.username as raised_by_username
+                FROM admin_events e
+                LEFT JOIN deals d ON d.deal_id = e.deal_id
+                LEFT JOIN users u ON u.user_id = d.party_a_id
+                LEFT JOIN disputes ds ON ds.dispute_id = e.dispute_id
+                LEFT JOIN users r ON r.user_id = ds.raised_by
+                WHERE e.event_id > ?
+                ORDER BY e.event_id
+                LIMIT ?
+            ''', (after_event_id, limit))
+            build = row_builder(AdminEvent, cursor.description)
+            return [build(row) for row in cursor.fetchall()]
+    
+    def get_admin_event_bounds(self) -> Tuple[int, int]:
+        """Get the oldest and newest retained event ids, (0, 0) when the log is empty"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MIN(event_id), 0), COALESCE(MAX(event_id), 0) FROM admin_events')
+            return cursor.fetchone()
+    
+    def prune_admin_events(self, keep: int) -> int:
+        """Delete all but the newest keep events and return how many were deleted"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM admin_events
+                WHERE event_id <= (SELECT MAX(event_id) FROM admin_events) - ?
+            ''', (keep,))
+            return cursor.rowcount
+    
+    def search(self, text: str, limit: int = ADMIN_SEARCH_PAGE_SIZE, offset: int = 0,
+               kinds: List[str] = None) -> Page:
+        """Ranked full-text search over deals, users and disputes
+        
+        Every word of text must start a word of a party B username, user
+        name, deal description or dispute reason/resolution; name matches
+        rank higher. kinds limits the hits to some of SEARCH_KINDS. Matched
+        words in snippets are wrapped in SNIPPET_START and SNIPPET_END.
+        """
+        match = fts_query(text)
+        offset = min(max(offset, 0), ADMIN_SEARCH_MAX_OFFSET)
+        if match is None:
+            return Page([], offset > 0, False)
+        
+        kind_filter, params = '', [match]
+        if kinds:
+            kind_filter = f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+        
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT kind, ref_id, snippet(search_index, -1, ?, ?, '...', 12), rank
+                    FROM search_index
+                    WHERE search_index MATCH ?{kind_filter}
+                    ORDER BY rank
+                    LIMIT ? OFFSET ?
+                ''', [SNIPPET_START, SNIPPET_END, *params, limit + 1, offset])
+                hits = cursor.fetchall()
+                has_next = len(hits) > limit and offset + limit < ADMIN_SEARCH_MAX_OFFSET
+                hits = hits[:limit]
+                
+                # Summarize the records behind this page of hits, one query per kind
+                ids = {kind: [] for kind in SEARCH_KINDS}
+                for kind, ref_id, _, _ in hits:
+                    ids[kind].append(ref_id)
+                summaries = {}
+                if ids['deal']:
+                    cursor.execute('''
+                        SELECT d.deal_id, u.username, d.party_b_username, d.status
+                        FROM deals d
+                        LEFT JOIN users u ON d.party_a_id = u.user_id
+                        WHERE d.deal_id IN (SELECT value FROM json_each(?))
+                    ''', (json.dumps(ids['deal']),))
+                    for deal_id, party_a, party_b, status in cursor.fetchall():
+                        summaries['deal', deal_id] = (f"@{party_a or 'Unknown'} → @{party_b}", status)
+                if ids['user']:
+                    cursor.execute('''
+                        SELECT user_id, username, first_name FROM users
+                        WHERE user_id IN (SELECT value FROM json_each(?))
+                    ''', (json.dumps(ids['user']),))
+                    for user_id, username, first_name in cursor.fetchall():
+                        summaries['user', user_id] = (f"@{username or 'N/A'} ({first_name or ''})", None)
+                if ids['dispute']:
+                    cursor.execute('''
+                        SELECT dispute_id, deal_id, status FROM disputes
+                        WHERE dispute_id IN (SELECT value FROM json_each(?))
+                    ''', (json.dumps(ids['dispute']),))
+                    for dispute_id, deal_id, status in cursor.fetchall():
+                        summaries['dispute', dispute_id] = (f"Deal #{deal_id}", status)
+        except sqlite3.OperationalError as e:
+            print(f"Error searching for {text!r}: {e}")
+            return Page([], offset > 0, False)
+        
+        return Page(
+            [
+                SearchResult(kind, ref_id, snippet or '', score, *summaries.get((kind, ref_id), ('', None)))
+                for kind, ref_id, snippet, score in hits
+            ],
+            offset > 0,
+            has_next
+        )
+    
+    def get_user_deals(self, user_id: int) -> List[Deal]:
         """Get all deals for a user"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT * FROM deals 
                     WHERE party_a_id = ? OR party_b_id = ?
                     ORDER BY created_at DESC
                 ''', (user_id, user_id))
-                rows = cursor.fetchall()
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in rows]
+                build = row_builder(Deal, cursor.description)
+                return [build(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error getting user deals: {e}")
             return []
     
-    def update_deal_status(self, deal_id: int, status: str) -> bool:
-        """Update deal status"""
+    def get_user_deals_page(self, user_id: int, limit: int = 5, before_deal_id: int = None,
+                            after_deal_id: int = None, status: str = None) -> List[Deal]:
+        """Get one page of a user's deals, newest first, keyed on (created_at, deal_id).
+        
+        Pass the last deal_id of a page as before_deal_id to get the next (older)
+        page, or the first deal_id as after_deal_id to get the previous one.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            if after_deal_id is not None:
+                cursor_deal_id, comparison, order = after_deal_id, '>', 'ASC'
+            else:
+                cursor_deal_id, comparison, order = before_deal_id, '<', 'DESC'
+            
+            conditions = ''
+            condition_params = []
+            if cursor_deal_id is not None:
+                conditions += f'''
+                    AND (created_at, deal_id) {comparison}
+                        (SELECT created_at, deal_id FROM deals WHERE deal_id = ?)'''
+                condition_params.append(cursor_deal_id)
+            if status:
+                conditions += ' AND status = ?'
+                condition_params.append(status)
+            
+            # One indexed range scan per party column, merged and trimmed
+            members = [
+                f'''
+                SELECT * FROM (
+                    SELECT * FROM deals
+                    WHERE {column} = ?{conditions}
+                    ORDER BY created_at {order}, deal_id {order}
+                    LIMIT ?
+                )'''
+                for column in ('party_a_id', 'party_b_id')
+            ]
+            params = [user_id, *condition_params, limit] * 2 + [limit]
+            
+            with self.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE deals 
-                    SET status = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE deal_id = ?
-                ''', (status, deal_id))
-                conn.commit()
-                return cursor.rowcount > 0
+                cursor.execute(f'''
+                    {members[0]}
+                    UNION
+                    {members[1]}
+                    ORDER BY created_at {order}, deal_id {order}
+                    LIMIT ?
+                ''', params)
+                build = row_builder(Deal, cursor.description)
+                deals = [build(row) for row in cursor.fetchall()]
+                if order == 'ASC':
+                    deals.reverse()
+                return deals
         except Exception as e:
-            print(f"Error updating deal status: {e}")
-            return False
+            print(f"Error getting user deals page: {e}")
+            return []
     
-    def confirm_payment(self, deal_id: int) -> bool:
-        """Confirm payment for a deal"""
+    def count_user_deals(self, user_id: int, status: str = None) -> int:
+        """Count a user's deals from the party indexes without loading them"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            status_condition = ' AND status = ?' if status else ''
+            status_params = [status] if status else []
+            with self.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE deals 
-                    SET payment_confirmed = TRUE, 
-                        status = ?, 
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE deal_id = ?
-                ''', (DEAL_STATUS["PAYMENT_CONFIRMED"], deal_id))
-                conn.commit()
-                return cursor.rowcount > 0
+                cursor.execute(f'''
+                    SELECT
+                        (SELECT COUNT(*) FROM deals
+                         WHERE party_a_id = ?{status_condition})
+                      + (SELECT COUNT(*) FROM deals
+                         WHERE party_b_id = ? AND party_a_id IS NOT ?{status_condition})
+                ''', [user_id, *status_params, user_id, user_id, *status_params])
+                return cursor.fetchone()[0]
         except Exception as e:
-            print(f"Error confirming payment: {e}")
-            return False
+            print(f"Error counting user deals: {e}")
+            return 0
     
-    def confirm_delivery(self, deal_id: int) -> bool:
-        """Confirm delivery for a deal"""
+    def _transition_deal(self, cursor, deal_id: int, to_status: str, from_statuses=None,
+                         set_columns: str = '') -> Optional[Deal]:
+        """Move a deal to to_status within the caller's transaction, if its status allows it"""
+        if from_statuses is None:
+            from_statuses = DEAL_TRANSITIONS[to_status]
+        placeholders = ', '.join('?' for _ in from_statuses)
+        
+        # Check and update in one statement so concurrent callers cannot
+        # both apply the same transition
+        cursor.execute(f'''
+            UPDATE deals 
+            SET status = ?,{set_columns}
+                updated_at = CURRENT_TIMESTAMP
+            WHERE deal_id = ? AND status IN ({placeholders})
+            RETURNING *,
+                (SELECT username FROM users WHERE user_id = deals.party_a_id) as party_a_username
+        ''', (to_status, deal_id, *from_statuses))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        deal = row_builder(Deal, cursor.description)(row)
+        
+        if to_status == DEAL_STATUS["COMPLETED"]:
+            cursor.execute('''
+                UPDATE users SET successful_deals = successful_deals + 1
+                WHERE user_id IN (?, ?)
+            ''', (deal.party_a_id, deal.party_b_id))
+        return deal
+    
+    def transition_deal(self, deal_id: int, to_status: str, from_statuses=None,
+                        set_columns: str = '') -> Optional[Deal]:
+        """Atomically move a deal to to_status if it is currently in one of from_statuses
+        
+        from_statuses defaults to DEAL_TRANSITIONS[to_status]. Returns the
+        updated deal joined with party A's username, or None if the deal does
+        not exist or its status did not allow the transition.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE deals 
-                    SET delivery_confirmed = TRUE, 
-                        status = ?, 
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE deal_id = ?
-                ''', (DEAL_STATUS["DELIVERED"], deal_id))
-                conn.commit()
-                return cursor.rowcount > 0
+                deal = self._transition_deal(cursor, deal_id, to_status, from_statuses, set_columns)
+            if deal and to_status == DEAL_STATUS["COMPLETED"]:
+                self.invalidate_user(deal.party_a_id)
+                if deal.party_b_id:
+                    self.invalidate_user(deal.party_b_id)
+            return deal
         except Exception as e:
-            print(f"Error confirming delivery: {e}")
-            return False
+            print(f"Error transitioning deal {deal_id} to {to_status}: {e}")
+            return None
+    
+    def transition_deals(self, deal_ids: List[int], to_status: str, set_columns: str = '',
+                         atomic: bool = False) -> Tuple[List[Deal], Dict[int, Optional[str]]]:
+        """Move many deals to to_status in one transaction
+        
+        Returns the deals that moved and, for each deal that could not, its
+        current status (None if it does not exist). With atomic, nothing
+        moves unless every deal can.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            moved = []
+            for deal_id in deal_ids:
+                deal = self._transition_deal(cursor, deal_id, to_status, set_columns=set_columns)
+                if deal:
+                    moved.append(deal)
+            
+            moved_ids = {deal.deal_id for deal in moved}
+            failed_ids = [deal_id for deal_id in deal_ids if deal_id not in moved_ids]
+            rejected = dict.fromkeys(failed_ids)
+            if failed_ids:
+                cursor.execute(
+                    'SELECT deal_id, status FROM deals WHERE deal_id IN (SELECT value FROM json_each(?))',
+                    (json.dumps(failed_ids),)
+                )
+                rejected.update(cursor.fetchall())
+                if atomic:
+                    conn.rollback()
+                    return [], rejected
+        
+        if to_status == DEAL_STATUS["COMPLETED"]:
+            for deal in moved:
+                self.invalidate_user(deal.party_a_id)
+                if deal.party_b_id:
+                    self.invalidate_user(deal.party_b_id)
+        return moved, rejected
+    
+    def update_deal_status(self, deal_id: int, status: str) -> Optional[Deal]:
+        """Update deal status, if the current status allows it"""
+        return self.transition_deal(deal_id, status)
+    
+    def confirm_payment(self, deal_id: int) -> Optional[Deal]:
+        """Confirm payment for a deal awaiting payment"""
+        return self.transition_deal(
+            deal_id, DEAL_STATUS["PAYMENT_CONFIRMED"], set_columns=' payment_confirmed = TRUE,'
+        )
+    
+    def confirm_payments(self, deal_ids: List[int], atomic: bool = False) -> Tuple[List[Deal], Dict[int, Optional[str]]]:
+        """Confirm payment for many deals in one transaction (see transition_deals)"""
+        return self.transition_deals(
+            deal_ids, DEAL_STATUS["PAYMENT_CONFIRMED"], set_columns=' payment_confirmed = TRUE,', atomic=atomic
+        )
+    
+    def confirm_delivery(self, deal_id: int) -> Optional[Deal]:
+        """Confirm delivery for a deal whose payment is confirmed"""
+        return self.transition_deal(
+            deal_id, DEAL_STATUS["DELIVERED"], set_columns=' delivery_confirmed = TRUE,'
+        )
     
     def create_dispute(self, deal_id: int, raised_by: int, reason: str) -> Optional[int]:
         """Create a dispute for a deal"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
+                # Update deal status to disputed, unless it is already closed
+                if not self._transition_deal(cursor, deal_id, DEAL_STATUS["DISPUTED"]):
+                    return None
+                
                 cursor.execute('''
                     INSERT INTO disputes (deal_id, raised_by, reason)
                     VALUES (?, ?, ?)
                 ''', (deal_id, raised_by, reason))
                 dispute_id = cursor.lastrowid
                 
-                # Update deal status to disputed
-                cursor.execute('''
-                    UPDATE deals 
-                    SET status = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE deal_id = ?
-                ''', (DEAL_STATUS["DISPUTED"], deal_id))
-                
                 conn.commit()
                 return dispute_id
         except Exception as e:
             print(f"Error creating dispute: {e}")
             return None
     
+    def _add_trust_rating(self, cursor, deal_id: int, rater_id: int, rated_id: int, rating: int,
+                          comment: str = None) -> bool:
+        """Add a trust rating within the caller's transaction; False if already rated"""
+        cursor.execute('''
+            INSERT INTO trust_ratings (deal_id, rater_id, rated_id, rating, comment)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (deal_id, rater_id) DO NOTHING
+        ''', (deal_id, rater_id, rated_id, rating, comment))
+        if cursor.rowcount == 0:
+            return False
+        
+        # Update user's running rating aggregates (right-hand sides
+        # see the pre-update values, so this is a single O(1) write)
+        cursor.execute('''
+            UPDATE users 
+            SET rating_sum = rating_sum + ?,
+                rating_count = rating_count + 1,
+                trust_rating = CAST(rating_sum + ? AS REAL) / (rating_count + 1)
+            WHERE user_id = ?
+        ''', (rating, rating, rated_id))
+        return True
+    
     def add_trust_rating(self, deal_id: int, rater_id: int, rated_id: int, rating: int, comment: str = None) -> bool:
-        """Add a trust rating"""
+        """Add a trust rating; returns False if the rater already rated this deal"""
+        try:
+            with self.connection() as conn:
+                added = self._add_trust_rating(conn.cursor(), deal_id, rater_id, rated_id, rating, comment)
+            if added:
+                self.invalidate_user(rated_id)
+            return added
+        except Exception as e:
+            print(f"Error adding trust rating: {e}")
+            return False
+    
+    def rate_deal(self, deal_id: int, rater_id: int, rated_id: int, rating: int,
+                  comment: str = None) -> Tuple[bool, Optional[Deal]]:
+        """Rate a delivered or completed deal, completing it if it was delivered
+        
+        The rating and the completion commit together. Returns whether the
+        rating was recorded and, if this rating completed the deal, the deal.
+        Nothing changes if the deal is not delivered yet or was already rated
+        by rater_id.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO trust_ratings (deal_id, rater_id, rated_id, rating, comment)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (deal_id, rater_id, rated_id, rating, comment))
-                
-                # Update user's trust rating
-                cursor.execute('''
-                    SELECT AVG(rating) as avg_rating, COUNT(*) as total_ratings
-                    FROM trust_ratings 
-                    WHERE rated_id = ?
-                ''', (rated_id,))
-                result = cursor.fetchone()
-                avg_rating, total_ratings = result
+                completed = self._transition_deal(cursor, deal_id, DEAL_STATUS["COMPLETED"])
+                if completed is None:
+                    cursor.execute('SELECT status FROM deals WHERE deal_id = ?', (deal_id,))
+                    row = cursor.fetchone()
+                    if row is None or row[0] != DEAL_STATUS["COMPLETED"]:
+                        return False, None
                 
-                cursor.execute('''
+                if not self._add_trust_rating(cursor, deal_id, rater_id, rated_id, rating, comment):
+                    conn.rollback()
+                    return False, None
+            
+            self.invalidate_user(rated_id)
+            if completed:
+                self.invalidate_user(completed.party_a_id)
+                if completed.party_b_id:
+                    self.invalidate_user(completed.party_b_id)
+            return True, completed
+        except Exception as e:
+            print(f"Error rating deal {deal_id}: {e}")
+            return False, None
+    
+    def reconcile_trust_ratings(self, fix: bool = True) -> List[Dict[str, Any]]:
+        """Rebuild rating aggregates from trust_ratings and report users that drifted"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT u.user_id, u.rating_sum, u.rating_count, u.trust_rating,
+                       COALESCE(r.actual_sum, 0), COALESCE(r.actual_count, 0)
+                FROM users u
+                LEFT JOIN (
+                    SELECT rated_id, SUM(rating) as actual_sum, COUNT(*) as actual_count
+                    FROM trust_ratings
+                    GROUP BY rated_id
+                ) r ON r.rated_id = u.user_id
+                WHERE u.rating_sum != COALESCE(r.actual_sum, 0)
+                   OR u.rating_count != COALESCE(r.actual_count, 0)
+                   OR (r.actual_count > 0 AND
+                       ABS(u.trust_rating - CAST(r.actual_sum AS REAL) / r.actual_count) > 1e-9)
+            ''')
+            drift = [
+                {
+                    'user_id': user_id,
+                    'rating_sum': rating_sum,
+                    'rating_count': rating_count,
+                    'trust_rating': trust_rating,
+                    'actual_sum': actual_sum,
+                    'actual_count': actual_count
+                }
+                for user_id, rating_sum, rating_count, trust_rating, actual_sum, actual_count
+                in cursor.fetchall()
+            ]
+            
+            if fix:
+                cursor.executemany('''
                     UPDATE users 
-                    SET trust_rating = ?
+                    SET rating_sum = ?,
+                        rating_count = ?,
+                        trust_rating = CASE WHEN ? > 0 THEN CAST(? AS REAL) / ? ELSE trust_rating END
                     WHERE user_id = ?
-                ''', (avg_rating, rated_id))
-                
-                conn.commit()
-                return True
-        except Exception as e:
-            print(f"Error adding trust rating: {e}")
-            return False
+                ''', [
+                    (row['actual_sum'], row['actual_count'], row['actual_count'],
+                     row['actual_sum'], row['actual_count'], row['user_id'])
+                    for row in drift
+                ])
+        if fix and drift:
+            self.user_cache.clear()
+        return drift
+    
+    def reconcile_deal_counters(self, fix: bool = True) -> List[Dict[str, Any]]:
+        """Recompute per-user deal counters from deals and report users that drifted"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT user_id, total_deals, successful_deals, actual_total, actual_successful
+                FROM (
+                    SELECT u.user_id, u.total_deals, u.successful_deals,
+                           (SELECT COUNT(*) FROM deals WHERE party_a_id = u.user_id)
+                         + (SELECT COUNT(*) FROM deals
+                            WHERE party_b_id = u.user_id AND party_a_id IS NOT u.user_id) as actual_total,
+                           (SELECT COUNT(*) FROM deals WHERE party_a_id = u.user_id AND status = 'completed')
+                         + (SELECT COUNT(*) FROM deals
+                            WHERE party_b_id = u.user_id AND party_a_id IS NOT u.user_id
+                              AND status = 'completed') as actual_successful
+                    FROM users u
+                )
+                WHERE total_deals IS NOT actual_total OR successful_deals IS NOT actual_successful
+            ''')
+            drift = [
+                {
+                    'user_id': user_id,
+                    'total_deals': total_deals,
+                    'successful_deals': successful_deals,
+                    'actual_total': actual_total,
+                    'actual_successful': actual_successful
+                }
+                for user_id, total_deals, successful_deals, actual_total, actual_successful
+                in cursor.fetchall()
+            ]
+            
+            if fix:
+                cursor.executemany('''
+                    UPDATE users SET total_deals = ?, successful_deals = ? WHERE user_id = ?
+                ''', [
+                    (row['actual_total'], row['actual_successful'], row['user_id'])
+                    for row in drift
+                ])
+        if fix and drift:
+            self.user_cache.clear()
+        return drift
+    
+    def get_stats(self) -> Dict[str, int]:
+        """All materialized counters, '<table>' and '<table>:<status>' -> rows"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, value FROM stats')
+            return dict(cursor.fetchall())
+    
+    def get_dashboard_stats(self) -> Tuple[Dict[str, int], int]:
+        """Dashboard figures and the newest admin event id they include
+        
+        Both come from one statement, so they share a snapshot: live updates
+        after that event id are exactly the changes the figures miss.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT name, value FROM stats
+                UNION ALL
+                SELECT NULL, COALESCE(MAX(event_id), 0) FROM admin_events
+            ''')
+            counters = dict(cursor.fetchall())
+        last_event_id = counters.pop(None)
+        return {key: counters.get(name, 0) for key, name in DASHBOARD_STATS.items()}, last_event_id
+    
+    def reconcile_stats(self, fix: bool = True) -> List[Dict[str, Any]]:
+        """Recount the rows behind the stats counters and report counters that drifted
+        
+        The recount reads a snapshot without taking the write lock, so bot
+        writes carry on during the scans. Fixes are applied as corrections
+        to the counters, not overwrites, so writes that land between the
+        recount and the fix are kept.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # One statement reads the counters and the rows from the same snapshot
+            cursor.execute(f'''
+                SELECT name, MAX(stored), MAX(actual)
+                FROM (
+                    SELECT name, value AS stored, NULL AS actual FROM stats
+                    UNION ALL
+                    SELECT name, NULL, value FROM ({STATS_ACTUAL_SQL})
+                )
+                GROUP BY name
+                HAVING COALESCE(MAX(stored), 0) != COALESCE(MAX(actual), 0)
+            ''')
+            drift = [
+                {'name': name, 'value': value or 0, 'actual': actual or 0}
+                for name, value, actual in cursor.fetchall()
+            ]
+        
+        if fix and drift:
+            with self.connection() as conn:
+                conn.executemany('''
+                    INSERT INTO stats (name, value) VALUES (?, ?)
+                    ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+                ''', [(row['name'], row['actual'] - row['value']) for row in drift])
+        return drift
+    
+    def rebuild_analytics(self) -> Dict[str, int]:
+        """Recompute the analytics rollups from all deals; returns buckets per granularity"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for statement in ANALYTICS_REBUILD_SQL:
+                cursor.execute(statement)
+            cursor.execute('SELECT granularity, COUNT(*) FROM analytics_rollups GROUP BY granularity')
+            return dict(cursor.fetchall())
+    
+    def get_analytics(self, granularity: str, start: datetime,
+                      end: datetime) -> Tuple[List[AnalyticsBucket], AnalyticsBucket]:
+        """Rolled-up figures for every bucket from start to end, and for the whole range
+        
+        Reads only the rollup tables. Buckets without deals are included
+        with zero counts so the series has no gaps.
+        """
+        label, width = ANALYTICS_GRANULARITIES[granularity]
+        first, last = start.strftime(label), end.strftime(label)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT bucket, deals, amount, completed, disputed FROM analytics_rollups
+                WHERE granularity = ? AND bucket BETWEEN ? AND ?
+            ''', (granularity, first, last))
+            rollups = {row[0]: row[1:] for row in cursor.fetchall()}
+            cursor.execute('''
+                SELECT bucket, minutes, deals FROM analytics_confirm_times
+                WHERE granularity = ? AND bucket BETWEEN ? AND ?
+            ''', (granularity, first, last))
+            confirm_times = {}
+            for bucket, minutes, deals in cursor.fetchall():
+                confirm_times.setdefault(bucket, {})[minutes] = deals
+        
+        series = []
+        moment = datetime.strptime(first, label)
+        while moment.strftime(label) <= last:
+            bucket = moment.strftime(label)
+            figures = rollups.get(bucket, (0, 0.0, 0, 0))
+            series.append(AnalyticsBucket(
+                bucket, *figures, median_minutes_to_confirm=histogram_median(confirm_times.get(bucket, {}))
+            ))
+            moment += width
+        
+        overall = {}
+        for histogram in confirm_times.values():
+            for minutes, deals in histogram.items():
+                overall[minutes] = overall.get(minutes, 0) + deals
+        total = AnalyticsBucket(
+            first,
+            sum(item.deals for item in series),
+            sum(item.amount for item in series),
+            sum(item.completed for item in series),
+            sum(item.disputed for item in series),
+            histogram_median(overall)
+        )
+        return series, total
     
-    def get_pending_confirmations(self) -> List[Dict[str, Any]]:
+    def get_pending_confirmations(self) -> List[Deal]:
         """Get deals pending payment confirmation"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT * FROM deals 
                     WHERE status = ? 
                     ORDER BY created_at ASC
                 ''', (DEAL_STATUS["PAYMENT_PENDING"],))
-                rows = cursor.fetchall()
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in rows]
+                build = row_builder(Deal, cursor.description)
+                return [build(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error getting pending confirmations: {e}")
             return []
     
-    def get_open_disputes(self) -> List[Dict[str, Any]]:
+    def get_open_disputes(self) -> List[Dispute]:
         """Get open disputes"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT d.*, deals.amount, deals.description, u.username as raised_by_username
@@ -312,9 +1911,162 @@ class Database:
                     WHERE d.status = 'open'
                     ORDER BY d.created_at ASC
                 ''')
-                rows = cursor.fetchall()
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in rows]
+                build = row_builder(Dispute, cursor.description)
+                return [build(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error getting open disputes: {e}")
             return []
+    
+    def resolve_disputes(self, dispute_ids: List[int], resolution: str,
+                         atomic: bool = False) -> Tuple[List[int], Dict[int, Optional[str]]]:
+        """Resolve many open disputes with the same resolution in one transaction
+        
+        Returns the ids resolved and, for each dispute that was not, its
+        current status (None if it does not exist). With atomic, nothing is
+        resolved unless every dispute can be.
+        """
+        ids = json.dumps(dispute_ids)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE disputes 
+                SET status = 'resolved', resolution = ?, resolved_at = CURRENT_TIMESTAMP
+                WHERE dispute_id IN (SELECT value FROM json_each(?)) AND status = 'open'
+                RETURNING dispute_id
+            ''', (resolution, ids))
+            resolved = {row[0] for row in cursor.fetchall()}
+            
+            rejected = {dispute_id: None for dispute_id in dispute_ids if dispute_id not in resolved}
+            if rejected:
+                cursor.execute(
+                    'SELECT dispute_id, status FROM disputes WHERE dispute_id IN (SELECT value FROM json_each(?))',
+                    (json.dumps(list(rejected)),)
+                )
+                rejected.update(cursor.fetchall())
+                if atomic:
+                    conn.rollback()
+                    return [], rejected
+        return [dispute_id for dispute_id in dispute_ids if dispute_id in resolved], rejected
+
+class AsyncDatabase:
+    """Awaitable facade over Database for use inside the bot's event loop.
+    
+    Every public Database method is available as a coroutine with the same
+    signature. Calls run on a dedicated, bounded thread pool so SQLite work
+    never blocks the event loop. At most max_pending calls are accepted at
+    once (running or waiting for a worker); past that a call raises
+    sqlite3.OperationalError at once, keeping queueing delay bounded.
+    """
+    
+    def __init__(self, database: Database = None, max_workers: int = DB_ASYNC_WORKERS,
+                 max_pending: int = DB_ASYNC_MAX_PENDING):
+        self.database = database or Database()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self.max_pending = max_pending
+        self._pending = 0
+        self._wrappers = {}
+    
+    def __getattr__(self, name: str):
+        attr = getattr(self.database, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            async def wrapper(*args, **kwargs):
+                return await self.run(attr, *args, **kwargs)
+            wrapper.__name__ = name
+            wrapper.__doc__ = attr.__doc__
+            self._wrappers[name] = wrapper
+        return wrapper
+    
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking callable on the database executor"""
+        if self._pending >= self.max_pending:
+            raise sqlite3.OperationalError(
+                f"database overloaded: {self._pending} calls pending (DB_ASYNC_MAX_PENDING={self.max_pending})"
+            )
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        try:
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        finally:
+            self._pending -= 1
+    
+    def close(self):
+        """Stop the executor and close pooled connections"""
+        self._executor.shutdown(wait=True)
+        self.database.close()
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description="Escrow bot database maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="Apply pending schema migrations")
+    subparsers.add_parser("check-plans", help="Verify hot queries are served by indexes")
+    reconcile_ratings = subparsers.add_parser(
+        "reconcile-ratings", help="Rebuild trust rating aggregates and report drift"
+    )
+    reconcile_ratings.add_argument("--dry-run", action="store_true", help="Report drift without fixing it")
+    reconcile_counters = subparsers.add_parser(
+        "reconcile-deal-counters", help="Recompute per-user deal counters and report drift"
+    )
+    reconcile_counters.add_argument("--dry-run", action="store_true", help="Report drift without fixing it")
+    reconcile_stats = subparsers.add_parser(
+        "reconcile-stats", help="Recount the dashboard counters and report drift"
+    )
+    reconcile_stats.add_argument("--dry-run", action="store_true", help="Report drift without fixing it")
+    subparsers.add_parser("backfill-analytics", help="Rebuild the analytics rollups from all deals")
+    export = subparsers.add_parser("export", help="Write a table as CSV")
+    export.add_argument("table", choices=sorted(EXPORTS))
+    export.add_argument("--output", help="File to write (default: standard output)")
+    args = parser.parse_args()
+    
+    database = Database()
+    if args.command == "migrate":
+        print(f"Schema version: {database.get_schema_version()}")
+    elif args.command == "check-plans":
+        violations = database.check_query_plans()
+        for name, details in violations.items():
+            print(f"{name}: full table scan")
+            for detail in details:
+                print(f"    {detail}")
+        if violations:
+            sys.exit(1)
+        print(f"All {len(HOT_QUERIES)} hot queries use indexes")
+    elif args.command == "reconcile-ratings":
+        drift = database.reconcile_trust_ratings(fix=not args.dry_run)
+        for row in drift:
+            print(
+                f"user {row['user_id']}: sum {row['rating_sum']} -> {row['actual_sum']}, "
+                f"count {row['rating_count']} -> {row['actual_count']}"
+            )
+        action = "found" if args.dry_run else "fixed"
+        print(f"{len(drift)} users with drifted ratings {action}")
+    elif args.command == "reconcile-deal-counters":
+        drift = database.reconcile_deal_counters(fix=not args.dry_run)
+        for row in drift:
+            print(
+                f"user {row['user_id']}: total {row['total_deals']} -> {row['actual_total']}, "
+                f"successful {row['successful_deals']} -> {row['actual_successful']}"
+            )
+        action = "found" if args.dry_run else "fixed"
+        print(f"{len(drift)} users with drifted deal counters {action}")
+    elif args.command == "reconcile-stats":
+        drift = database.reconcile_stats(fix=not args.dry_run)
+        for row in drift:
+            print(f"{row['name']}: {row['value']} -> {row['actual']}")
+        action = "found" if args.dry_run else "fixed"
+        print(f"{len(drift)} drifted counters {action}")
+    elif args.command == "backfill-analytics":
+        buckets = database.rebuild_analytics()
+        print(", ".join(f"{count} {granularity} buckets" for granularity, count in buckets.items()) or "No deals")
+    elif args.command == "export":
+        if args.output:
+            with open(args.output, "w", newline="") as output:
+                count = database.export_csv(args.table, output)
+            print(f"Exported {count} {args.table} to {args.output}")
+        else:
+            database.export_csv(args.table, sys.stdout)
@@ -1,26 +1,143 @@
+import inspect
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
-from database import Database
+from telegram.ext import ContextTypes, ApplicationHandlerStop
+from cache import LRUCache
+from database import AsyncDatabase, SNIPPET_START, SNIPPET_END
+from state_store import create_state_store
+from notifications import notifier, PRIORITY_ADMIN, PRIORITY_USER, PRIORITY_COMPLETION
+from qr_render import QRRenderPool
+from rate_limit import RateLimiter
 from utils import (
-    generate_upi_qr, format_amount, format_deal_info, 
+    upi_payment_link, format_amount, format_deal_info, 
     validate_username, validate_amount, get_trust_rating_display,
-    create_payment_keyboard, create_delivery_keyboard, create_rating_keyboard
+    create_payment_keyboard, create_delivery_keyboard, create_rating_keyboard,
+    create_status_page_keyboard
+)
+from config import (
+    COMMANDS, DEAL_STATUS, SUPPORT_CONTACT, ANIMATIONS, ADMIN_USER_ID, UPI_ID,
+    STATUS_PAGE_SIZE, UPDATE_DEDUP_SIZE, UPDATE_DEDUP_TTL, CALLBACK_DEDUP_TTL, ADMIN_SEARCH_BOT_RESULTS
 )
-from config import COMMANDS, DEAL_STATUS, SUPPORT_CONTACT, ANIMATIONS, ADMIN_USER_ID
-
-# Initialize database
-db = Database()
 
-# User state tracking
-user_states = {}
+# Initialize database (queries run off the event loop)
+db = AsyncDatabase()
+
+# QR codes are rendered on worker threads
+qr_renderer = QRRenderPool()
+
+# User state tracking (bounded, expiring and persisted across restarts)
+user_states = create_state_store(db.database)
+
+# Recently seen update ids and (user, action, deal) button presses
+seen_updates = LRUCache(UPDATE_DEDUP_SIZE, ttl=UPDATE_DEDUP_TTL)
+recent_callbacks = LRUCache(UPDATE_DEDUP_SIZE, ttl=CALLBACK_DEDUP_TTL)
+
+# Button presses a handler answered itself: query id -> whether it showed an alert
+answered_callbacks = LRUCache(UPDATE_DEDUP_SIZE, ttl=CALLBACK_DEDUP_TTL)
+
+# Per-user, per-command and global request budgets
+rate_limiter = RateLimiter()
+
+# Callback routing table: action prefix -> (handler(update, context, *args),
+# whether each argument must be numeric)
+CALLBACK_ROUTES = {}
+IDEMPOTENT_ACTIONS = set()
+
+def callback_route(action: str, idempotent: bool = False):
+    """Register a handler for callback data of the form "<action>:<arg>:<arg>..."
+    
+    The handler's parameters after update and context give the expected
+    arguments; those annotated int must be numeric. Repeat presses of an
+    idempotent action for the same deal by the same user within
+    CALLBACK_DEDUP_TTL are dropped before the handler runs.
+    """
+    def register(handler):
+        params = list(inspect.signature(handler).parameters.values())[2:]
+        CALLBACK_ROUTES[action] = (handler, tuple(param.annotation is int for param in params))
+        if idempotent:
+            IDEMPOTENT_ACTIONS.add(action)
+        return handler
+    return register
+
+def parse_callback_args(numeric: tuple, args: list):
+    """Arguments for a route, numeric ones as ints; None if they don't fit it"""
+    if len(args) != len(numeric):
+        return None
+    if any(is_numeric and not arg.isdigit() for is_numeric, arg in zip(numeric, args)):
+        return None
+    return [int(arg) if is_numeric else arg for is_numeric, arg in zip(numeric, args)]
+
+async def answer_callback(query, text: str = None, show_alert: bool = False):
+    """Answer a button press; presses a handler doesn't answer are answered after it"""
+    answered_callbacks.set(query.id, show_alert)
+    await query.answer(text, show_alert=show_alert)
+
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop updates Telegram delivered more than once before any handler runs"""
+    if seen_updates.get(update.update_id):
+        logging.info(f"Dropping duplicate update {update.update_id}")
+        raise ApplicationHandlerStop
+    seen_updates.set(update.update_id, True)
+
+def rate_limit_bucket(update: Update) -> str:
+    """Name of the per-command budget an update counts against"""
+    if update.callback_query:
+        return "callback"
+    text = update.message.text if update.message and update.message.text else ""
+    if text.startswith("/"):
+        return text.split()[0][1:].split("@")[0].lower()
+    return "message"
+
+async def rate_limit_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop updates from users over their budget, warning them at most once per interval"""
+    user = update.effective_user
+    if user is None or str(user.id) == ADMIN_USER_ID:
+        return
+    if rate_limiter.allow(user.id, rate_limit_bucket(update)):
+        return
+    
+    warn = rate_limiter.should_warn(user.id)
+    if update.callback_query:
+        # Always answer, or the button keeps spinning until Telegram gives up
+        if warn:
+            await update.callback_query.answer("⏳ Too many requests, please wait a moment", show_alert=True)
+        else:
+            await update.callback_query.answer()
+    elif warn and update.effective_message:
+        await update.effective_message.reply_text(
+            "⏳ **Slow down**\n\nYou're sending requests too quickly. Please wait a moment and try again.",
+            parse_mode='Markdown'
+        )
+    raise ApplicationHandlerStop
+
+async def get_callback_deal(query, deal_id: int, buyer_only: bool = False):
+    """Look up the deal a button refers to, if the pressing user is a party to it"""
+    deal = await db.get_deal(deal_id)
+    if deal:
+        user = query.from_user
+        if deal.party_a_id == user.id:
+            return deal
+        is_seller = deal.party_b_id == user.id or (
+            deal.party_b_id is None and user.username
+            and (deal.party_b_username or '').lower() == user.username.lower()
+        )
+        if is_seller and not buyer_only:
+            if deal.party_b_id is None:
+                await db.bind_party_b(user.id, user.username)
+                deal = deal._replace(party_b_id=user.id)
+            return deal
+    
+    await answer_callback(query, "❌ Deal not found", show_alert=True)
+    return None
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user = update.effective_user
     
-    # Add user to database
-    db.add_user(user.id, user.username, user.first_name, user.last_name)
+    # Add user to database (unchanged profiles are skipped, changes are batched)
+    await db.queue_user_update(user.id, user.username, user.first_name, user.last_name)
+    # Link deals that named this user as seller before they started the bot
+    await db.bind_party_b(user.id, user.username)
     
     welcome_message = f"""
 🛡️ **Welcome to Escrow Bot!**
@@ -80,7 +197,7 @@ async def newdeal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Check if user exists in database
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     if not user:
         await update.message.reply_text("❌ Please start the bot first using /start")
         return
@@ -95,41 +212,83 @@ async def newdeal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+async def build_status_page(user_id: int, before_deal_id: int = None, after_deal_id: int = None):
+    """Build the text and keyboard for one /status page, or (None, None) if empty"""
+    # Fetch one extra deal to learn whether a further page exists
+    deals = await db.get_user_deals_page(
+        user_id,
+        limit=STATUS_PAGE_SIZE + 1,
+        before_deal_id=before_deal_id,
+        after_deal_id=after_deal_id
+    )
+    if not deals:
+        return None, None
+    
+    has_more = len(deals) > STATUS_PAGE_SIZE
+    if after_deal_id is not None:
+        # Paging back towards newer deals: the extra deal is at the front
+        deals = deals[-STATUS_PAGE_SIZE:]
+        has_previous, has_next = has_more, True
+    else:
+        deals = deals[:STATUS_PAGE_SIZE]
+        has_previous, has_next = before_deal_id is not None, has_more
+    
+    total_deals = await db.count_user_deals(user_id)
+    
+    status_message = f"📊 **Your Deals ({total_deals} total):**\n\n"
+    
+    for deal in deals:
+        status_message += format_deal_info(deal) + "\n"
+    
+    keyboard = create_status_page_keyboard(
+        deals[0].deal_id, deals[-1].deal_id, has_previous, has_next
+    )
+    return status_message, keyboard
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command"""
     user_id = update.effective_user.id
     
-    deals = db.get_user_deals(user_id)
+    status_message, keyboard = await build_status_page(user_id)
     
-    if not deals:
+    if not status_message:
         await update.message.reply_text(
             "📭 **No Deals Found**\n\n"
             "You don't have any deals yet. Create your first deal with /newdeal!"
         )
         return
     
-    status_message = "📊 **Your Deals:**\n\n"
+    await update.message.reply_text(status_message, reply_markup=keyboard, parse_mode='Markdown')
+
+@callback_route("status")
+async def handle_status_page(update: Update, context: ContextTypes.DEFAULT_TYPE, direction: str, cursor_deal_id: int):
+    """Handle /status next/previous page buttons"""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    for deal in deals[:5]:  # Show last 5 deals
-        status_message += format_deal_info(deal) + "\n"
+    if direction == "next":
+        status_message, keyboard = await build_status_page(user_id, before_deal_id=cursor_deal_id)
+    else:
+        status_message, keyboard = await build_status_page(user_id, after_deal_id=cursor_deal_id)
     
-    if len(deals) > 5:
-        status_message += f"\n... and {len(deals) - 5} more deals"
+    if not status_message:
+        await answer_callback(query, "📭 No more deals", show_alert=True)
+        return
     
-    await update.message.reply_text(status_message, parse_mode='Markdown')
+    await query.edit_message_text(text=status_message, reply_markup=keyboard, parse_mode='Markdown')
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle regular text messages based on user state"""
     user_id = update.effective_user.id
     message_text = update.message.text
     
-    if user_id not in user_states:
+    state_data = user_states.get(user_id)
+    if state_data is None:
         await update.message.reply_text(
             "❓ I don't understand. Use /help to see available commands."
         )
         return
     
-    state_data = user_states[user_id]
     current_state = state_data["state"]
     
     if current_state == "waiting_amount":
@@ -160,8 +319,10 @@ async def handle_amount_input(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     # Update state
-    user_states[user_id]["amount"] = amount
-    user_states[user_id]["state"] = "waiting_counterparty"
+    state_data = user_states[user_id]
+    state_data["amount"] = amount
+    state_data["state"] = "waiting_counterparty"
+    user_states[user_id] = state_data
     
     await update.message.reply_text(
         f"✅ Amount set: {format_amount(amount)}\n\n"
@@ -186,8 +347,8 @@ async def handle_counterparty_input(update: Update, context: ContextTypes.DEFAUL
         return
     
     # Check if it's not the same user
-    current_user = db.get_user(user_id)
-    if current_user and current_user['username'] and current_user['username'].lower() == username:
+    current_user = await db.get_user(user_id)
+    if current_user and current_user.username and current_user.username.lower() == username:
         await update.message.reply_text(
             "❌ **Invalid Counterparty**\n\n"
             "You cannot create a deal with yourself!"
@@ -195,8 +356,10 @@ async def handle_counterparty_input(update: Update, context: ContextTypes.DEFAUL
         return
     
     # Update state
-    user_states[user_id]["counterparty"] = username
-    user_states[user_id]["state"] = "waiting_description"
+    state_data = user_states[user_id]
+    state_data["counterparty"] = username
+    state_data["state"] = "waiting_description"
+    user_states[user_id] = state_data
     
     await update.message.reply_text(
         f"✅ Counterparty set: @{username}\n\n"
@@ -217,8 +380,16 @@ async def handle_description_input(update: Update, context: ContextTypes.DEFAULT
         )
         return
     
+    # Refuse before creating the deal, so retrying can't leave a duplicate
+    if qr_renderer.busy:
+        await update.message.reply_text(
+            "⏳ **We're busy right now**\n\n"
+            "Please send your description again in a few seconds"
+        )
+        return
+    
     # Create deal
-    deal_id = db.create_deal(
+    deal_id = await db.create_deal(
         party_a_id=user_id,
         party_b_username=state_data["counterparty"],
         amount=state_data["amount"],
@@ -234,10 +405,10 @@ async def handle_description_input(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Update deal status to payment pending
-    db.update_deal_status(deal_id, DEAL_STATUS["PAYMENT_PENDING"])
+    await db.update_deal_status(deal_id, DEAL_STATUS["PAYMENT_PENDING"])
     
     # Generate QR code
-    qr_bytes = generate_upi_qr(state_data["amount"], deal_id)
+    qr_bytes = await qr_renderer.render(upi_payment_link(state_data["amount"], deal_id))
     
     deal_summary = f"""
 🎯 **Deal Created Successfully!**
@@ -249,13 +420,13 @@ async def handle_description_input(update: Update, context: ContextTypes.DEFAULT
 
 💳 **Payment Instructions:**
 1. Scan the QR code below OR
-2. Pay to UPI ID: `{db.UPI_ID}`
+2. Pay to UPI ID: `{UPI_ID}`
 3. Click "Payment Done" after payment
 
 ⚠️ **Important:** Only proceed with payment if you trust the counterparty!
 """
     
-    keyboard = create_payment_keyboard()
+    keyboard = create_payment_keyboard(deal_id)
     
     # Send deal summary
     await update.message.reply_text(deal_summary, parse_mode='Markdown')
@@ -270,7 +441,7 @@ async def handle_description_input(update: Update, context: ContextTypes.DEFAULT
         )
     else:
         await update.message.reply_text(
-            f"📱 **Manual Payment**\n\nUPI ID: `{db.UPI_ID}`\nAmount: {format_amount(state_data['amount'])}",
+            f"📱 **Manual Payment**\n\nUPI ID: `{UPI_ID}`\nAmount: {format_amount(state_data['amount'])}",
             reply_markup=keyboard,
             parse_mode='Markdown'
         )
@@ -293,7 +464,7 @@ async def handle_dispute_reason(update: Update, context: ContextTypes.DEFAULT_TY
     deal_id = state_data["deal_id"]
     
     # Create dispute
-    dispute_id = db.create_dispute(deal_id, user_id, reason.strip())
+    dispute_id = await db.create_dispute(deal_id, user_id, reason.strip())
     
     if dispute_id:
         await update.message.reply_text(
@@ -307,14 +478,12 @@ async def handle_dispute_reason(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Notify admin (if different from user)
         if str(user_id) != ADMIN_USER_ID:
-            try:
-                await context.bot.send_message(
-                    chat_id=ADMIN_USER_ID,
-                    text=f"🚨 **New Dispute**\n\nDispute ID: #{dispute_id}\nDeal ID: #{deal_id}\nRaised by: {update.effective_user.username or update.effective_user.first_name}\nReason: {reason}",
-                    parse_mode='Markdown'
-                )
-            except:
-                pass  # Admin notification failed, continue
+            notifier.send(
+                ADMIN_USER_ID,
+                f"🚨 **New Dispute**\n\nDispute ID: #{dispute_id}\nDeal ID: #{deal_id}\nRaised by: {update.effective_user.username or update.effective_user.first_name}\nReason: {reason}",
+                priority=PRIORITY_ADMIN,
+                parse_mode='Markdown'
+            )
     else:
         await update.message.reply_text(
             "❌ **Error creating dispute**\n\n"
@@ -327,29 +496,50 @@ async def handle_dispute_reason(update: Update, context: ContextTypes.DEFAULT_TY
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle inline keyboard callbacks"""
     query = update.callback_query
-    await query.answer()
     
-    user_id = query.from_user.id
-    data = query.data
-    
-    if data == "payment_done":
-        await handle_payment_done(update, context)
-    elif data == "cancel_deal":
-        await handle_cancel_deal(update, context)
-    elif data == "confirm_delivery":
-        await handle_confirm_delivery(update, context)
-    elif data == "raise_dispute":
-        await handle_raise_dispute_button(update, context)
-    elif data.startswith("rate_"):
-        rating = int(data.split("_")[1])
-        await handle_trust_rating(update, context, rating)
-    elif data.startswith("admin_"):
-        await handle_admin_action(update, context, data)
-
-async def handle_payment_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    action, *args = (query.data or "").split(":")
+    route = CALLBACK_ROUTES.get(action)
+    if route is not None:
+        handler, numeric = route
+        # Deal ids and other numeric arguments are passed as ints
+        args = parse_callback_args(numeric, args)
+    if route is None or args is None:
+        # Buttons from before deal ids were encoded, or malformed data
+        await query.answer("⌛ This button has expired, please use /status", show_alert=True)
+        return
+    
+    press = None
+    if action in IDEMPOTENT_ACTIONS:
+        # Keyed on the deal only, so tapping 4⭐ then 5⭐ also counts as a repeat
+        press = (query.from_user.id, action, args[0] if args else None)
+        if recent_callbacks.get(press):
+            await query.answer("⏳ Already received")
+            return
+    
+    await handler(update, context, *args)
+    
+    # A press can only be answered once, so handlers showing an alert answer it themselves
+    rejected = answered_callbacks.get(query.id)
+    if rejected is None:
+        await query.answer()
+    # Only presses that went through block repeats; a failed or refused press can be retried.
+    # A user's updates run one at a time, so a double tap waits for this one to finish.
+    if press and not rejected:
+        recent_callbacks.set(press, True)
+
+@callback_route("payment_done", idempotent=True)
+async def handle_payment_done(update: Update, context: ContextTypes.DEFAULT_TYPE, deal_id: int):
     """Handle payment done button"""
     query = update.callback_query
-    user_id = query.from_user.id
+    
+    deal = await get_callback_deal(query, deal_id, buyer_only=True)
+    if not deal:
+        return
+    
+    # Only an unpaid deal can be reported as paid
+    if deal.status != DEAL_STATUS["PAYMENT_PENDING"]:
+        await answer_callback(query, "❌ Invalid deal status", show_alert=True)
+        return
     
     # Show loading animation
     await query.edit_message_caption(
@@ -359,41 +549,32 @@ async def handle_payment_done(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Notify admin for manual confirmation
     try:
-        # Get the latest deal for this user
-        deals = db.get_user_deals(user_id)
-        if deals:
-            latest_deal = deals[0]
-            
-            admin_message = f"""
+        admin_message = f"""
 🔔 **Payment Confirmation Required**
 
-**Deal ID:** #{latest_deal['deal_id']}
-**Amount:** {format_amount(latest_deal['amount'])}
+**Deal ID:** #{deal.deal_id}
+**Amount:** {format_amount(deal.amount)}
 **Payer:** @{query.from_user.username or query.from_user.first_name}
-**Description:** {latest_deal['description']}
+**Description:** {deal.description}
 
 Please verify the payment and confirm below:
 """
-            
-            keyboard = InlineKeyboardButton("✅ Confirm Payment", callback_data=f"admin_confirm_{latest_deal['deal_id']}")
-            admin_keyboard = InlineKeyboardMarkup([[keyboard]])
-            
-            await context.bot.send_message(
-                chat_id=ADMIN_USER_ID,
-                text=admin_message,
-                reply_markup=admin_keyboard,
-                parse_mode='Markdown'
-            )
-            
-            await query.edit_message_caption(
-                caption=f"{ANIMATIONS['waiting']}\n\nYour payment notification has been sent to our team. You'll be notified once confirmed!",
-                parse_mode='Markdown'
-            )
-        else:
-            await query.edit_message_caption(
-                caption="❌ No active deal found. Please create a new deal.",
-                parse_mode='Markdown'
-            )
+        
+        keyboard = InlineKeyboardButton("✅ Confirm Payment", callback_data=f"admin_confirm:{deal.deal_id}")
+        admin_keyboard = InlineKeyboardMarkup([[keyboard]])
+        
+        notifier.send(
+            ADMIN_USER_ID,
+            admin_message,
+            priority=PRIORITY_ADMIN,
+            reply_markup=admin_keyboard,
+            parse_mode='Markdown'
+        )
+        
+        await query.edit_message_caption(
+            caption=f"{ANIMATIONS['waiting']}\n\nYour payment notification has been sent to our team. You'll be notified once confirmed!",
+            parse_mode='Markdown'
+        )
     except Exception as e:
         logging.error(f"Error in payment done handler: {e}")
         await query.edit_message_caption(
@@ -401,38 +582,56 @@ Please verify the payment and confirm below:
             parse_mode='Markdown'
         )
 
-async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE, action_data: str):
-    """Handle admin actions"""
+@callback_route("cancel_deal", idempotent=True)
+async def handle_cancel_deal(update: Update, context: ContextTypes.DEFAULT_TYPE, deal_id: int):
+    """Handle cancel deal button"""
+    query = update.callback_query
+    
+    deal = await get_callback_deal(query, deal_id, buyer_only=True)
+    if not deal:
+        return
+    
+    # Only deals that have not been paid for can be cancelled
+    if await db.update_deal_status(deal.deal_id, DEAL_STATUS["CANCELLED"]):
+        await query.edit_message_caption(
+            caption=f"❌ **Deal Cancelled**\n\nDeal #{deal.deal_id} has been cancelled.",
+            parse_mode='Markdown'
+        )
+    else:
+        await answer_callback(query, "❌ This deal can no longer be cancelled", show_alert=True)
+
+@callback_route("admin_confirm", idempotent=True)
+async def handle_admin_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, deal_id: int):
+    """Handle admin payment confirmation"""
     query = update.callback_query
     user_id = query.from_user.id
     
     # Check if user is admin
     if str(user_id) != ADMIN_USER_ID:
-        await query.answer("❌ Unauthorized access", show_alert=True)
+        await answer_callback(query, "❌ Unauthorized access", show_alert=True)
         return
     
-    if action_data.startswith("admin_confirm_"):
-        deal_id = int(action_data.split("_")[2])
-        
-        # Confirm payment
-        if db.confirm_payment(deal_id):
-            deal = db.get_deal(deal_id)
-            
-            await query.edit_message_text(
-                text=f"✅ **Payment Confirmed**\n\nDeal #{deal_id} payment has been confirmed and funds are now in escrow.",
-                parse_mode='Markdown'
-            )
-            
-            # Notify buyer
-            try:
-                success_message = f"""
+    # Confirm payment; the updated deal comes back with the buyer's username
+    deal = await db.confirm_payment(deal_id)
+    if not deal:
+        await answer_callback(query, "❌ Deal not found or payment already confirmed", show_alert=True)
+        return
+    
+    await query.edit_message_text(
+        text=f"✅ **Payment Confirmed**\n\nDeal #{deal_id} payment has been confirmed and funds are now in escrow.",
+        parse_mode='Markdown'
+    )
+    
+    # Notify buyer
+    try:
+        success_message = f"""
 {ANIMATIONS['success']}
 
 **Deal #{deal_id}** payment confirmed! 
 Funds are now safely held in escrow.
 
 💡 **Next Steps:**
-• Wait for delivery from @{deal['party_b_username']}
+• Wait for delivery from @{deal.party_b_username}
 • Once delivered, use the buttons below to proceed
 
 **What happens next?**
@@ -440,151 +639,162 @@ Funds are now safely held in escrow.
 • After delivery, confirm to release payment
 • Rate your experience
 """
-                
-                delivery_keyboard = create_delivery_keyboard()
-                
-                await context.bot.send_message(
-                    chat_id=deal['party_a_id'],
-                    text=success_message,
-                    reply_markup=delivery_keyboard,
-                    parse_mode='Markdown'
-                )
-                
-                # Notify seller if we have their user ID
-                if deal['party_b_id']:
-                    seller_message = f"""
+        
+        delivery_keyboard = create_delivery_keyboard(deal_id)
+        
+        notifier.send(
+            deal.party_a_id,
+            success_message,
+            priority=PRIORITY_USER,
+            reply_markup=delivery_keyboard,
+            parse_mode='Markdown'
+        )
+        
+        # Notify seller, linking the deal to them if they registered after it was created
+        seller_id = deal.party_b_id
+        if seller_id is None and deal.party_b_username:
+            seller = await db.get_user_by_username(deal.party_b_username)
+            if seller:
+                seller_id = seller.user_id
+                await db.bind_party_b(seller.user_id, seller.username)
+        if seller_id is None:
+            logging.warning(f"Deal {deal.deal_id}: seller @{deal.party_b_username} not registered, not notified")
+        else:
+            buyer_username = deal.party_a_username or 'Unknown'
+            seller_message = f"""
 🔔 **New Escrow Deal for You!**
 
-**Deal ID:** #{deal['deal_id']}
-**Amount:** {format_amount(deal['amount'])}
-**Buyer:** @{db.get_user(deal['party_a_id'])['username'] or 'Unknown'}
-**Description:** {deal['description']}
+**Deal ID:** #{deal.deal_id}
+**Amount:** {format_amount(deal.amount)}
+**Buyer:** @{buyer_username}
+**Description:** {deal.description}
 
 💰 Payment has been confirmed and is safely held in escrow!
 Proceed with delivery as agreed.
 
-Contact buyer for coordination: @{db.get_user(deal['party_a_id'])['username'] or 'Unknown'}
+Contact buyer for coordination: @{buyer_username}
 """
-                    
-                    await context.bot.send_message(
-                        chat_id=deal['party_b_id'],
-                        text=seller_message,
-                        parse_mode='Markdown'
-                    )
-            except Exception as e:
-                logging.error(f"Error notifying parties: {e}")
-        else:
-            await query.answer("❌ Error confirming payment", show_alert=True)
+            
+            notifier.send(
+                seller_id,
+                seller_message,
+                priority=PRIORITY_USER,
+                parse_mode='Markdown'
+            )
+    except Exception as e:
+        logging.error(f"Error notifying parties: {e}")
 
-async def handle_confirm_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route("confirm_delivery", idempotent=True)
+async def handle_confirm_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE, deal_id: int):
     """Handle delivery confirmation"""
     query = update.callback_query
-    user_id = query.from_user.id
     
-    # Get latest deal for this user
-    deals = db.get_user_deals(user_id)
-    if not deals:
-        await query.answer("❌ No deals found", show_alert=True)
+    deal = await get_callback_deal(query, deal_id, buyer_only=True)
+    if not deal:
         return
     
-    latest_deal = deals[0]
-    
-    if latest_deal['status'] != DEAL_STATUS["PAYMENT_CONFIRMED"]:
-        await query.answer("❌ Invalid deal status", show_alert=True)
-        return
-    
-    # Confirm delivery
-    if db.confirm_delivery(latest_deal['deal_id']):
+    # Confirm delivery (only applies while payment is confirmed)
+    if await db.confirm_delivery(deal.deal_id):
         await query.edit_message_text(
-            text=f"✅ **Delivery Confirmed!**\n\nDeal #{latest_deal['deal_id']} has been marked as delivered.\n\nPlease rate your experience:",
-            reply_markup=create_rating_keyboard(),
+            text=f"✅ **Delivery Confirmed!**\n\nDeal #{deal.deal_id} has been marked as delivered.\n\nPlease rate your experience:",
+            reply_markup=create_rating_keyboard(deal.deal_id),
             parse_mode='Markdown'
         )
     else:
-        await query.answer("❌ Error confirming delivery", show_alert=True)
+        await answer_callback(query, "❌ Invalid deal status", show_alert=True)
 
-async def handle_raise_dispute_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route("raise_dispute", idempotent=True)
+async def handle_raise_dispute_button(update: Update, context: ContextTypes.DEFAULT_TYPE, deal_id: int):
     """Handle raise dispute button"""
     query = update.callback_query
     user_id = query.from_user.id
     
-    # Get latest deal for this user
-    deals = db.get_user_deals(user_id)
-    if not deals:
-        await query.answer("❌ No deals found", show_alert=True)
+    deal = await get_callback_deal(query, deal_id)
+    if not deal:
         return
     
-    latest_deal = deals[0]
-    
     # Set user state for dispute creation
     user_states[user_id] = {
         "state": "waiting_dispute_reason",
-        "deal_id": latest_deal['deal_id']
+        "deal_id": deal.deal_id
     }
     
     await query.edit_message_text(
-        text=f"🚨 **Raising Dispute for Deal #{latest_deal['deal_id']}**\n\nPlease describe the issue in detail:",
+        text=f"🚨 **Raising Dispute for Deal #{deal.deal_id}**\n\nPlease describe the issue in detail:",
         parse_mode='Markdown'
     )
 
-async def handle_trust_rating(update: Update, context: ContextTypes.DEFAULT_TYPE, rating: int):
+@callback_route("rate", idempotent=True)
+async def handle_trust_rating(update: Update, context: ContextTypes.DEFAULT_TYPE, deal_id: int, rating: int):
     """Handle trust rating submission"""
     query = update.callback_query
     user_id = query.from_user.id
     
-    # Get latest deal for this user
-    deals = db.get_user_deals(user_id)
-    if not deals:
-        await query.answer("❌ No deals found", show_alert=True)
+    if rating not in range(1, 6):
+        await answer_callback(query, "❌ Invalid rating", show_alert=True)
         return
     
-    latest_deal = deals[0]
+    deal = await get_callback_deal(query, deal_id)
+    if not deal:
+        return
     
     # Determine who to rate (the other party)
-    if latest_deal['party_a_id'] == user_id:
-        # Rating party B
-        rated_user = db.get_user_by_username(latest_deal['party_b_username'])
+    if deal.party_a_id == user_id and deal.party_b_id:
+        rated_id = deal.party_b_id
+    elif deal.party_a_id == user_id:
+        # Rating party B, who has not been linked to the deal by id
+        rated_user = await db.get_user_by_username(deal.party_b_username)
         if rated_user:
-            rated_id = rated_user['user_id']
+            rated_id = rated_user.user_id
         else:
-            await query.answer("❌ Cannot find counterparty", show_alert=True)
+            await answer_callback(query, "❌ Cannot find counterparty", show_alert=True)
             return
     else:
         # Rating party A
-        rated_id = latest_deal['party_a_id']
+        rated_id = deal.party_a_id
     
-    # Add trust rating
-    if db.add_trust_rating(latest_deal['deal_id'], user_id, rated_id, rating):
-        # Complete the deal
-        db.update_deal_status(latest_deal['deal_id'], DEAL_STATUS["COMPLETED"])
-        
-        stars = "⭐" * rating
+    # Rate, completing the deal in the same transaction if it was just delivered
+    rated, completed = await db.rate_deal(deal.deal_id, user_id, rated_id, rating)
+    if not rated:
+        await answer_callback(
+            query, "❌ Rating not recorded, this deal is not delivered yet or was already rated", show_alert=True
+        )
+        return
+    
+    stars = "⭐" * rating
+    if not completed:
+        # The other party already completed the deal
         await query.edit_message_text(
-            text=f"🎉 **Deal Completed!**\n\nThank you for rating: {stars} {rating}/5\n\nDeal #{latest_deal['deal_id']} is now complete!",
+            text=f"⭐ **Thank you for rating!**\n\nYou rated deal #{deal.deal_id}: {stars} {rating}/5",
             parse_mode='Markdown'
         )
-        
-        # Notify the other party about completion
-        try:
-            other_party_id = rated_id
-            completion_message = f"""
+        return
+    
+    await query.edit_message_text(
+        text=f"🎉 **Deal Completed!**\n\nThank you for rating: {stars} {rating}/5\n\nDeal #{deal.deal_id} is now complete!",
+        parse_mode='Markdown'
+    )
+    
+    # Notify the other party about completion
+    try:
+        other_party_id = rated_id
+        completion_message = f"""
 🎉 **Deal Completed!**
 
-Deal #{latest_deal['deal_id']} has been completed successfully!
+Deal #{deal.deal_id} has been completed successfully!
 You received a {stars} {rating}/5 rating.
 
 Thank you for using Escrow Bot! 🤝
 """
-            
-            await context.bot.send_message(
-                chat_id=other_party_id,
-                text=completion_message,
-                parse_mode='Markdown'
-            )
-        except:
-            pass  # Notification failed, but deal is still complete
-    else:
-        await query.answer("❌ Error submitting rating", show_alert=True)
+        
+        notifier.send(
+            other_party_id,
+            completion_message,
+            priority=PRIORITY_COMPLETION,
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        logging.error(f"Error queueing completion notice: {e}")
 
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /admin command - admin only"""
@@ -594,15 +804,16 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Unauthorized access")
         return
     
-    # Get pending confirmations and disputes
-    pending_payments = db.get_pending_confirmations()
-    open_disputes = db.get_open_disputes()
+    stats, _ = await db.get_dashboard_stats()
+    queue_metrics = notifier.metrics()
     
     admin_message = f"""
 🔧 **Admin Panel**
 
-**Pending Payment Confirmations:** {len(pending_payments)}
-**Open Disputes:** {len(open_disputes)}
+**Pending Payment Confirmations:** {stats['pending_payments']}
+**Open Disputes:** {stats['open_disputes']}
+**Outbound Queue:** {sum(queue_metrics['queued'].values())} queued, {queue_metrics['failed']} failed
+**Throttled Requests:** {rate_limiter.rejected}
 
 **Quick Actions:**
 • View pending payments: /admin_payments
@@ -614,6 +825,37 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(admin_message, parse_mode='Markdown')
 
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /search <text> - admin only"""
+    user_id = update.effective_user.id
+    
+    if str(user_id) != ADMIN_USER_ID:
+        await update.message.reply_text("❌ Unauthorized access")
+        return
+    
+    text = ' '.join(context.args or [])
+    if not text:
+        await update.message.reply_text("Usage: /search <username, name, description or dispute reason>")
+        return
+    
+    results = await db.search(text, limit=ADMIN_SEARCH_BOT_RESULTS)
+    if not results.items:
+        await update.message.reply_text(f"🔍 Nothing matches \"{text}\"")
+        return
+    
+    # Plain text: names and descriptions are user input and may break Markdown
+    lines = [f"🔍 Top matches for \"{text}\":", ""]
+    for result in results.items:
+        heading = f"{result.kind.title()} #{result.ref_id} {result.title}"
+        if result.status:
+            heading += f" [{result.status.replace('_', ' ')}]"
+        snippet = result.snippet.replace(SNIPPET_START, '«').replace(SNIPPET_END, '»')
+        lines.append(f"• {heading}\n  {snippet}")
+    if results.has_next:
+        lines.append("\nMore results: http://localhost:5000/admin/search")
+    
+    await update.message.reply_text('\n'.join(lines))
+
 # Error handler
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors"""
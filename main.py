@@ -28,9 +28,9 @@ from pathlib import Path
 # Add current directory to Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from config import BOT_TOKEN, WEB_HOST, WEB_PORT
+from config import BOT_TOKEN, WEB_HOST, WEB_PORT, BOT_RUN_MODE, ADMIN_SERVER_MODE, ADMIN_WORKERS
 from bot import EscrowBot
-from admin import run_admin_server
+from admin_server import AdminServerProcess
 from database import Database
 
 # Configure logging
@@ -51,6 +51,7 @@ class EscrowBotApplication:
     def __init__(self):
         self.bot = None
         self.web_thread = None
+        self.admin_server = None
         self.running = False
         
         # Validate configuration
@@ -88,18 +89,34 @@ class EscrowBotApplication:
         signal.signal(signal.SIGTERM, signal_handler)
     
     def start_web_server(self):
-        """Start the web server in a separate thread"""
-        def run_web():
-            try:
-                logger.info(f"Starting admin web server on {WEB_HOST}:{WEB_PORT}")
-                run_admin_server()
-            except Exception as e:
-                logger.error(f"Web server error: {e}")
-        
-        self.web_thread = threading.Thread(target=run_web, daemon=True)
-        self.web_thread.start()
+        """Start the admin panel in the configured ADMIN_SERVER_MODE"""
+        if ADMIN_SERVER_MODE == "process":
+            logger.info(f"Starting admin server on {WEB_HOST}:{WEB_PORT} with {ADMIN_WORKERS} workers")
+            self.admin_server = AdminServerProcess()
+            self.admin_server.start()
+        elif ADMIN_SERVER_MODE == "thread":
+            def run_web():
+                try:
+                    from admin import run_admin_server
+                    logger.info(f"Starting admin web server on {WEB_HOST}:{WEB_PORT}")
+                    run_admin_server()
+                except Exception as e:
+                    logger.error(f"Web server error: {e}")
+            
+            self.web_thread = threading.Thread(target=run_web, daemon=True)
+            self.web_thread.start()
+        else:
+            logger.info("Admin panel disabled")
+            return
         logger.info(f"Admin panel available at http://{WEB_HOST}:{WEB_PORT}/admin")
     
+    def stop_web_server(self):
+        """Stop the admin server process, if one was started"""
+        if self.admin_server:
+            logger.info("Stopping admin server...")
+            self.admin_server.stop()
+            self.admin_server = None
+    
     async def start_bot(self):
         """Start the Telegram bot"""
         try:
@@ -108,7 +125,7 @@ class EscrowBotApplication:
             if await self.bot.initialize():
                 logger.info("Starting Telegram bot...")
                 self.running = True
-                await self.bot.start_polling()
+                await self.bot.run()
             else:
                 logger.error("Failed to initialize bot")
                 return False
@@ -129,6 +146,7 @@ class EscrowBotApplication:
         """Stop the entire application"""
         self.running = False
         logger.info("Application stopping...")
+        self.stop_web_server()
     
     def run(self):
         """Run the complete application"""
@@ -164,8 +182,8 @@ class EscrowBotApplication:
         logger.info("=" * 50)
         logger.info("🚀 APPLICATION STARTED SUCCESSFULLY")
         logger.info("=" * 50)
-        logger.info(f"📱 Telegram Bot: Active")
-        logger.info(f"🌐 Admin Panel: http://{WEB_HOST}:{WEB_PORT}/admin")
+        logger.info(f"📱 Telegram Bot: Active ({BOT_RUN_MODE})")
+        logger.info(f"🌐 Admin Panel: http://{WEB_HOST}:{WEB_PORT}/admin ({ADMIN_SERVER_MODE})")
         logger.info(f"💾 Database: SQLite (escrow_bot.db)")
         logger.info(f"💳 UPI ID: Shouryahooda751-2@oksbi")
         logger.info("=" * 50)
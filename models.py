@@ -0,0 +1,130 @@
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, NamedTuple, Optional, Sequence, Tuple
+
+class User(NamedTuple):
+    """A row of the users table"""
+    user_id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    trust_rating: float = 0.0
+    total_deals: int = 0
+    successful_deals: int = 0
+    created_at: Optional[str] = None
+    rating_sum: int = 0
+    rating_count: int = 0
+
+class Deal(NamedTuple):
+    """A row of the deals table, optionally joined with party A's username"""
+    deal_id: int
+    party_a_id: Optional[int] = None
+    party_b_username: Optional[str] = None
+    party_b_id: Optional[int] = None
+    amount: float = 0.0
+    description: str = ''
+    status: str = 'created'
+    payment_confirmed: bool = False
+    delivery_confirmed: bool = False
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    payment_confirmed_at: Optional[str] = None
+    party_a_username: Optional[str] = None
+
+class Dispute(NamedTuple):
+    """A row of the disputes table, optionally joined with deal and raiser details"""
+    dispute_id: int
+    deal_id: Optional[int] = None
+    raised_by: Optional[int] = None
+    reason: str = ''
+    status: str = 'open'
+    resolved_by: Optional[int] = None
+    resolution: Optional[str] = None
+    created_at: Optional[str] = None
+    resolved_at: Optional[str] = None
+    amount: Optional[float] = None
+    description: Optional[str] = None
+    raised_by_username: Optional[str] = None
+
+class TrustRating(NamedTuple):
+    """A row of the trust_ratings table"""
+    rating_id: int
+    deal_id: Optional[int] = None
+    rater_id: Optional[int] = None
+    rated_id: Optional[int] = None
+    rating: int = 0
+    comment: Optional[str] = None
+    created_at: Optional[str] = None
+
+class AdminEvent(NamedTuple):
+    """A row of the admin_events log, joined with the deal and dispute it refers to"""
+    event_id: int
+    kind: str = ''
+    deal_id: Optional[int] = None
+    dispute_id: Optional[int] = None
+    user_id: Optional[int] = None
+    old_status: Optional[str] = None
+    new_status: Optional[str] = None
+    created_at: Optional[str] = None
+    amount: Optional[float] = None
+    party_a_username: Optional[str] = None
+    party_b_username: Optional[str] = None
+    description: Optional[str] = None
+    deal_created_at: Optional[str] = None
+    reason: Optional[str] = None
+    raised_by_username: Optional[str] = None
+
+class SearchResult(NamedTuple):
+    """One full-text search hit, with a summary of the record it points at"""
+    kind: str
+    ref_id: int
+    snippet: str = ''
+    score: float = 0.0
+    title: str = ''
+    status: Optional[str] = None
+
+class AnalyticsBucket(NamedTuple):
+    """Rolled-up figures for the deals created in one hour or day"""
+    bucket: str
+    deals: int = 0
+    amount: float = 0.0
+    completed: int = 0
+    disputed: int = 0
+    median_minutes_to_confirm: Optional[int] = None
+    
+    @property
+    def completion_rate(self) -> Optional[float]:
+        """Share of these deals that completed"""
+        return self.completed / self.deals if self.deals else None
+    
+    @property
+    def dispute_rate(self) -> Optional[float]:
+        """Share of these deals with at least one dispute"""
+        return self.disputed / self.deals if self.deals else None
+
+class Page(NamedTuple):
+    """One keyset-paginated page of records"""
+    items: list
+    has_previous: bool = False
+    has_next: bool = False
+
+@lru_cache(maxsize=256)
+def _row_builder(record_type: type, columns: Tuple[str, ...]) -> Callable[[Sequence[Any]], Any]:
+    """Build (once per query shape) a function turning a result row into a record"""
+    fields = record_type._fields
+    if columns == fields[:len(columns)]:
+        # Columns line up with the leading fields: construct positionally
+        if len(columns) == len(fields):
+            return record_type._make
+        return lambda row: record_type(*row)
+    
+    # Pick known columns by name, in field order; missing fields keep defaults
+    present = [field for field in fields if field in columns]
+    getter = itemgetter(*[columns.index(field) for field in present])
+    if len(present) == 1:
+        return lambda row: record_type(**{present[0]: getter(row)})
+    return lambda row: record_type(**dict(zip(present, getter(row))))
+
+def row_builder(record_type: type, description) -> Callable[[Sequence[Any]], Any]:
+    """Get the row-to-record function for a cursor's result description"""
+    return _row_builder(record_type, tuple(column[0] for column in description))
@@ -0,0 +1,224 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Dict
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from cache import LRUCache
+from config import (
+    NOTIFY_GLOBAL_RATE, NOTIFY_GLOBAL_BURST, NOTIFY_CHAT_RATE, NOTIFY_CHAT_BURST,
+    NOTIFY_QUEUE_SIZE, NOTIFY_WORKERS, NOTIFY_MAX_RETRIES, NOTIFY_RETRY_BASE_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes: lower values are sent first
+PRIORITY_ADMIN = 0       # Payment confirmations and dispute alerts for the admin
+PRIORITY_USER = 1        # Deal progress messages for buyers and sellers
+PRIORITY_COMPLETION = 2  # Completion notices
+
+LANE_NAMES = {
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_USER: "user",
+    PRIORITY_COMPLETION: "completion"
+}
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second"""
+    
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+    
+    def take(self) -> float:
+        """Take a token; returns 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class Notification:
+    """An outbound Bot API sendMessage call"""
+    
+    __slots__ = ('chat_id', 'text', 'kwargs', 'priority', 'attempts', 'sequence')
+    
+    def __init__(self, chat_id, text: str, priority: int, kwargs: Dict[str, Any]):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.attempts = 0
+        self.sequence = None
+
+class NotificationQueue:
+    """Rate-limited outbound message queue with priority lanes.
+    
+    Handlers enqueue messages and return immediately; worker tasks send them
+    respecting a global and a per-chat token bucket. Messages for a chat that
+    is over its budget are set aside until it has tokens again, so one busy
+    chat does not hold up the others. Flood-control (429) responses pause all
+    sending for the requested time, and transient network errors are retried
+    with exponential backoff.
+    """
+    
+    def __init__(self):
+        self.bot = None
+        self._queue = None
+        self._workers = []
+        self._sequence = itertools.count()
+        self._global_bucket = TokenBucket(NOTIFY_GLOBAL_RATE, NOTIFY_GLOBAL_BURST)
+        self._chat_buckets = LRUCache(10000)
+        self._paused_until = 0.0
+        self._deferred = {}  # Notification -> TimerHandle that re-queues it
+        self._lane_depth = {priority: 0 for priority in LANE_NAMES}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+    
+    async def start(self, bot):
+        """Start the dispatcher workers for a bot"""
+        self.bot = bot
+        self._queue = asyncio.PriorityQueue(maxsize=NOTIFY_QUEUE_SIZE)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"notify-{index}")
+            for index in range(NOTIFY_WORKERS)
+        ]
+        logger.info(f"Notification queue started with {NOTIFY_WORKERS} workers")
+    
+    async def stop(self, timeout: float = 10.0):
+        """Give queued and deferred messages up to timeout seconds to go out, then stop the workers"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Stopping with {self._queue.qsize()} queued and {len(self._deferred)} deferred notifications unsent"
+            )
+        for handle in self._deferred.values():
+            handle.cancel()
+        self.dropped += len(self._deferred)
+        self._deferred.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+    
+    async def _drain(self):
+        """Wait until the queue is empty and no deferred message is waiting to re-enter it"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._queue.join()
+            if not self._deferred:
+                return
+            next_due = min(handle.when() for handle in self._deferred.values())
+            await asyncio.sleep(max(0.0, next_due - loop.time()))
+    
+    def send(self, chat_id, text: str, priority: int = PRIORITY_USER, **kwargs) -> bool:
+        """Queue a message for chat_id; kwargs are passed to bot.send_message"""
+        return self._put(Notification(chat_id, text, priority, kwargs))
+    
+    def _put(self, notification: Notification) -> bool:
+        if self._queue is None:
+            logger.error(f"Notification queue not started, dropping message to {notification.chat_id}")
+            self.dropped += 1
+            return False
+        # Re-queued messages keep their original place among their lane
+        if notification.sequence is None:
+            notification.sequence = next(self._sequence)
+        try:
+            self._queue.put_nowait((notification.priority, notification.sequence, notification))
+        except asyncio.QueueFull:
+            logger.error(f"Notification queue full, dropping message to {notification.chat_id}")
+            self.dropped += 1
+            return False
+        self._lane_depth[notification.priority] += 1
+        return True
+    
+    def _put_later(self, delay: float, notification: Notification):
+        """Re-queue a message after delay seconds without occupying a worker"""
+        def requeue():
+            del self._deferred[notification]
+            self._put(notification)
+        
+        self._deferred[notification] = asyncio.get_running_loop().call_later(delay, requeue)
+    
+    async def _worker(self):
+        while True:
+            priority, _, notification = await self._queue.get()
+            self._lane_depth[priority] -= 1
+            try:
+                await self._dispatch(notification)
+            except Exception as e:
+                logger.error(f"Unexpected error sending notification to {notification.chat_id}: {e}")
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+    
+    async def _dispatch(self, notification: Notification):
+        chat_bucket = self._chat_buckets.get(notification.chat_id)
+        if chat_bucket is None:
+            chat_bucket = TokenBucket(NOTIFY_CHAT_RATE, NOTIFY_CHAT_BURST)
+            self._chat_buckets.set(notification.chat_id, chat_bucket)
+        wait = chat_bucket.take()
+        if wait:
+            self._put_later(wait, notification)
+            return
+        
+        # Global budget (and flood-control pauses) apply to every chat
+        while True:
+            wait = max(self._paused_until - time.monotonic(), self._global_bucket.take())
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        
+        try:
+            await self.bot.send_message(
+                chat_id=notification.chat_id, text=notification.text, **notification.kwargs
+            )
+            self.sent += 1
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            logger.warning(f"Flood control: pausing notifications for {retry_after}s")
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._retry(notification, retry_after)
+        except (Forbidden, BadRequest) as e:
+            # The user blocked the bot or the message is invalid: retrying won't help
+            logger.error(f"Notification to {notification.chat_id} rejected: {e}")
+            self.failed += 1
+        except NetworkError as e:
+            logger.warning(f"Notification to {notification.chat_id} failed: {e}")
+            self._retry(notification, NOTIFY_RETRY_BASE_DELAY * 2 ** notification.attempts)
+    
+    def _retry(self, notification: Notification, delay: float):
+        notification.attempts += 1
+        if notification.attempts > NOTIFY_MAX_RETRIES:
+            logger.error(f"Giving up on notification to {notification.chat_id} after {NOTIFY_MAX_RETRIES} retries")
+            self.failed += 1
+            return
+        self.retried += 1
+        self._put_later(delay, notification)
+    
+    def metrics(self) -> Dict[str, Any]:
+        """Get queue depth and delivery counters"""
+        return {
+            'queued': {LANE_NAMES[priority]: depth for priority, depth in self._lane_depth.items()},
+            'delayed': len(self._deferred),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'paused_for': max(0.0, self._paused_until - time.monotonic())
+        }
+
+# Shared queue used by the handlers; started and stopped by EscrowBot
+notifier = NotificationQueue()
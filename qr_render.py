@@ -0,0 +1,138 @@
+import asyncio
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import qrcode
+from config import (
+    QR_BOX_SIZE, QR_BORDER, QR_WORKERS, QR_MAX_PENDING
+)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def qr_matrix(data: str, border: int = QR_BORDER) -> Tuple[Tuple[bool, ...], ...]:
+    """Get the module matrix (True = dark, quiet zone included) for data
+    
+    Not cached: every payload carries its deal id, so no two renders repeat.
+    """
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+def _png_chunk(chunk_type: bytes, payload: bytes) -> bytes:
+    return (
+        struct.pack('>I', len(payload)) + chunk_type + payload
+        + struct.pack('>I', zlib.crc32(chunk_type + payload))
+    )
+
+def matrix_to_png(matrix: Tuple[Tuple[bool, ...], ...], box_size: int = QR_BOX_SIZE) -> bytes:
+    """Encode a module matrix as a 1-bit grayscale PNG, box_size pixels per module"""
+    size = len(matrix) * box_size
+    padding = '1' * (-size % 8)
+    dark, light = '0' * box_size, '1' * box_size
+    row_bytes = (size + 7) // 8
+    
+    # Every module row becomes box_size identical scanlines (filter type 0)
+    scanlines = []
+    for row in matrix:
+        bits = ''.join(dark if module else light for module in row) + padding
+        scanlines.append((b'\x00' + int(bits, 2).to_bytes(row_bytes, 'big')) * box_size)
+    
+    header = struct.pack('>IIBBBBB', size, size, 1, 0, 0, 0, 0)
+    return (
+        PNG_SIGNATURE
+        + _png_chunk(b'IHDR', header)
+        + _png_chunk(b'IDAT', zlib.compress(b''.join(scanlines), 6))
+        + _png_chunk(b'IEND', b'')
+    )
+
+def render_qr_png(data: str, box_size: int = QR_BOX_SIZE, border: int = QR_BORDER) -> bytes:
+    """Render data as a QR code PNG"""
+    return matrix_to_png(qr_matrix(data, border), box_size)
+
+class QRRenderPool:
+    """Renders QR codes on a small thread pool, off the event loop.
+    
+    At most max_pending renders are accepted at once (running or waiting for
+    a worker); past that, render fails fast instead of queueing a burst.
+    """
+    
+    def __init__(self, max_workers: int = QR_WORKERS, max_pending: int = QR_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qr")
+        self.max_pending = max_pending
+        self._pending = 0
+    
+    @property
+    def busy(self) -> bool:
+        """Whether a render would be refused right now"""
+        return self._pending >= self.max_pending
+    
+    async def render(self, data: str) -> Optional[bytes]:
+        """Render data as a QR code PNG, or None if the pool is full or rendering failed"""
+        if self.busy:
+            print(f"QR render refused: {self._pending} renders pending")
+            return None
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        try:
+            return await loop.run_in_executor(self._executor, render_qr_png, data)
+        except Exception as e:
+            print(f"Error generating QR code: {e}")
+            return None
+        finally:
+            self._pending -= 1
+    
+    def close(self):
+        """Stop the workers"""
+        self._executor.shutdown(wait=True)
+
+def _render_with_pil(data: str) -> bytes:
+    """The previous PIL-based pipeline, kept as the benchmark baseline"""
+    import io
+    
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def benchmark(count: int = 300):
+    """Compare throughput and PNG size of the PIL pipeline and the direct encoder"""
+    import time
+    from config import UPI_ID, UPI_NAME
+    
+    payloads = [
+        f"upi://pay?pa={UPI_ID}&pn={UPI_NAME}&am={100 + index * 7.5}&tn=Escrow Deal {index}"
+        for index in range(count)
+    ]
+    
+    def measure(name, render, inputs):
+        started = time.perf_counter()
+        sizes = [len(render(data)) for data in inputs]
+        elapsed = time.perf_counter() - started
+        print(f"{name:<28} {len(inputs) / elapsed:>9.0f} img/s  {elapsed / len(inputs) * 1000:>7.2f} ms/img"
+              f"  {sum(sizes) / len(sizes):>8.0f} bytes/img")
+    
+    measure("PIL (previous)", _render_with_pil, payloads)
+    measure("direct PNG", render_qr_png, payloads)
+    matrices = [qr_matrix(data) for data in payloads]
+    measure("PNG encode only", matrix_to_png, matrices)
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="QR rendering micro-benchmark")
+    parser.add_argument("--count", type=int, default=300, help="Distinct payloads to render")
+    benchmark(parser.parse_args().count)
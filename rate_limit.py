@@ -0,0 +1,86 @@
+import time
+from typing import Dict, Hashable, Optional, Tuple
+from cache import LRUCache
+from config import (
+    RATE_LIMIT_USER, RATE_LIMIT_COMMANDS, RATE_LIMIT_GLOBAL, RATE_LIMIT_MAX_KEYS,
+    RATE_LIMIT_WARNING_INTERVAL
+)
+
+class SlidingWindowCounter:
+    """Approximate sliding window: the previous fixed window is weighted by its overlap"""
+    
+    __slots__ = ('window', 'started_at', 'current', 'previous')
+    
+    def __init__(self, window: float, now: float):
+        self.window = window
+        self.started_at = now
+        self.current = 0
+        self.previous = 0
+    
+    def hit(self, limit: int, now: float) -> bool:
+        """Count one event if fewer than limit happened in the last window"""
+        elapsed = now - self.started_at
+        if elapsed >= self.window:
+            # Roll forward; anything older than two windows no longer counts
+            self.previous = self.current if elapsed < 2 * self.window else 0
+            self.current = 0
+            self.started_at = now - elapsed % self.window
+            elapsed = now - self.started_at
+        
+        estimate = self.previous * (1 - elapsed / self.window) + self.current
+        if estimate >= limit:
+            return False
+        self.current += 1
+        return True
+
+class RateLimiter:
+    """Per-user, per-command and global request budgets.
+    
+    Each budget is a (limit, window seconds) pair counted with a sliding
+    window of three integers, and the per-user counters live in a bounded
+    LRU so idle users are forgotten. A user sees at most one warning per
+    warning_interval, however many requests get rejected.
+    """
+    
+    def __init__(self, user_budget: Tuple[int, float] = RATE_LIMIT_USER,
+                 command_budgets: Dict[str, Tuple[int, float]] = RATE_LIMIT_COMMANDS,
+                 global_budget: Tuple[int, float] = RATE_LIMIT_GLOBAL,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS,
+                 warning_interval: float = RATE_LIMIT_WARNING_INTERVAL):
+        self.user_budget = user_budget
+        self.command_budgets = command_budgets
+        self.global_budget = global_budget
+        self._counters = LRUCache(max_keys)
+        self._global = SlidingWindowCounter(global_budget[1], time.monotonic())
+        self._warned = LRUCache(max_keys, ttl=warning_interval)
+        self.rejected = 0
+    
+    def _hit(self, key: Hashable, budget: Tuple[int, float], now: float) -> bool:
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = SlidingWindowCounter(budget[1], now)
+            self._counters.set(key, counter)
+        return counter.hit(budget[0], now)
+    
+    def allow(self, user_id: int, command: Optional[str] = None) -> bool:
+        """Count a request from user_id (for command, if any); False if over a budget"""
+        now = time.monotonic()
+        allowed = self._hit(user_id, self.user_budget, now)
+        
+        budget = self.command_budgets.get(command)
+        if allowed and budget:
+            allowed = self._hit((user_id, command), budget, now)
+        
+        if allowed:
+            allowed = self._global.hit(self.global_budget[0], now)
+        
+        if not allowed:
+            self.rejected += 1
+        return allowed
+    
+    def should_warn(self, user_id: int) -> bool:
+        """True once per warning interval for a throttled user"""
+        if self._warned.get(user_id):
+            return False
+        self._warned.set(user_id, True)
+        return True
@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+from typing import Any, Dict, Optional
+from cache import LRUCache
+from config import STATE_STORE_BACKEND, STATE_TTL, STATE_MAX_ENTRIES, STATE_FLUSH_INTERVAL
+
+class MemoryStateStore:
+    """Conversation state per user, with per-entry TTL and an LRU memory cap.
+    
+    Supports the dict operations the handlers use (``in``, ``[]``, ``pop``).
+    State dicts are not watched for changes: assign the state back after
+    modifying it so the entry's TTL is refreshed and backends can persist it.
+    """
+    
+    def __init__(self, max_entries: int = STATE_MAX_ENTRIES, ttl: float = STATE_TTL):
+        self.ttl = ttl
+        self._states = LRUCache(max_entries, ttl=ttl, on_evict=self._on_evict)
+    
+    def _on_evict(self, user_id: int, state: Dict[str, Any]):
+        """Called when the memory cap pushes out the least recently used state"""
+    
+    def get(self, user_id: int, default: Any = None) -> Optional[Dict[str, Any]]:
+        """Get a user's state, or default if there is none or it expired"""
+        return self._states.get(user_id, default)
+    
+    def set(self, user_id: int, state: Dict[str, Any]):
+        """Store a user's state and restart its TTL"""
+        self._states.set(user_id, state)
+    
+    def pop(self, user_id: int, default: Any = None) -> Any:
+        """Remove a user's state"""
+        return self._states.pop(user_id, default)
+    
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+    
+    def __getitem__(self, user_id: int) -> Dict[str, Any]:
+        state = self.get(user_id)
+        if state is None:
+            raise KeyError(user_id)
+        return state
+    
+    def __setitem__(self, user_id: int, state: Dict[str, Any]):
+        self.set(user_id, state)
+    
+    def __len__(self) -> int:
+        return len(self._states)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics for the in-memory states"""
+        return self._states.stats()
+    
+    def close(self):
+        """Release resources"""
+
+class SQLiteStateStore(MemoryStateStore):
+    """MemoryStateStore that persists states to SQLite with write-behind.
+    
+    Reads are always served from memory. Changes are recorded as dirty and
+    written in one transaction every STATE_FLUSH_INTERVAL seconds by a
+    background thread, so flows survive a restart without a DB write on the
+    event loop for every message.
+    """
+    
+    def __init__(self, database, max_entries: int = STATE_MAX_ENTRIES, ttl: float = STATE_TTL,
+                 flush_interval: float = STATE_FLUSH_INTERVAL):
+        super().__init__(max_entries, ttl)
+        self.database = database
+        self.flush_interval = flush_interval
+        self._dirty = {}  # user_id -> (state JSON, expires_at), or None to delete
+        self._dirty_lock = threading.Lock()
+        self._stop = threading.Event()
+        
+        self._load()
+        self._flusher = threading.Thread(target=self._flush_loop, name="state-flush", daemon=True)
+        self._flusher.start()
+    
+    def _load(self):
+        """Load unexpired states saved by a previous run, most recent last"""
+        now = time.time()
+        with self.database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM conversation_states WHERE expires_at <= ?', (now,))
+            cursor.execute('''
+                SELECT user_id, state, expires_at FROM conversation_states
+                ORDER BY updated_at ASC
+            ''')
+            for user_id, state, expires_at in cursor.fetchall():
+                self._states.set(user_id, json.loads(state), ttl=expires_at - now)
+    
+    def _mark_dirty(self, user_id: int, state: Optional[Dict[str, Any]]):
+        with self._dirty_lock:
+            if state is None:
+                self._dirty[user_id] = None
+            else:
+                self._dirty[user_id] = (json.dumps(state), time.time() + self.ttl)
+    
+    def _on_evict(self, user_id: int, state: Dict[str, Any]):
+        # Over the memory cap: drop the idle session everywhere
+        self._mark_dirty(user_id, None)
+    
+    def set(self, user_id: int, state: Dict[str, Any]):
+        super().set(user_id, state)
+        self._mark_dirty(user_id, state)
+    
+    def pop(self, user_id: int, default: Any = None) -> Any:
+        state = super().pop(user_id, default)
+        self._mark_dirty(user_id, None)
+        return state
+    
+    def flush(self) -> int:
+        """Write pending changes and purge expired rows; returns the number of changes"""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, {}
+        
+        upserts = [(user_id, *entry) for user_id, entry in dirty.items() if entry is not None]
+        deletes = [(user_id,) for user_id, entry in dirty.items() if entry is None]
+        
+        try:
+            with self.database.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO conversation_states (user_id, state, expires_at, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        state = excluded.state,
+                        expires_at = excluded.expires_at,
+                        updated_at = excluded.updated_at
+                ''', upserts)
+                cursor.executemany('DELETE FROM conversation_states WHERE user_id = ?', deletes)
+                cursor.execute('DELETE FROM conversation_states WHERE expires_at <= ?', (time.time(),))
+        except Exception:
+            # Put the changes back unless newer ones arrived meanwhile
+            with self._dirty_lock:
+                for user_id, entry in dirty.items():
+                    self._dirty.setdefault(user_id, entry)
+            raise
+        return len(dirty)
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing conversation states: {e}")
+    
+    def close(self):
+        """Stop the background writer and flush what is left"""
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+
+def create_state_store(database=None) -> MemoryStateStore:
+    """Create the conversation-state store selected by STATE_STORE_BACKEND"""
+    if STATE_STORE_BACKEND == "sqlite":
+        if database is None:
+            from database import Database
+            database = Database()
+        return SQLiteStateStore(database)
+    if STATE_STORE_BACKEND == "memory":
+        return MemoryStateStore()
+    raise ValueError(f"Unknown state store backend: {STATE_STORE_BACKEND}")
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules that open the default database at import (handlers) must not touch a real one
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(prefix="escrow-tests-"), "escrow.db"))
+
+from database import Database
+
+@pytest.fixture
+def database(tmp_path):
+    """A fresh, fully migrated database in a temporary directory"""
+    db = Database(str(tmp_path / "escrow.db"))
+    yield db
+    db.close()
+
+@pytest.fixture
+def deal(database):
+    """A deal from a registered buyer to a registered seller, awaiting payment"""
+    database.add_user(1, "alice", "Alice")
+    database.add_user(2, "bob", "Bob")
+    deal_id = database.create_deal(1, "bob", 250.0, "A pair of concert tickets")
+    return database.update_deal_status(deal_id, "payment_pending")
@@ -0,0 +1,56 @@
+from config import DEAL_STATUS
+from database import DEAL_TRANSITIONS
+
+def test_transitions_name_known_statuses():
+    statuses = set(DEAL_STATUS.values())
+    for to_status, from_statuses in DEAL_TRANSITIONS.items():
+        assert to_status in statuses
+        assert set(from_statuses) <= statuses
+
+def test_create_deal_binds_registered_seller(database):
+    database.add_user(1, "alice", "Alice")
+    database.add_user(2, "Bob", "Bob")
+    deal_id = database.create_deal(1, "bob", 10.0, "Seller name in another case")
+    
+    assert database.get_deal(deal_id).party_b_id == 2
+    assert database.get_user(1).total_deals == 1
+    assert database.get_user(2).total_deals == 1
+
+def test_transition_applies_once(database, deal):
+    confirmed = database.confirm_payment(deal.deal_id)
+    assert confirmed.status == DEAL_STATUS["PAYMENT_CONFIRMED"]
+    assert confirmed.payment_confirmed
+    assert database.confirm_payment(deal.deal_id) is None
+    assert database.get_deal(deal.deal_id).status == DEAL_STATUS["PAYMENT_CONFIRMED"]
+
+def test_disallowed_transition_leaves_deal_alone(database, deal):
+    assert database.confirm_delivery(deal.deal_id) is None
+    assert database.update_deal_status(deal.deal_id, DEAL_STATUS["COMPLETED"]) is None
+    assert database.get_deal(deal.deal_id).status == DEAL_STATUS["PAYMENT_PENDING"]
+
+def test_atomic_batch_moves_nothing_on_rejection(database, deal):
+    moved, rejected = database.confirm_payments([deal.deal_id, 999], atomic=True)
+    assert moved == []
+    assert rejected == {999: None}
+    assert database.get_deal(deal.deal_id).status == DEAL_STATUS["PAYMENT_PENDING"]
+    
+    moved, rejected = database.confirm_payments([deal.deal_id, 999])
+    assert [moved_deal.deal_id for moved_deal in moved] == [deal.deal_id]
+    assert rejected == {999: None}
+
+def test_rate_deal_is_idempotent(database, deal):
+    database.confirm_payment(deal.deal_id)
+    assert database.rate_deal(deal.deal_id, 1, 2, 5) == (False, None)
+    
+    database.confirm_delivery(deal.deal_id)
+    recorded, completed = database.rate_deal(deal.deal_id, 1, 2, 5, "Great")
+    assert recorded and completed.status == DEAL_STATUS["COMPLETED"]
+    assert database.rate_deal(deal.deal_id, 1, 2, 1) == (False, None)
+    
+    # The other party can still rate, without completing the deal again
+    assert database.rate_deal(deal.deal_id, 2, 1, 4) == (True, None)
+    
+    seller = database.get_user(2)
+    assert (seller.rating_count, seller.rating_sum, seller.successful_deals) == (1, 5, 1)
+    assert database.reconcile_trust_ratings(fix=False) == []
+    assert database.reconcile_deal_counters(fix=False) == []
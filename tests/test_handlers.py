@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.ext import ApplicationHandlerStop
+import handlers
+from rate_limit import RateLimiter
+
+class FakeQuery:
+    """Records the answers a handler gives to a button press"""
+    
+    def __init__(self, data: str, user_id: int = 1, query_id: str = "1"):
+        self.id = query_id
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id, username="alice", first_name="Alice")
+        self.answers = []
+    
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append((text, show_alert))
+
+def press(data: str, query_id: str):
+    query = FakeQuery(data, query_id=query_id)
+    return SimpleNamespace(callback_query=query, effective_user=query.from_user, effective_message=None), query
+
+@pytest.fixture
+def echo_route():
+    """An idempotent route whose handler refuses presses while refuse is set"""
+    calls = []
+    refuse = []
+    
+    @handlers.callback_route("test_echo", idempotent=True)
+    async def echo(update, context, deal_id: int):
+        calls.append(deal_id)
+        if refuse:
+            await handlers.answer_callback(update.callback_query, "refused", show_alert=True)
+    
+    yield calls, refuse
+    handlers.CALLBACK_ROUTES.pop("test_echo")
+    handlers.IDEMPOTENT_ACTIONS.discard("test_echo")
+    handlers.recent_callbacks.clear()
+
+def test_duplicate_update_ids_are_dropped():
+    update = SimpleNamespace(update_id=424242)
+    asyncio.run(handlers.drop_duplicate_updates(update, None))
+    with pytest.raises(ApplicationHandlerStop):
+        asyncio.run(handlers.drop_duplicate_updates(update, None))
+
+def test_parse_callback_args():
+    assert handlers.parse_callback_args((True, False), ["12", "x"]) == [12, "x"]
+    assert handlers.parse_callback_args((True,), ["abc"]) is None
+    assert handlers.parse_callback_args((True,), ["1", "2"]) is None
+
+def test_repeat_press_runs_handler_once(echo_route):
+    calls, _ = echo_route
+    first, first_query = press("test_echo:7", "a")
+    second, second_query = press("test_echo:7", "b")
+    asyncio.run(handlers.handle_callback_query(first, None))
+    asyncio.run(handlers.handle_callback_query(second, None))
+    
+    assert calls == [7]
+    assert first_query.answers == [(None, False)]
+    assert second_query.answers == [("⏳ Already received", False)]
+
+def test_refused_press_can_be_retried(echo_route):
+    calls, refuse = echo_route
+    refuse.append(True)
+    first, first_query = press("test_echo:7", "a")
+    asyncio.run(handlers.handle_callback_query(first, None))
+    refuse.clear()
+    second, second_query = press("test_echo:7", "b")
+    asyncio.run(handlers.handle_callback_query(second, None))
+    
+    assert calls == [7, 7]
+    assert first_query.answers == [("refused", True)]
+    assert second_query.answers == [(None, False)]
+
+def test_malformed_callback_data_is_answered(echo_route):
+    calls, _ = echo_route
+    update, query = press("test_echo:seven", "a")
+    asyncio.run(handlers.handle_callback_query(update, None))
+    assert calls == []
+    assert query.answers == [("⌛ This button has expired, please use /status", True)]
+
+def test_throttled_presses_are_always_answered(monkeypatch):
+    monkeypatch.setattr(
+        handlers, "rate_limiter", RateLimiter(user_budget=(1, 60), command_budgets={}, global_budget=(1000, 1))
+    )
+    queries = []
+    for index in range(3):
+        update, query = press("test_echo:7", str(index))
+        queries.append(query)
+        try:
+            asyncio.run(handlers.rate_limit_updates(update, None))
+        except ApplicationHandlerStop:
+            pass
+    
+    assert queries[0].answers == []
+    assert queries[1].answers == [("⏳ Too many requests, please wait a moment", True)]
+    assert queries[2].answers == [(None, False)]
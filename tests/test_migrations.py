@@ -0,0 +1,56 @@
+from database import Database, MIGRATIONS
+
+def make_activity(database):
+    """Drive a few deals through every status so triggers and counters have work to do"""
+    database.add_user(1, "alice", "Alice")
+    database.add_user(2, "bob", "Bob")
+    for index in range(6):
+        deal_id = database.create_deal(1, "bob", 100.0 + index, f"Deal number {index} for tests")
+        database.update_deal_status(deal_id, "payment_pending")
+        if index == 0:
+            database.update_deal_status(deal_id, "cancelled")
+            continue
+        database.confirm_payment(deal_id)
+        if index == 1:
+            database.create_dispute(deal_id, 1, "Item never arrived")
+            continue
+        database.confirm_delivery(deal_id)
+        database.rate_deal(deal_id, 1, 2, 5, "Smooth trade")
+
+def test_versions_are_unique_and_ascending():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+def test_fresh_database_reaches_latest_version(database):
+    assert database.get_schema_version() == MIGRATIONS[-1][0]
+
+def test_migrate_is_idempotent(database):
+    assert database.migrate() == []
+    # A second process opening the same file applies nothing either
+    other = Database(database.db_path)
+    try:
+        assert other.migrate() == []
+        assert other.get_schema_version() == MIGRATIONS[-1][0]
+    finally:
+        other.close()
+
+def test_hot_queries_use_indexes(database):
+    assert database.check_query_plans() == {}
+
+def test_counters_match_deals_after_activity(database):
+    make_activity(database)
+    assert database.reconcile_trust_ratings(fix=False) == []
+    assert database.reconcile_deal_counters(fix=False) == []
+    assert database.reconcile_stats(fix=False) == []
+
+def test_reconcile_repairs_drift(database):
+    make_activity(database)
+    with database.connection() as conn:
+        conn.execute("UPDATE users SET total_deals = 0, rating_count = 0 WHERE user_id = 2")
+    
+    assert database.reconcile_deal_counters() != []
+    assert database.reconcile_trust_ratings() != []
+    database.invalidate_user(2)
+    assert database.reconcile_deal_counters(fix=False) == []
+    assert database.reconcile_trust_ratings(fix=False) == []
+    assert database.get_user(2).total_deals == 6
@@ -0,0 +1,55 @@
+import time
+from cache import LRUCache
+from rate_limit import RateLimiter, SlidingWindowCounter
+
+def test_sliding_window_counts_previous_window_by_overlap():
+    counter = SlidingWindowCounter(10, now=0)
+    assert all(counter.hit(5, now=1) for _ in range(5))
+    assert not counter.hit(5, now=2)
+    # Halfway through the next window, half of the previous five still count
+    assert all(counter.hit(5, now=15) for _ in range(3))
+    assert not counter.hit(5, now=15)
+    # Two windows later nothing from the first one is left
+    assert counter.hit(1, now=40)
+
+def test_user_budget_is_per_user():
+    limiter = RateLimiter(user_budget=(3, 60), command_budgets={}, global_budget=(1000, 1))
+    assert [limiter.allow(1) for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow(2)
+    assert limiter.rejected == 1
+
+def test_command_budget_applies_on_top_of_user_budget():
+    limiter = RateLimiter(user_budget=(100, 60), command_budgets={"deal": (1, 60)}, global_budget=(1000, 1))
+    assert limiter.allow(1, "deal")
+    assert not limiter.allow(1, "deal")
+    assert limiter.allow(1, "help")
+
+def test_global_budget_covers_all_users():
+    limiter = RateLimiter(user_budget=(100, 60), command_budgets={}, global_budget=(2, 60))
+    assert limiter.allow(1)
+    assert limiter.allow(2)
+    assert not limiter.allow(3)
+
+def test_warns_once_per_interval():
+    limiter = RateLimiter(warning_interval=60)
+    assert limiter.should_warn(1)
+    assert not limiter.should_warn(1)
+    assert limiter.should_warn(2)
+
+def test_cache_evicts_least_recently_used():
+    evicted = []
+    cache = LRUCache(2, on_evict=lambda key, value: evicted.append(key))
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert evicted == ["b"]
+    assert cache.get("a") == 1 and cache.get("b") is None
+
+def test_cache_entries_expire():
+    cache = LRUCache(10, ttl=0.01)
+    cache.set("update", True)
+    cache.set("pinned", True, ttl=60)
+    time.sleep(0.02)
+    assert cache.get("update") is None
+    assert cache.get("pinned")
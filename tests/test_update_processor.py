@@ -0,0 +1,12 @@
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+from update_processor import PerUserUpdateProcessor, stress_check
+
+def test_stress_check_keeps_each_user_in_order():
+    assert asyncio.run(stress_check(users=100, updates_per_user=30, max_concurrent_updates=16))
+
+def test_updates_without_a_user_or_chat_are_not_serialized():
+    assert PerUserUpdateProcessor.ordering_key(object()) is None
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable, Optional
+from telegram.ext import BaseUpdateProcessor
+from config import MAX_CONCURRENT_UPDATES
+
+logger = logging.getLogger(__name__)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates in order.
+    
+    Up to max_concurrent_updates handlers run at once, but an update only
+    starts after the previous update from the same user has finished, so
+    conversation states and deal transitions see one user's actions in the
+    order they were sent. Updates waiting for their turn do not hold a
+    concurrency slot, so one busy user cannot stall the others.
+    """
+    
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+    
+    @staticmethod
+    def ordering_key(update: Any) -> Optional[Hashable]:
+        """Key whose updates must run in order, or None if the update can run anytime"""
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return ('chat', chat.id)
+        return None
+    
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        
+        # Take our place in the user's line before the first await: the
+        # application starts update tasks in arrival order
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        
+        def release(_):
+            if self._tails.get(key) is done:
+                del self._tails[key]
+        
+        done.add_done_callback(release)
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            await super().process_update(update, coroutine)
+        finally:
+            if previous is not None and not previous.done():
+                # Cancelled while waiting: later updates still queue behind the earlier one
+                previous.add_done_callback(lambda _: done.set_result(None))
+            else:
+                done.set_result(None)
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+    
+    @property
+    def waiting_users(self) -> int:
+        """Number of users with updates in flight or queued"""
+        return len(self._tails)
+
+async def stress_check(users: int = 200, updates_per_user: int = 50,
+                       max_concurrent_updates: int = 32) -> bool:
+    """Push interleaved updates through the processor and check per-user ordering
+    
+    Every handler sleeps a random short time, so without serialization later
+    updates would overtake earlier ones. Fails if any user's updates run out
+    of order or overlap, or if the concurrency limit is exceeded.
+    """
+    import random
+    from types import SimpleNamespace
+    
+    processor = PerUserUpdateProcessor(max_concurrent_updates)
+    processed = {user_id: [] for user_id in range(users)}
+    in_flight = {user_id: 0 for user_id in range(users)}
+    running = 0
+    peak = 0
+    violations = []
+    
+    async def handle(user_id: int, sequence: int):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        in_flight[user_id] += 1
+        if in_flight[user_id] > 1:
+            violations.append(f"user {user_id}: update {sequence} overlapped another")
+        await asyncio.sleep(random.random() * 0.002)
+        processed[user_id].append(sequence)
+        in_flight[user_id] -= 1
+        running -= 1
+    
+    # Interleave users the way a busy bot receives them, with bursts per user
+    arrivals = [(user_id, sequence) for user_id in range(users) for sequence in range(updates_per_user)]
+    arrivals.sort(key=lambda item: (item[1] + random.randint(0, 3), random.random()))
+    next_sequence = {user_id: 0 for user_id in range(users)}
+    tasks = []
+    for user_id, _ in arrivals:
+        sequence = next_sequence[user_id]
+        next_sequence[user_id] += 1
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+        tasks.append(asyncio.create_task(processor.process_update(update, handle(user_id, sequence))))
+    
+    started = asyncio.get_running_loop().time()
+    await asyncio.gather(*tasks)
+    elapsed = asyncio.get_running_loop().time() - started
+    
+    for user_id, sequences in processed.items():
+        if sequences != list(range(updates_per_user)):
+            violations.append(f"user {user_id}: processed out of order")
+    if peak > max_concurrent_updates:
+        violations.append(f"{peak} handlers ran at once, limit is {max_concurrent_updates}")
+    if processor.waiting_users:
+        violations.append(f"{processor.waiting_users} users left queued")
+    
+    print(f"{len(tasks)} updates from {users} users in {elapsed:.2f}s, "
+          f"peak concurrency {peak}/{max_concurrent_updates}")
+    for violation in violations[:20]:
+        print(f"VIOLATION: {violation}")
+    return not violations
+
+if __name__ == "__main__":
+    import sys
+    
+    ok = asyncio.run(stress_check())
+    print("OK: per-user order held" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -1,35 +1,17 @@
-import qrcode
-import io
 import base64
-from PIL import Image
 from typing import Optional
 from config import UPI_ID, UPI_NAME
+from models import Deal
+from qr_render import render_qr_png
+
+def upi_payment_link(amount: float, deal_id: int) -> str:
+    """Build the UPI payment link encoded in a deal's QR code"""
+    return f"upi://pay?pa={UPI_ID}&pn={UPI_NAME}&am={amount}&tn=Escrow Deal {deal_id}"
 
 def generate_upi_qr(amount: float, deal_id: int) -> bytes:
-    """Generate UPI QR code for payment"""
+    """Generate UPI QR code for payment (blocking; the bot uses QRRenderPool)"""
     try:
-        # Create UPI payment link
-        upi_link = f"upi://pay?pa={UPI_ID}&pn={UPI_NAME}&am={amount}&tn=Escrow Deal {deal_id}"
-        
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(upi_link)
-        qr.make(fit=True)
-        
-        # Create image
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to bytes
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        return img_buffer.getvalue()
+        return render_qr_png(upi_payment_link(amount, deal_id))
     except Exception as e:
         print(f"Error generating QR code: {e}")
         return None
@@ -38,7 +20,7 @@ def format_amount(amount: float) -> str:
     """Format amount for display"""
     return f"₹{amount:,.2f}"
 
-def format_deal_info(deal: dict) -> str:
+def format_deal_info(deal: Deal) -> str:
     """Format deal information for display"""
     status_emoji = {
         "created": "🆕",
@@ -50,15 +32,15 @@ def format_deal_info(deal: dict) -> str:
         "cancelled": "❌"
     }
     
-    emoji = status_emoji.get(deal['status'], "❓")
-    amount = format_amount(deal['amount'])
+    emoji = status_emoji.get(deal.status, "❓")
+    amount = format_amount(deal.amount)
     
     return f"""
-{emoji} **Deal #{deal['deal_id']}**
+{emoji} **Deal #{deal.deal_id}**
 Amount: {amount}
-Party B: @{deal['party_b_username']}
-Status: {deal['status'].replace('_', ' ').title()}
-Description: {deal['description'][:100]}{'...' if len(deal['description']) > 100 else ''}
+Party B: @{deal.party_b_username}
+Status: {deal.status.replace('_', ' ').title()}
+Description: {deal.description[:100]}{'...' if len(deal.description) > 100 else ''}
 """
 
 def validate_username(username: str) -> bool:
@@ -99,44 +81,58 @@ def get_trust_rating_display(rating: float, total_deals: int) -> str:
     stars = "⭐" * int(rating)
     return f"{stars} {rating:.1f}/5.0 ({total_deals} deals)"
 
-def create_payment_keyboard():
-    """Create payment confirmation keyboard"""
+def create_payment_keyboard(deal_id: int):
+    """Create payment confirmation keyboard for a deal"""
     from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     
     keyboard = [
-        [InlineKeyboardButton("💳 Payment Done", callback_data="payment_done")],
-        [InlineKeyboardButton("❌ Cancel Deal", callback_data="cancel_deal")]
+        [InlineKeyboardButton("💳 Payment Done", callback_data=f"payment_done:{deal_id}")],
+        [InlineKeyboardButton("❌ Cancel Deal", callback_data=f"cancel_deal:{deal_id}")]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def create_delivery_keyboard():
-    """Create delivery confirmation keyboard"""
+def create_delivery_keyboard(deal_id: int):
+    """Create delivery confirmation keyboard for a deal"""
     from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     
     keyboard = [
-        [InlineKeyboardButton("✅ Confirm Delivery", callback_data="confirm_delivery")],
-        [InlineKeyboardButton("🚨 Raise Dispute", callback_data="raise_dispute")]
+        [InlineKeyboardButton("✅ Confirm Delivery", callback_data=f"confirm_delivery:{deal_id}")],
+        [InlineKeyboardButton("🚨 Raise Dispute", callback_data=f"raise_dispute:{deal_id}")]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def create_rating_keyboard():
-    """Create trust rating keyboard"""
+def create_rating_keyboard(deal_id: int):
+    """Create trust rating keyboard for a deal"""
     from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     
     keyboard = []
     for i in range(1, 6):
         stars = "⭐" * i
-        keyboard.append([InlineKeyboardButton(f"{stars} {i}/5", callback_data=f"rate_{i}")])
+        keyboard.append([InlineKeyboardButton(f"{stars} {i}/5", callback_data=f"rate:{deal_id}:{i}")])
     
     return InlineKeyboardMarkup(keyboard)
 
-def create_admin_keyboard():
-    """Create admin action keyboard"""
+def create_status_page_keyboard(first_deal_id: int, last_deal_id: int, has_previous: bool, has_next: bool):
+    """Create /status pagination keyboard"""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    
+    buttons = []
+    if has_previous:
+        buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"status:prev:{first_deal_id}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"status:next:{last_deal_id}"))
+    
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup([buttons])
+
+def create_admin_keyboard(deal_id: int):
+    """Create admin action keyboard for a deal"""
     from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     
     keyboard = [
-        [InlineKeyboardButton("✅ Confirm Payment", callback_data="admin_confirm")],
-        [InlineKeyboardButton("❌ Reject Payment", callback_data="admin_reject")],
-        [InlineKeyboardButton("📊 View Details", callback_data="admin_details")]
+        [InlineKeyboardButton("✅ Confirm Payment", callback_data=f"admin_confirm:{deal_id}")],
+        [InlineKeyboardButton("❌ Reject Payment", callback_data=f"admin_reject:{deal_id}")],
+        [InlineKeyboardButton("📊 View Details", callback_data=f"admin_details:{deal_id}")]
     ]
     return InlineKeyboardMarkup(keyboard)
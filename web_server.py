@@ -1,7 +1,8 @@
 import threading
 import asyncio
-from bot import EscrowBot
-from admin import run_admin_server
+from bot import main as bot_main
+from admin_server import AdminServerProcess
+from config import ADMIN_SERVER_MODE
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,15 +10,16 @@ logger = logging.getLogger(__name__)
 def run_bot():
     """Run the Telegram bot in an async event loop"""
     try:
-        bot = EscrowBot()
-        asyncio.run(bot.initialize())
-        asyncio.run(bot.start_polling())
+        # Initialize and run on one loop: the notification workers and the
+        # stats reconcile task started by initialize() live on it
+        asyncio.run(bot_main())
     except Exception as e:
         logger.error(f"Bot error: {e}")
 
 def run_web_server():
     """Run the Flask web server"""
     try:
+        from admin import run_admin_server
         run_admin_server()
     except Exception as e:
         logger.error(f"Web server error: {e}")
@@ -32,14 +34,24 @@ def main():
     
     logger.info("Starting Escrow Bot with Admin Panel...")
     
-    # Start web server in a separate thread
-    web_thread = threading.Thread(target=run_web_server, daemon=True)
-    web_thread.start()
+    admin_server = None
+    if ADMIN_SERVER_MODE == "process":
+        # Serve the admin panel from its own worker processes
+        admin_server = AdminServerProcess()
+        admin_server.start()
+    elif ADMIN_SERVER_MODE == "thread":
+        # Start web server in a separate thread
+        web_thread = threading.Thread(target=run_web_server, daemon=True)
+        web_thread.start()
     
     logger.info("Web server started on http://0.0.0.0:5000")
     
     # Run bot in main thread
-    run_bot()
+    try:
+        run_bot()
+    finally:
+        if admin_server:
+            admin_server.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,161 @@
+import asyncio
+import hmac
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from config import WEBHOOK_MAX_BODY, WEBHOOK_IDLE_TIMEOUT, WEBHOOK_REQUEST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    500: "Internal Server Error"
+}
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+class WebhookServer:
+    """Minimal asyncio HTTP/1.1 endpoint that receives Telegram webhook updates.
+    
+    Each POST to path carrying the expected secret token header is decoded
+    and handed to process_update, and Telegram gets its 200 as soon as the
+    update is queued. Connections are kept alive between requests, and a
+    client that takes longer than request_timeout to send a request's
+    headers and body gets a 408 and is disconnected. If
+    record_path is set, every accepted update is appended to it as one JSON
+    line, for replay with webhook_harness.py.
+    """
+    
+    def __init__(self, process_update: Callable[[Dict[str, Any]], Awaitable[None]],
+                 host: str, port: int, path: str, secret_token: Optional[str] = None,
+                 record_path: Optional[str] = None, max_body: int = WEBHOOK_MAX_BODY,
+                 idle_timeout: float = WEBHOOK_IDLE_TIMEOUT,
+                 request_timeout: float = WEBHOOK_REQUEST_TIMEOUT):
+        self.process_update = process_update
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.record_path = record_path
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+        self._server = None
+        self._record_file = None
+        self.received = 0
+        self.rejected = 0
+    
+    async def start(self):
+        """Start listening"""
+        if self.record_path:
+            self._record_file = open(self.record_path, "a", encoding="utf-8")
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+    
+    async def stop(self):
+        """Stop accepting connections and close the recording file"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._record_file:
+            self._record_file.close()
+            self._record_file = None
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+                
+                try:
+                    headers, error, body = await asyncio.wait_for(
+                        self._read_request(reader), self.request_timeout
+                    )
+                except asyncio.TimeoutError:
+                    await self._respond(writer, 408, keep_alive=False)
+                    break
+                if error:
+                    await self._respond(writer, error, keep_alive=False)
+                    break
+                
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status = await self._dispatch(method, target, headers, body)
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[Dict[str, str], Optional[int], bytes]:
+        """Read the headers and body after a request line; the status to reject it with, if any"""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            return headers, 400, b""
+        if length > self.max_body:
+            return headers, 413, b""
+        body = await reader.readexactly(length) if length else b""
+        return headers, None, body
+    
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> int:
+        if target.split("?", 1)[0] != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            self.rejected += 1
+            logger.warning("Rejected webhook request with a missing or wrong secret token")
+            return 403
+        
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(data, dict):
+            return 400
+        
+        try:
+            await self.process_update(data)
+        except Exception as e:
+            # Non-2xx makes Telegram deliver the update again later
+            logger.error(f"Error queueing webhook update: {e}")
+            return 500
+        
+        self.received += 1
+        if self._record_file:
+            self._record_file.write(json.dumps(data) + "\n")
+        return 200
+    
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"\r\n".encode("latin-1")
+        )
+        await writer.drain()
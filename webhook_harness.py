@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Webhook load harness - stands in for Telegram by POSTing recorded updates
+to the bot's webhook endpoint and reporting latency and throughput.
+
+Record real traffic by running the bot with WEBHOOK_RECORD_PATH set, or
+let the harness generate synthetic /help messages.
+
+Usage:
+    python webhook_harness.py --updates updates.jsonl --concurrency 8
+    python webhook_harness.py --count 5000 --serve   # measure the endpoint alone
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN
+from webhook import WebhookServer, SECRET_HEADER
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    """Load one update per line from a recording"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def synthetic_updates(count: int) -> List[Dict[str, Any]]:
+    """Build /help messages from count distinct users"""
+    updates = []
+    for index in range(count):
+        user = {"id": 100000 + index, "is_bot": False, "first_name": f"Load{index}", "username": f"load{index}"}
+        updates.append({
+            "update_id": index + 1,
+            "message": {
+                "message_id": index + 1,
+                "date": int(time.time()),
+                "chat": {"id": user["id"], "type": "private", "first_name": user["first_name"]},
+                "from": user,
+                "text": "/help",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 5}]
+            }
+        })
+    return updates
+
+def build_requests(updates: List[Dict[str, Any]], repeat: int, host: str, path: str, secret: str) -> List[bytes]:
+    """Encode each update as a raw HTTP request, renumbering repeats so none look duplicated"""
+    max_update_id = max((update.get("update_id", 0) for update in updates), default=0)
+    requests = []
+    for round_index in range(repeat):
+        for update in updates:
+            update = dict(update, update_id=update.get("update_id", 0) + round_index * max_update_id)
+            body = json.dumps(update).encode()
+            head = (
+                f"POST {path} HTTP/1.1\r\n"
+                f"Host: {host}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                + (f"{SECRET_HEADER}: {secret}\r\n" if secret else "")
+                + "\r\n"
+            )
+            requests.append(head.encode("latin-1") + body)
+    return requests
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    """Read one response and return its status code"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+async def run_client(host: str, port: int, requests: List[bytes], concurrency: int) -> Dict[str, Any]:
+    """Send all requests over concurrency keep-alive connections"""
+    pending = iter(requests)
+    latencies = []
+    statuses = {}
+    
+    async def worker():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for request in pending:
+                started = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                status = await read_response(reader)
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+    
+    return {
+        "requests": len(latencies),
+        "statuses": statuses,
+        "seconds": elapsed,
+        "per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(0.50) if latencies else 0.0,
+        "p90_ms": percentile(0.90) if latencies else 0.0,
+        "p99_ms": percentile(0.99) if latencies else 0.0,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay updates against the webhook endpoint")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}",
+                        help="Webhook endpoint (default: the configured local endpoint)")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET_TOKEN, help="Secret token header value")
+    parser.add_argument("--updates", help="JSON-lines file of recorded updates")
+    parser.add_argument("--count", type=int, default=1000, help="Synthetic updates when --updates is not given")
+    parser.add_argument("--repeat", type=int, default=1, help="Times to replay the updates")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel connections")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run a local endpoint that only counts updates, to measure the server alone")
+    args = parser.parse_args()
+    
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.count)
+    requests = build_requests(updates, args.repeat, url.netloc, url.path, args.secret)
+    
+    server = None
+    if args.serve:
+        async def discard(data):
+            pass
+        server = WebhookServer(discard, host, port, url.path, secret_token=args.secret or None)
+        await server.start()
+    
+    try:
+        results = await run_client(host, port, requests, args.concurrency)
+    finally:
+        if server:
+            await server.stop()
+    
+    print(f"Requests:   {results['requests']} in {results['seconds']:.2f}s "
+          f"({results['per_second']:.0f}/s, {args.concurrency} connections)")
+    print(f"Statuses:   {results['statuses']}")
+    print(f"Latency ms: mean {results['mean_ms']:.2f}  p50 {results['p50_ms']:.2f}  "
+          f"p90 {results['p90_ms']:.2f}  p99 {results['p99_ms']:.2f}  max {results['max_ms']:.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())